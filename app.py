@@ -0,0 +1,80 @@
+"""
+Bootcamp GenAI launcher
+Every Streamlit app as a page of one process: `streamlit run app.py`.
+A page's script, and with it the SDK it uses, is only run the first time
+someone opens it. Clients, pools and caches are module-level singletons, so
+all pages share the same warm ones. The sidebar shows what each page cost to
+load and how much memory the process holds.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import streamlit as st
+
+import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PAGES = [
+    ("chatbot.py", "Chatbot", "💬"),
+    ("poetry.py", "Poetry", "📝"),
+    ("ruskin_stories.py", "Ruskin Bond stories", "📚"),
+    ("code-generation.py", "Code completion", "💻"),
+    ("langchain.py", "LangChain QA", "🦜"),
+    ("gemini_chat.py", "Gemini chat", "✨"),
+    ("cook.py", "Recipe generator", "🍳"),
+]
+
+# Background work (story pool, model preloads) started from a page is labelled as the launcher
+metrics.set_app_name("app")
+
+
+@st.cache_resource
+def page_loads():
+    """Page title -> (seconds, modules imported) of its first run in this process"""
+    # This script reruns on every interaction, so process-wide state lives in the resource cache
+    return {}, threading.Lock()
+
+
+def run(page):
+    """Run the page, timing it if this is the first time the process runs it"""
+    loads, lock = page_loads()
+    with lock:
+        first = page.title not in loads
+        if first:
+            loads[page.title] = None
+    if not first:
+        page.run()
+        return
+    modules = len(sys.modules)
+    started = time.perf_counter()
+    try:
+        page.run()
+    finally:
+        # st.rerun() and st.stop() end a run by raising; the imports happened either way
+        seconds = time.perf_counter() - started
+        imported = len(sys.modules) - modules
+        loads[page.title] = (seconds, imported)
+        metrics.record_page_load(page.title, seconds, imported)
+
+
+def startup_report():
+    loads, _ = page_loads()
+    with st.sidebar.expander("⏱️ Startup cost"):
+        rss = metrics.rss_bytes()
+        if rss is not None:
+            st.caption(f"Resident memory: {rss / 2 ** 20:.0f} MiB")
+        loaded = {title: load for title, load in loads.items() if load is not None}
+        if not loaded:
+            st.caption("No page loaded yet")
+        for title, (seconds, modules) in loaded.items():
+            st.caption(f"{title}: {seconds:.2f}s, {modules} modules")
+
+
+page = st.navigation([st.Page(os.path.join(ROOT, script), title=title, icon=icon)
+                      for script, title, icon in PAGES])
+run(page)
+startup_report()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Async serving engine for the Ollama web UI
+Same page and API as ollama_webui.py, served by aiohttp on one event loop.
+Upstream generations go through a non-blocking client, wait in bounded
+per-model queues and share a fixed number of slots per backend; when a
+queue is full the request is turned away at once with 429 + Retry-After.
+
+Run with: python ollama_webui.py --async   (or python async_engine.py)
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+import weakref
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+
+import aiohttp
+from aiohttp import web
+
+import metrics
+import model_catalog
+import ollama_webui as webui
+from model_residency import get_residency_manager
+from ollama_balancer import OLLAMA_HOSTS
+from ollama_client import CONNECT_TIMEOUT, OLLAMA_API, POOL_SIZE, READ_TIMEOUT, get_client
+from scheduler import Scheduler
+from semantic_cache import SEMANTIC_CACHE, get_semantic_cache
+from singleflight import AsyncSingleFlight, flight_key
+
+MAX_CONCURRENT = int(os.getenv("OLLAMA_MAX_CONCURRENT", "2"))
+MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "32"))
+WAIT_SAMPLES = 1000
+
+
+class Overloaded(Exception):
+    """The model's queue is full; retry after `retry_after` seconds"""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"{model} queue is full")
+        self.retry_after = retry_after
+
+
+def _percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdmissionController:
+    """Bounded per-model queues in front of a per-backend concurrency cap"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._slots = {}
+        self.queued = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.waits = defaultdict(lambda: deque(maxlen=WAIT_SAMPLES))
+        # Moving average of how long a generation holds its slot
+        self.service_seconds = 5.0
+
+    def retry_after(self, model):
+        backlog = self.queued[model] + self.in_flight[model]
+        return max(1, math.ceil(backlog * self.service_seconds / self.max_concurrent))
+
+    @asynccontextmanager
+    async def slot(self, model, backend=OLLAMA_API, priority=None, client_id=None):
+        """Wait for a generation slot on `backend`; raises Overloaded if the queue is full.
+
+        Waiting requests are served by `priority` class and fairly between
+        clients (see scheduler.py) rather than first come, first served.
+        """
+        if self.queued[model] >= self.max_queue:
+            self.rejected[model] += 1
+            raise Overloaded(model, self.retry_after(model))
+        slots = self._slots.get(backend)
+        if slots is None:
+            slots = self._slots[backend] = Scheduler(self.max_concurrent, name=backend)
+
+        self.queued[model] += 1
+        queued_at = time.monotonic()
+        try:
+            await slots.acquire_async(priority, client_id)
+        finally:
+            self.queued[model] -= 1
+        started = time.monotonic()
+        self.waits[model].append(started - queued_at)
+
+        self.in_flight[model] += 1
+        try:
+            yield started - queued_at
+        finally:
+            self.in_flight[model] -= 1
+            slots.release()
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * (time.monotonic() - started)
+
+    def stats(self):
+        models = set(self.queued) | set(self.in_flight) | set(self.waits)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "models": {model: {
+                "queued": self.queued[model],
+                "in_flight": self.in_flight[model],
+                "rejected": self.rejected[model],
+                "wait_p50": round(_percentile(self.waits[model], 0.50), 4),
+                "wait_p95": round(_percentile(self.waits[model], 0.95), 4),
+            } for model in sorted(models)},
+        }
+
+
+admission = AdmissionController()
+# Stands in for the threaded coalescer, so the web UI's /metrics collector
+# reports this engine's flights
+inflight = webui.inflight = AsyncSingleFlight()
+
+
+def collect_admission():
+    stats = admission.stats()["models"]
+    return [
+        ("webui_queue_depth", "gauge", "Requests waiting for a generation slot",
+         [({"model": m}, s["queued"]) for m, s in stats.items()]),
+        ("webui_in_flight", "gauge", "Generations holding a slot",
+         [({"model": m}, s["in_flight"]) for m, s in stats.items()]),
+        ("webui_rejected_total", "counter", "Requests turned away with 429",
+         [({"model": m}, s["rejected"]) for m, s in stats.items()]),
+    ]
+
+
+metrics.REGISTRY.register_collector(collect_admission)
+_session_locks = weakref.WeakValueDictionary()
+
+
+def session_lock(session):
+    """One turn at a time per conversation, without blocking the loop"""
+    lock = _session_locks.get(session.id)
+    if lock is None:
+        lock = _session_locks[session.id] = asyncio.Lock()
+    return lock
+
+
+async def in_thread(func, *args):
+    """Run a blocking helper (embeddings, SQLite) off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def index(request):
+    return web.Response(text=webui.HTML_TEMPLATE, content_type="text/html")
+
+
+async def get_models(request):
+    try:
+        # Only the very first call reaches the backends, and that blocks
+        status, headers, body = await in_thread(model_catalog.http_response, request.headers.get("If-None-Match"),
+                                                request.headers.get("Accept-Encoding"), ("ollama",))
+        return web.Response(body=body, status=status, headers=headers)
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+
+def overloaded_response(e):
+    return web.json_response({"error": str(e), "retry_after": e.retry_after}, status=429,
+                             headers={"Retry-After": str(e.retry_after)})
+
+
+class UpstreamError(Exception):
+    """Ollama answered with an error status"""
+
+
+def pick_backend(model=None, exclude=()):
+    """The balancer's backend for `model` when OLLAMA_HOSTS is set, else None"""
+    return get_client().pick(model, exclude) if OLLAMA_HOSTS else None
+
+
+def produce_generation(client, payload, priority=None, client_id=None):
+    """Producer for one flight: streams /api/generate while holding an admission slot"""
+    model = payload["model"]
+
+    async def stream_from(flight, url):
+        async with admission.slot(model, url, priority, client_id) as queue_wait:
+            started = time.perf_counter()
+            ttft = None
+            async with client.post(f"{url}/api/generate", json={**payload, "stream": True}) as upstream:
+                if upstream.status != 200:
+                    metrics.record_error(model, f"http_{upstream.status}")
+                    raise UpstreamError(f"Ollama API error {upstream.status}")
+                try:
+                    async for line in upstream.content:
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            metrics.record_error(model, "ollama")
+                        elif ttft is None:
+                            ttft = time.perf_counter() - started
+                        if chunk.get("done"):
+                            # Timed from the slot on, like OllamaClient: the wait is queue_wait
+                            metrics.record_response(model, chunk, time.perf_counter() - started,
+                                                    ttft=ttft, queue_wait=queue_wait)
+                        await flight.publish(chunk)
+                except asyncio.CancelledError:
+                    # Nobody follows the flight any more (see AsyncFlight.follow)
+                    generated = sum(1 for c in flight.chunks if not c.get("done"))
+                    metrics.record_cancel(model, generated)
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    metrics.record_error(model, type(e).__name__)
+                    raise
+
+    async def produce(flight):
+        tried = []
+        while True:
+            backend = pick_backend(model, tried)
+            if backend is None:
+                return await stream_from(flight, OLLAMA_API)
+            backend.begin()
+            try:
+                return await stream_from(flight, backend.url)
+            except aiohttp.ClientConnectionError:
+                backend.mark_down()
+                # Fail over only while nothing has been relayed yet
+                if flight.chunks or len(tried) + 1 == len(get_client().backends):
+                    raise
+                tried.append(backend)
+            finally:
+                backend.end()
+
+    return produce
+
+
+def join_generation(request, payload, priority=None, client_id=None):
+    """Follow the upstream generation for `payload`; returns (chunks, leader)"""
+    produce = produce_generation(request.app["client"], payload, priority, client_id)
+    flight, leader = inflight.join(flight_key(payload), produce)
+    return flight.follow(), leader
+
+
+async def finish_turn(session, model, prompt, reply, chunk, fresh, leader):
+    session.add_turn(prompt, reply, chunk.get("context"), model)
+    # Followers got the leader's tokens; count the generation once
+    if leader:
+        get_residency_manager().observe(model, chunk)
+    if fresh and leader and SEMANTIC_CACHE:
+        await in_thread(get_semantic_cache().store, f"webui:{model}", prompt, reply)
+
+
+async def stream_chat(request, session, model, prompt, priority=None):
+    """Relay Ollama's NDJSON token stream as Server-Sent Events"""
+    fresh = not session.messages
+    get_residency_manager().touch(model)
+    chunks, leader = join_generation(request, webui.turn_payload(session, model, prompt), priority, session.id)
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"})
+    reply = ""
+    try:
+        # The response is only started once the first chunk arrives, so a
+        # full queue (Overloaded) still reaches the client as a 429
+        async for chunk in chunks:
+            if not response.prepared:
+                await response.prepare(request)
+            if session.closed:
+                # The chat was cleared mid-answer
+                break
+            if chunk.get("error"):
+                await response.write(webui.sse({"error": chunk["error"]}, event="error").encode())
+                break
+            if chunk.get("done"):
+                await finish_turn(session, model, prompt, reply, chunk, fresh, leader)
+                stats = {k: v for k, v in chunk.items() if k.endswith(("_count", "_duration"))}
+                await response.write(webui.sse({"done": True, "session_id": session.id, **stats}).encode())
+            else:
+                reply += chunk.get("response", "")
+                await response.write(webui.sse({"token": chunk.get("response", "")}).encode())
+    except ConnectionResetError:
+        # The browser went away; the flight carries on only while others follow it
+        raise
+    except (UpstreamError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        if not response.prepared:
+            await response.prepare(request)
+        await response.write(webui.sse({"error": str(e)}, event="error").encode())
+    finally:
+        await chunks.aclose()
+    return response
+
+
+async def chat(request):
+    try:
+        data = await request.json()
+        model = data.get("model")
+        prompt = data.get("prompt")
+        session = webui.sessions.get(data.get("session_id"))
+
+        async with session_lock(session):
+            cached = await in_thread(webui.semantic_lookup, session, model, prompt)
+            if cached is not None:
+                session.add_turn(prompt, cached, None, model)
+                if not data.get("stream"):
+                    return web.json_response({"response": cached, "session_id": session.id, "cached": True})
+                response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+                await response.prepare(request)
+                await response.write(webui.sse({"token": cached}).encode())
+                await response.write(webui.sse({"done": True, "session_id": session.id, "cached": True}).encode())
+                return response
+
+            if data.get("stream"):
+                return await stream_chat(request, session, model, prompt, data.get("priority"))
+
+            fresh = not session.messages
+            get_residency_manager().touch(model)
+            # Non-streamed requests follow the same flights as streamed ones
+            chunks, leader = join_generation(request, webui.turn_payload(session, model, prompt),
+                                             data.get("priority"), session.id)
+            reply = ""
+            try:
+                async for chunk in chunks:
+                    if chunk.get("error"):
+                        return web.json_response({"error": chunk["error"]}, status=500)
+                    if chunk.get("done"):
+                        await finish_turn(session, model, prompt, reply, chunk, fresh, leader)
+                    else:
+                        reply += chunk.get("response", "")
+            finally:
+                await chunks.aclose()
+            return web.json_response({"response": reply, "session_id": session.id})
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def residency(request):
+    try:
+        manager = get_residency_manager()
+        await in_thread(manager.refresh)
+        return web.json_response(manager.stats())
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def backends(request):
+    if not OLLAMA_HOSTS:
+        return web.json_response({OLLAMA_API: {"healthy": True}})
+    return web.json_response(get_client().stats())
+
+
+async def queue_stats(request):
+    return web.json_response(admission.stats())
+
+
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def clear_session(request):
+    session_id = request.match_info["session_id"]
+    webui.sessions.drop(session_id)
+    return web.json_response({"cleared": session_id})
+
+
+async def _client_ctx(app):
+    connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    app["client"] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    yield
+    await app["client"].close()
+
+
+def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(_client_ctx)
+    app.router.add_get("/", index)
+    app.router.add_get("/api/models", get_models)
+    app.router.add_post("/api/chat", chat)
+    app.router.add_get("/api/residency", residency)
+    app.router.add_get("/api/queue", queue_stats)
+    app.router.add_get("/api/backends", backends)
+    app.router.add_get("/metrics", prometheus_metrics)
+    app.router.add_delete("/api/session/{session_id}", clear_session)
+    return app
+
+
+def serve(host="0.0.0.0", port=8080):
+    get_residency_manager()
+    model_catalog.get_model_catalog().start("ollama")
+    web.run_app(create_app(), host=host, port=port, print=None)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Batch generation CLI
+Drains a JSONL file of jobs through Ollama with bounded concurrency.
+
+Each input line is one job:
+    {"id": "p1", "task": "poem", "topic": "rain", "model": "tinyllama", "options": {"temperature": 0.7}}
+
+Tasks and their inputs:
+    poem    topic
+    story   theme
+    code    code, language, instructions (optional)
+    recipe  dish
+    chat    messages (list of {role, content}) or prompt
+
+Results are appended to the output JSONL as they finish. Re-running with the
+same output file skips every id that already has an "ok" result.
+
+Usage: python batch_generate.py jobs.jsonl -o results.jsonl --concurrency 8 --per-model 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import scheduler
+from ollama_balancer import BalancedClient
+from ollama_client import OLLAMA_API, OllamaClient
+from prompts import code_completion_prompt, poem_prompt, recipe_prompt, story_prompt
+
+DEFAULT_MODEL = "tinyllama"
+
+TIMING_FIELDS = ("total_duration", "load_duration", "prompt_eval_count",
+                 "prompt_eval_duration", "eval_count", "eval_duration")
+
+# task -> (prompt builder, default options); the same prompts the apps use
+TASKS = {
+    "poem": (lambda job: poem_prompt(job["topic"]), {}),
+    "story": (lambda job: story_prompt(job["theme"]), {"temperature": 0.8, "top_p": 0.9}),
+    "code": (lambda job: code_completion_prompt(job.get("language", "Python"), job["code"],
+                                                job.get("instructions", "")), {}),
+    "recipe": (lambda job: recipe_prompt(job["dish"]), {}),
+    "chat": (None, {}),
+}
+
+
+def read_jobs(path):
+    """Yield jobs one at a time so the input file is never fully loaded.
+
+    A line that isn't a JSON object comes out as a job with an "invalid"
+    message, to be recorded as an error instead of ending the run.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                job = {"invalid": f"invalid JSON: {e}"}
+            if not isinstance(job, dict):
+                job = {"invalid": "not a JSON object"}
+            job.setdefault("id", f"line-{line_no}")
+            yield job
+
+
+def completed_ids(path):
+    """Ids that already have a successful result in the output file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a half-written last line
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def run_job(client, job):
+    """Run one job and return its result record"""
+    task = job.get("task")
+    model = job.get("model", DEFAULT_MODEL)
+    if task not in TASKS:
+        raise ValueError(f"unknown task: {task!r}")
+    build_prompt, default_options = TASKS[task]
+    options = {**default_options, **job.get("options", {})}
+
+    if task == "chat":
+        messages = job.get("messages") or [{"role": "user", "content": job["prompt"]}]
+        payload = {"model": model, "messages": messages, "stream": False, "options": options}
+        response = client.post("/api/chat", json=payload)
+    else:
+        payload = {"model": model, "prompt": build_prompt(job), "stream": False, "options": options}
+        response = client.post("/api/generate", json=payload)
+    response.raise_for_status()
+    result = response.json()
+
+    text = result["message"]["content"] if task == "chat" else result["response"]
+    record = {"id": job["id"], "task": task, "model": model, "status": "ok", "response": text}
+    record.update({k: result[k] for k in TIMING_FIELDS if k in result})
+    return record
+
+
+class BatchRunner:
+    """Runs jobs with a global concurrency limit and per-model in-flight caps.
+
+    Jobs wait in a queue per model and only take a global slot once their
+    model has room, so a busy model's backlog never holds slots that
+    other models' jobs could use.
+    """
+
+    def __init__(self, client, output, concurrency=4, per_model=2, buffered=None):
+        self.client = client
+        self.output = output
+        self.concurrency = concurrency
+        self.per_model = per_model
+        # Jobs read ahead of the running ones, so other models' jobs can be found
+        self.buffered = buffered or 4 * concurrency
+        self.waiting = defaultdict(deque)
+        self.queued = 0
+        self.running = 0
+        self.running_by_model = defaultdict(int)
+        self.pool = None
+        self.cond = threading.Condition()
+        self.lock = threading.Lock()
+        self.counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    def _dispatch(self):
+        """Start waiting jobs whose model has room, one model at a time in turn (call with cond held)"""
+        started = True
+        while started and self.running < self.concurrency:
+            started = False
+            for model, queue in self.waiting.items():
+                if queue and self.running < self.concurrency and self.running_by_model[model] < self.per_model:
+                    self.queued -= 1
+                    self.running += 1
+                    self.running_by_model[model] += 1
+                    self.pool.submit(self._work, queue.popleft())
+                    started = True
+        self.cond.notify_all()
+
+    def _write(self, record):
+        with self.lock:
+            self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.output.flush()
+            self.counts[record["status"]] += 1
+
+    def _work(self, job):
+        model = job.get("model", DEFAULT_MODEL)
+        started = time.perf_counter()
+        try:
+            record = run_job(self.client, job)
+        except Exception as e:
+            record = {"id": job["id"], "task": job.get("task"), "model": model,
+                      "status": "error", "error": str(e)}
+        finally:
+            with self.cond:
+                self.running -= 1
+                self.running_by_model[model] -= 1
+                self._dispatch()
+        record["elapsed"] = round(time.perf_counter() - started, 3)
+        self._write(record)
+
+    def run(self, jobs, skip=()):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            self.pool = pool
+            for job in jobs:
+                if job["id"] in skip:
+                    self.counts["skipped"] += 1
+                    continue
+                if "invalid" in job:
+                    self._write({"id": job["id"], "task": None, "model": None,
+                                 "status": "error", "error": job["invalid"]})
+                    continue
+                with self.cond:
+                    # Block the reader instead of queueing the whole file in memory
+                    self.cond.wait_for(lambda: self.queued < self.buffered)
+                    self.waiting[job.get("model", DEFAULT_MODEL)].append(job)
+                    self.queued += 1
+                    self._dispatch()
+            with self.cond:
+                self.cond.wait_for(lambda: not self.queued)
+        return self.counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of generation jobs through Ollama")
+    parser.add_argument("input", help="JSONL file of jobs")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="max jobs in flight (default: 4, or 2 per host if more)")
+    parser.add_argument("--per-model", type=int, default=2, help="max jobs in flight per model")
+    parser.add_argument("--host", default=OLLAMA_API,
+                        help="Ollama base URL, or a comma-separated list to balance over")
+    args = parser.parse_args(argv)
+    metrics.set_app_name("batch")
+    # Share the backend with live users instead of crowding them out
+    scheduler.set_default_priority("batch")
+
+    skip = completed_ids(args.output)
+    hosts = [h.strip() for h in args.host.split(",") if h.strip()]
+    args.concurrency = args.concurrency or max(4, 2 * len(hosts))
+    # Every generation in this process waits for a scheduler slot; the job
+    # limits here are the ones that should apply, not SCHEDULER_SLOTS
+    scheduler.get_scheduler().resize(args.concurrency)
+    if len(hosts) > 1:
+        client = BalancedClient(hosts, pool_size=args.concurrency).start()
+    else:
+        client = OllamaClient(args.host, pool_size=args.concurrency)
+    started = time.perf_counter()
+    with open(args.output, "a", encoding="utf-8") as output:
+        runner = BatchRunner(client, output, args.concurrency, args.per_model)
+        counts = runner.run(read_jobs(args.input), skip)
+    elapsed = time.perf_counter() - started
+
+    print(f"ok={counts['ok']} error={counts['error']} skipped={counts['skipped']} "
+          f"in {elapsed:.1f}s", file=sys.stderr)
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Stub Ollama and Gemini server for benchmarks
+Speaks enough of both APIs for every app in this repo (/api/generate,
+/api/chat, /api/tags, /api/ps, /api/show, /api/embeddings, /api/embed and Gemini's
+generateContent / streamGenerateContent / models) with a configurable model
+load delay, time to first token and generation speed, so timings don't
+depend on what a real server happens to have loaded.
+
+Instead of synthetic text it can replay streams recorded from Ollama, with
+their original pacing:
+
+    curl -N localhost:11434/api/generate -d '{"model": "tinyllama", "prompt": "..."}' > recorded/story.ndjson
+    python bench_stub_server.py --replay recorded/
+
+Usage: python bench_stub_server.py --port 11435 --load-delay 2 --ttft 0.2 --tokens-per-second 40
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+WORDS = ("the mist rolled down from the deodars and the old road to the bazaar was quiet "
+         "except for a dog asleep in the sun and the bells of a mule train far below").split()
+CODE_REPLY = '''```python
+def solution(values):
+    """Return the running total of values"""
+    total = 0
+    result = []
+    for value in values:
+        total += value
+        result.append(total)
+    return result
+```
+
+This keeps a running total and appends it after each value, so the result has the same length as the input.'''
+EMBED_DIM = 256
+MODEL_SIZE = 637700138
+
+
+def tokenize(text):
+    """Split text into word-sized pieces that join back into it"""
+    return re.findall(r"\s*\S+|\s+", text)
+
+
+def synthetic_tokens(prompt, count):
+    # Code prompts get a fenced block followed by an explanation, like a real model
+    if "```" in prompt:
+        return tokenize(CODE_REPLY)
+    return [(" " if i else "") + word for i, word in zip(range(count), itertools.cycle(WORDS))]
+
+
+def _timestamp(value):
+    # Ollama writes nanoseconds, which fromisoformat doesn't take
+    head, _, frac = value.rstrip("Z").partition(".")
+    return datetime.fromisoformat(head).timestamp() + float("0." + (frac or "0"))
+
+
+def load_recordings(path):
+    """Recorded Ollama streams as lists of (token, seconds since the previous token)"""
+    files = [os.path.join(path, f) for f in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    recordings = []
+    for name in files:
+        tokens, previous = [], None
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("done"):
+                    break
+                text = chunk.get("response", chunk.get("message", {}).get("content", ""))
+                at = _timestamp(chunk["created_at"]) if chunk.get("created_at") else None
+                gap = at - previous if at is not None and previous is not None else None
+                previous = at
+                tokens.append((text, gap))
+        if tokens:
+            recordings.append(tokens)
+    return recordings
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, load_delay=0.0, ttft=0.05, tokens_per_second=50.0, tokens=120,
+                 parallel=4, models=("tinyllama:latest",), replay=None):
+        super().__init__(address, StubHandler)
+        self.load_delay = load_delay
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.models = list(models)
+        self.recordings = load_recordings(replay) if replay else []
+        self._replay = itertools.cycle(self.recordings) if self.recordings else None
+        # Like OLLAMA_NUM_PARALLEL: requests beyond this wait for a free slot
+        self.slots = threading.Semaphore(parallel)
+        self.loaded = set()
+        self.requests = {}
+        self.aborted = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def handle_error(self, request, client_address):
+        # Clients closing a stream early (cancellations, fence stops) are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def load(self, model, keep_alive=None):
+        """Seconds spent loading `model`; concurrent first requests share one load"""
+        name = model if ":" in model else f"{model}:latest"
+        if keep_alive in (0, "0", "0s"):
+            self.loaded.discard(name)
+            return 0.0
+        with self._lock:
+            lock = self._load_locks.setdefault(name, threading.Lock())
+        started = time.perf_counter()
+        with lock:
+            if name not in self.loaded:
+                time.sleep(self.load_delay)
+                self.loaded.add(name)
+        return time.perf_counter() - started
+
+    def plan(self, prompt, options):
+        """Tokens to send as (text, delay before it), cut at any stop sequence"""
+        if self._replay is not None:
+            with self._lock:
+                recording = next(self._replay)
+            steps = [(text, self.ttft if i == 0 else gap) for i, (text, gap) in enumerate(recording)]
+        else:
+            count = int(options.get("num_predict") or self.tokens)
+            steps = [(text, self.ttft if i == 0 else None)
+                     for i, text in enumerate(synthetic_tokens(prompt, count)[:count])]
+        interval = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        steps = [(text, interval if delay is None else delay) for text, delay in steps]
+
+        stops = options.get("stop") or []
+        if not stops:
+            return steps, False
+        text = ""
+        for i, (token, _) in enumerate(steps):
+            text += token
+            found = [text.find(stop) for stop in stops if stop in text]
+            if not found:
+                continue
+            # Ollama drops the stop sequence and everything after it
+            cut, kept, length = min(found), [], 0
+            for piece, delay in steps[:i + 1]:
+                if length + len(piece) > cut:
+                    if cut > length:
+                        kept.append((piece[:cut - length], delay))
+                    break
+                kept.append((piece, delay))
+                length += len(piece)
+            return kept, True
+        return steps, False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.server.count(path)
+        if path == "/api/tags":
+            self._json({"models": [{"name": m, "model": m, "size": MODEL_SIZE,
+                                    "digest": hashlib.sha256(m.encode()).hexdigest()}
+                                   for m in self.server.models]})
+        elif path == "/api/ps":
+            self._json({"models": [{"name": m, "model": m, "size": MODEL_SIZE, "size_vram": MODEL_SIZE}
+                                   for m in sorted(self.server.loaded)]})
+        elif path.startswith("/v1beta/models"):
+            self._json({"models": [{"name": f"models/{m.split(':')[0]}", "displayName": m,
+                                    "supportedGenerationMethods": ["generateContent"]}
+                                   for m in self.server.models]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        self.server.count(path)
+        body = self._body()
+        try:
+            if path in ("/api/generate", "/api/chat"):
+                self._generate(path, body)
+            elif path == "/api/show":
+                self._json({"capabilities": ["completion"], "details": {"format": "gguf"}})
+            elif path in ("/api/embeddings", "/api/embed"):
+                self._embed(path, body)
+            elif path.startswith("/v1beta/models/"):
+                self._gemini(path, body)
+            else:
+                self._json({"error": "not found"}, 404)
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server._lock:
+                self.server.aborted += 1
+
+    def _generate(self, path, body):
+        model = body.get("model", "")
+        load = self.server.load(model, body.get("keep_alive"))
+        chat = path == "/api/chat"
+        if chat:
+            prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        else:
+            prompt = body.get("prompt", "")
+        if not prompt:
+            # An empty prompt only loads or unloads the model
+            return self._json({"model": model, "response": "", "done": True, "done_reason": "load"})
+
+        options = body.get("options") or {}
+        with self.server.slots:
+            started = time.perf_counter()
+            steps, stopped = self.server.plan(prompt, options)
+            limited = not stopped and len(steps) >= int(options.get("num_predict") or self.server.tokens)
+
+            def piece(text):
+                return {"message": {"role": "assistant", "content": text}} if chat else {"response": text}
+
+            def final():
+                total = time.perf_counter() - started
+                prompt_seconds = min(self.server.ttft, total)
+                result = {"model": model, **piece(""), "done": True,
+                          "done_reason": "length" if limited else "stop",
+                          "total_duration": int((total + load) * 1e9), "load_duration": int(load * 1e9),
+                          "prompt_eval_count": len(tokenize(prompt)),
+                          "prompt_eval_duration": int(prompt_seconds * 1e9),
+                          "eval_count": len(steps), "eval_duration": int((total - prompt_seconds) * 1e9)}
+                if not chat:
+                    result["context"] = [1, 2, 3]
+                return result
+
+            if body.get("stream") is False:
+                for _, delay in steps:
+                    time.sleep(delay)
+                result = final()
+                result.update(piece("".join(text for text, _ in steps)))
+                return self._json(result)
+
+            self._start_chunked("application/x-ndjson")
+            for text, delay in steps:
+                time.sleep(delay)
+                self._chunk((json.dumps({"model": model, **piece(text), "done": False}) + "\n").encode())
+            self._chunk((json.dumps(final()) + "\n").encode())
+            self._end_chunked()
+
+    def _embed(self, path, body):
+        def vector(text):
+            digest = b"".join(hashlib.sha256(f"{i}:{text}".encode()).digest() for i in range(EMBED_DIM // 32))
+            return [b / 127.5 - 1 for b in digest]
+
+        if path == "/api/embeddings":
+            return self._json({"embedding": vector(body.get("prompt", ""))})
+        inputs = body.get("input", "")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        self._json({"model": body.get("model"), "embeddings": [vector(text) for text in inputs]})
+
+    def _gemini(self, path, body):
+        model, _, method = path.rsplit("/", 1)[-1].partition(":")
+        prompt = "\n".join(part.get("text", "") for content in body.get("contents", [])
+                           for part in content.get("parts", []))
+        self.server.load(model)
+        config = body.get("generationConfig") or {}
+        with self.server.slots:
+            steps, _ = self.server.plan(prompt, {"num_predict": config.get("maxOutputTokens"),
+                                                 "stop": config.get("stopSequences")})
+
+            def response(text, last=False):
+                result = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+                if last:
+                    result["candidates"][0]["finishReason"] = "STOP"
+                    result["usageMetadata"] = {"promptTokenCount": len(tokenize(prompt)),
+                                               "candidatesTokenCount": len(steps)}
+                return result
+
+            if method != "streamGenerateContent":
+                for _, delay in steps:
+                    time.sleep(delay)
+                return self._json(response("".join(text for text, _ in steps), last=True))
+
+            self._start_chunked("text/event-stream")
+            for i, (text, delay) in enumerate(steps):
+                time.sleep(delay)
+                self._chunk(b"data: " + json.dumps(response(text, i == len(steps) - 1)).encode() + b"\r\n\r\n")
+            self._end_chunked()
+
+
+def start(host="127.0.0.1", port=0, **settings):
+    """Serve in a background thread; port 0 picks a free one (see server.url)"""
+    server = StubServer((host, port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stub Ollama/Gemini server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--load-delay", type=float, default=0.0, help="seconds to load a model on first use")
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per synthetic response")
+    parser.add_argument("--parallel", type=int, default=4, help="generations run at once")
+    parser.add_argument("--models", default="tinyllama:latest,qwen2.5:0.5b",
+                        help="comma-separated models listed by /api/tags")
+    parser.add_argument("--replay", help="recorded NDJSON stream, or a directory of them, to replay")
+    args = parser.parse_args(argv)
+    server = StubServer((args.host, args.port), load_delay=args.load_delay, ttft=args.ttft,
+                        tokens_per_second=args.tokens_per_second, tokens=args.tokens,
+                        parallel=args.parallel, models=args.models.split(","), replay=args.replay)
+    print(f"Stub Ollama/Gemini server on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
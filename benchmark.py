@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite
+Drives the apps' own code paths against bench_stub_server.py (or a live
+Ollama with --target), reports throughput and p50/p95/p99 latency and time
+to first token, and writes the results as JSON so runs can be compared.
+
+Scenarios:
+    chat     chatbot.chat_with_ollama
+    poetry   poetry.generate_poetry
+    story    ruskin_stories.generate_ruskin_bond_story
+    code     code_completion.stream_completion, code-generation.py's single-model path
+    webui    streamed POST /api/chat on ollama_webui.py's Flask app
+    gemini   gemini_client.stream against the stub's Gemini endpoint
+
+Usage: python benchmark.py --requests 20 --concurrency 4 -o bench_results.json
+       python benchmark.py --scenarios webui --concurrency 16 --ttft 0.3 --tokens-per-second 30
+       python benchmark.py --backends 3 --concurrency 12   # through the OLLAMA_HOSTS balancer
+       python benchmark.py --baseline bench_results.json   # exits 1 if anything got worse
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_stub_server
+
+SCENARIOS = ("chat", "poetry", "story", "code", "webui", "gemini")
+MODEL = "tinyllama"
+CODE_MODEL = "qwen2.5:0.5b"
+GEMINI_MODEL = "gemini-2.0-flash"
+INCOMPLETE_CODE = '''def running_total(values):
+    # TODO: return the running totals of values
+'''
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def at(q):
+        # Nearest rank
+        return round(ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))], 4)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "mean": round(sum(ordered) / len(ordered), 4)}
+
+
+def first_token(started):
+    """An on_token callback and the dict it fills with the ttft and a token count"""
+    seen = {"tokens": 0}
+
+    def on_token(token):
+        if not token:
+            return
+        if "ttft" not in seen:
+            seen["ttft"] = time.perf_counter() - started
+        seen["tokens"] += 1
+
+    return seen, on_token
+
+
+# Each scenario runs request `i` started at `started` and returns what it
+# measured: ttft, tokens and ok, or the metrics app label to look them up by
+
+def bench_chat(i, started):
+    from chat_context import ChatWindow
+    from chatbot import chat_with_ollama, failed
+
+    seen, on_token = first_token(started)
+    reply = chat_with_ollama(f"What is a good name for a mountain dog? ({i})", ChatWindow(), on_token)
+    return {**seen, "ok": not failed(reply)}
+
+
+def bench_poetry(i, started):
+    import metrics
+    from poetry import generate_poetry
+
+    # The Streamlit pages don't hand back their tokens; their metrics records carry the timings
+    app = f"bench/poetry/{i}"
+    metrics.set_app_name(app)
+    generate_poetry(f"rain on a tin roof ({i})")
+    return {"app": app}
+
+
+def bench_story(i, started):
+    import metrics
+    from ruskin_stories import generate_ruskin_bond_story
+
+    app = f"bench/story/{i}"
+    metrics.set_app_name(app)
+    generate_ruskin_bond_story(f"an old tree in the mountains ({i})")
+    return {"app": app}
+
+
+def bench_code(i, started):
+    from code_completion import stream_completion
+    from prompts import code_completion_prompt
+
+    seen, on_token = first_token(started)
+    prompt = code_completion_prompt("Python", INCOMPLETE_CODE, f"Request {i}")
+    code = stream_completion(CODE_MODEL, prompt, {"temperature": 0.7, "num_predict": 1000}, on_token=on_token)
+    return {**seen, "ok": bool(code)}
+
+
+def bench_webui(i, started, url):
+    import requests
+
+    seen, on_token = first_token(started)
+    ok = False
+    payload = {"model": MODEL, "prompt": f"Tell me about the hills ({i})", "stream": True}
+    with requests.post(f"{url}/api/chat", json=payload, stream=True, timeout=(3.05, 120)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            event = json.loads(line[len(b"data: "):])
+            if event.get("error"):
+                break
+            on_token(event.get("token"))
+            ok = ok or bool(event.get("done"))
+    return {**seen, "ok": ok}
+
+
+def bench_gemini(i, started):
+    import gemini_client
+
+    seen, on_token = first_token(started)
+    for text in gemini_client.stream(GEMINI_MODEL, f"Write a recipe for dal ({i})"):
+        on_token(text)
+    return {**seen, "ok": seen["tokens"] > 0}
+
+
+def start_webui():
+    """Serve ollama_webui.py's Flask app on a free port; returns its URL"""
+    import threading
+
+    from werkzeug.serving import make_server
+
+    import ollama_webui
+
+    server = make_server("127.0.0.1", 0, ollama_webui.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def run_scenario(scenario, requests, concurrency, warmup):
+    """Results of `requests` calls, `concurrency` at a time, and the seconds they took"""
+    def one(i):
+        started = time.perf_counter()
+        try:
+            result = scenario(i, started)
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        result["latency"] = time.perf_counter() - started
+        return result
+
+    # Warm-up requests load the model and fill connection pools; they aren't counted
+    for i in range(warmup):
+        one(-1 - i)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    return results, time.perf_counter() - started
+
+
+def fill_from_metrics_log(results, path):
+    """Take ttft, token counts and errors of label-tagged results from the metrics log"""
+    records = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            records.setdefault(record.get("app"), []).append(record)
+    for result in results:
+        if "app" not in result:
+            continue
+        done = [r for r in records.get(result.pop("app"), []) if "elapsed" in r]
+        result["ok"] = result.get("ok", True) and bool(done)
+        if done:
+            result["ttft"] = (done[-1].get("ttft") or 0) + (done[-1].get("queue_wait") or 0)
+            result["tokens"] = done[-1].get("eval_count")
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r.get("ok", True)]
+    tokens = sum(r.get("tokens") or 0 for r in ok)
+    errors = sorted({r["error"] for r in results if r.get("error")})
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "tokens_per_second": round(tokens / elapsed, 1) if elapsed else 0.0,
+        "latency": percentiles([r["latency"] for r in ok]),
+        "ttft": percentiles([r["ttft"] for r in ok if r.get("ttft") is not None]),
+        **({"error_samples": errors[:5]} if errors else {}),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as readable lines"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if current["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {current['errors']}")
+        if current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {current['throughput_rps']} req/s")
+        for metric in ("latency", "ttft"):
+            if current[metric] and before.get(metric) and current[metric]["p95"] > before[metric]["p95"] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} p95 {before[metric]['p95']}s -> {current[metric]['p95']}s")
+    return regressions
+
+
+def print_report(results):
+    def fmt(stats, key):
+        return f"{stats[key]:.3f}" if stats else "-"
+
+    print(f"{'scenario':<8} {'ok':>7} {'req/s':>7} {'tok/s':>7}   "
+          f"{'latency p50':>11} {'p95':>6} {'p99':>6}   {'ttft p50':>8} {'p95':>6} {'p99':>6}")
+    for name, s in results["scenarios"].items():
+        lat, ttft = s["latency"], s["ttft"]
+        print(f"{name:<8} {s['requests'] - s['errors']:>3}/{s['requests']:<3} {s['throughput_rps']:>7.2f} "
+              f"{s['tokens_per_second']:>7.1f}   {fmt(lat, 'p50'):>11} {fmt(lat, 'p95'):>6} {fmt(lat, 'p99'):>6}   "
+              f"{fmt(ttft, 'p50'):>8} {fmt(ttft, 'p95'):>6} {fmt(ttft, 'p99'):>6}")
+        for error in s.get("error_samples", []):
+            print(f"         error: {error}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the apps against a stub (or live) Ollama")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=20, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests before each scenario")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON file to write results to")
+    parser.add_argument("--baseline", help="earlier results file; exit 1 if this run is worse")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change against --baseline")
+    parser.add_argument("--target", help="benchmark this Ollama URL instead of starting the stub")
+    stub = parser.add_argument_group("stub server")
+    stub.add_argument("--load-delay", type=float, default=0.0, help="seconds to load a model on first use")
+    stub.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    stub.add_argument("--tokens-per-second", type=float, default=50.0)
+    stub.add_argument("--tokens", type=int, default=120, help="tokens per synthetic response")
+    stub.add_argument("--parallel", type=int, default=4, help="generations the stub runs at once")
+    stub.add_argument("--replay", help="recorded NDJSON stream, or a directory of them, to replay")
+    stub.add_argument("--backends", type=int, default=1,
+                      help="stub servers to start; more than one are balanced over through OLLAMA_HOSTS")
+    args = parser.parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    servers = []
+    if args.target:
+        url = args.target
+    else:
+        servers = [bench_stub_server.start(load_delay=args.load_delay, ttft=args.ttft,
+                                           tokens_per_second=args.tokens_per_second, tokens=args.tokens,
+                                           parallel=args.parallel, replay=args.replay,
+                                           models=(f"{MODEL}:latest", CODE_MODEL))
+                   for _ in range(max(1, args.backends))]
+        url = servers[0].url
+        os.environ["GEMINI_BASE_URL"] = url
+        os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+    # The apps read their settings at import, so everything is configured
+    # before the first of them is imported
+    log = tempfile.NamedTemporaryFile(prefix="bench-metrics-", suffix=".jsonl", delete=False)
+    log.close()
+    os.environ["OLLAMA_HOST"] = url
+    os.environ["METRICS_LOG"] = log.name
+    if len(servers) > 1:
+        os.environ["OLLAMA_HOSTS"] = ",".join(server.url for server in servers)
+    else:
+        os.environ.pop("OLLAMA_HOSTS", None)
+    import metrics
+    metrics.set_app_name("benchmark")
+    # The pages run outside `streamlit run` here; keep its warnings about that quiet
+    from streamlit import config, logger
+    config.set_option("logger.level", "error")
+    logger.set_log_level("error")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    webui_url = start_webui() if "webui" in scenarios else None
+    runners = {
+        "chat": bench_chat, "poetry": bench_poetry, "story": bench_story, "code": bench_code,
+        "webui": lambda i, started: bench_webui(i, started, webui_url), "gemini": bench_gemini,
+    }
+    results = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+               "settings": vars(args), "scenarios": {}}
+    try:
+        for name in scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            runs, elapsed = run_scenario(runners[name], args.requests, args.concurrency, args.warmup)
+            fill_from_metrics_log(runs, log.name)
+            results["scenarios"][name] = summarize(runs, elapsed)
+    finally:
+        os.unlink(log.name)
+        for server in servers:
+            server.shutdown()
+
+    print_report(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Token-budgeted conversation window
+Keeps the messages sent to Ollama's /api/chat under a token budget by
+folding older turns into a running summary.
+"""
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Rough token count; good enough for budgeting without a tokenizer"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ChatWindow:
+    """Sliding window of chat messages with a summary of older turns.
+
+    Ollama keeps the KV cache of the previous request and only evaluates
+    the part of the prompt after the longest shared prefix. The window is
+    therefore append-only between summarizations: each turn adds to the end
+    and the prefix stays byte-identical, so only the new turn is evaluated.
+    When the budget is exceeded, all but the most recent turns are folded
+    into the summary at once, which costs one full re-evaluation and then
+    buys many more incremental turns.
+    """
+
+    def __init__(self, system="You are a helpful assistant.", budget=1536, keep_recent=4):
+        self.system = system
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.summary = ""
+        self.messages = []
+
+    def add(self, role, content):
+        self.messages.append({"role": role, "content": content})
+
+    def tokens(self):
+        return sum(estimate_tokens(m["content"]) for m in self.build())
+
+    def build(self):
+        """Return the message list to send to /api/chat"""
+        system = self.system
+        if self.summary:
+            system += f"\n\nSummary of the conversation so far:\n{self.summary}"
+        return [{"role": "system", "content": system}] + self.messages
+
+    def trim(self, summarize=None):
+        """Fold older turns into the summary until the window fits the budget.
+
+        `summarize(summary, messages)` returns the new summary text; without
+        it the oldest turns are simply dropped.
+        """
+        if self.tokens() <= self.budget or len(self.messages) <= self.keep_recent:
+            return False
+        old = self.messages[:-self.keep_recent]
+        self.messages = self.messages[-self.keep_recent:]
+        if summarize is not None:
+            try:
+                self.summary = summarize(self.summary, old)
+            except Exception:
+                pass
+        # A single huge turn can still blow the budget; drop from the front
+        while self.tokens() > self.budget and len(self.messages) > 1:
+            self.messages.pop(0)
+        return True
+
+    def clear(self):
+        self.summary = ""
+        self.messages = []
@@ -0,0 +1,166 @@
+"""
+Durable chat history for the Streamlit chat apps
+Messages are appended one row at a time to an SQLite file (WAL mode), and a
+browser session holds only the window of recent messages it shows; older
+ones are read a page at a time when asked for. A conversation's random
+token is kept in the page URL, so a reload or a restarted server picks it up
+again; the token is all it takes to read and continue it.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+HISTORY_PATH = os.getenv("CHAT_HISTORY_PATH", os.path.join(os.path.expanduser("~"), ".cache", "bootcamp-genai", "history.db"))
+PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE", "20"))
+# Stored as their index to keep rows small
+ROLES = ("user", "assistant", "system")
+
+
+class ChatHistory:
+    """Conversations and their messages in SQLite"""
+
+    def __init__(self, path=HISTORY_PATH):
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY, app TEXT NOT NULL, created REAL NOT NULL, token TEXT)""")
+        if "token" not in [row[1] for row in self._db.execute("PRAGMA table_info(conversations)")]:
+            # Files from before tokens; their conversations can no longer be opened
+            self._db.execute("ALTER TABLE conversations ADD COLUMN token TEXT")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS conversations_token ON conversations (token)")
+        # The rowid orders messages; (conversation, id) pages through one conversation
+        self._db.execute("""CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY, conversation INTEGER NOT NULL,
+            role INTEGER NOT NULL, content TEXT NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation, id)")
+
+    def new_conversation(self, app):
+        """Start a conversation; returns its id and the token that finds it again.
+
+        Ids are sequential and never leave the server: the token is what a
+        URL carries, so nobody can reach someone else's chat by counting.
+        """
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            conversation = self._db.execute("INSERT INTO conversations (app, created, token) VALUES (?, ?, ?)",
+                                            (app, time.time(), token)).lastrowid
+        return conversation, token
+
+    def find(self, token, app):
+        """The id of `app`'s conversation with `token`, or None"""
+        with self._lock:
+            row = self._db.execute("SELECT id FROM conversations WHERE token = ? AND app = ?",
+                                   (token, app)).fetchone()
+        return row[0] if row else None
+
+    def append(self, conversation, role, content):
+        """Store one message; returns its id"""
+        with self._lock:
+            return self._db.execute("INSERT INTO messages (conversation, role, content) VALUES (?, ?, ?)",
+                                    (conversation, ROLES.index(role), content)).lastrowid
+
+    def page(self, conversation, before=None, limit=PAGE_SIZE):
+        """Up to `limit` messages older than message id `before` (default: the latest), oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, role, content FROM messages WHERE conversation = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?", (conversation, before or 2 ** 63 - 1, limit)).fetchall()
+        return [(id_, ROLES[role], content) for id_, role, content in reversed(rows)]
+
+    def delete(self, conversation):
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE conversation = ?", (conversation,))
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation,))
+
+
+class Transcript:
+    """The part of a conversation one browser session shows: recent messages and their ids"""
+
+    def __init__(self, history, app, conversation=None, token=None, page_size=PAGE_SIZE):
+        self.history = history
+        self.app = app
+        self.conversation = conversation
+        self.token = token
+        self.page_size = page_size
+        self.limit = page_size
+        self.messages = []
+        self.has_older = False
+        if conversation is not None:
+            # One extra row tells whether there is anything older
+            self.messages = history.page(conversation, limit=page_size + 1)
+            self.has_older = len(self.messages) > page_size
+            self.messages = self.messages[-page_size:]
+
+    def append(self, role, content):
+        if self.conversation is None:
+            # Created with the first message, so idle page loads leave nothing behind
+            self.conversation, self.token = self.history.new_conversation(self.app)
+            st.query_params["c"] = self.token
+        message_id = self.history.append(self.conversation, role, content)
+        self.messages.append((message_id, role, content))
+        if len(self.messages) > self.limit:
+            del self.messages[:-self.limit]
+            self.has_older = True
+
+    def load_older(self):
+        """Prepend the page of messages before the oldest one shown"""
+        before = self.messages[0][0] if self.messages else None
+        older = self.history.page(self.conversation, before, self.page_size + 1)
+        self.has_older = len(older) > self.page_size
+        older = older[-self.page_size:]
+        self.messages[:0] = older
+        self.limit += len(older)
+
+    def render(self):
+        """Draw the shown messages, with a button for older ones if there are any"""
+        if self.has_older and st.button("⬆️ Show earlier messages"):
+            self.load_older()
+        for _, role, content in self.messages:
+            with st.chat_message(role):
+                st.markdown(content)
+
+    def reset(self):
+        """Delete this conversation and start an empty one"""
+        if self.conversation is not None:
+            self.history.delete(self.conversation)
+        self.__init__(self.history, self.app, page_size=self.page_size)
+        st.query_params.pop("c", None)
+
+
+def get_transcript(app):
+    """This browser session's Transcript, resumed from the URL's conversation token if it has one"""
+    # Keyed by app: under the launcher one browser session holds every chat page
+    key = f"transcript_{app}"
+    if key not in st.session_state:
+        history = get_history()
+        token = st.query_params.get("c") or None
+        conversation = history.find(token, app) if token else None
+        st.session_state[key] = Transcript(history, app, conversation, token if conversation else None)
+    transcript = st.session_state[key]
+    if transcript.token is not None and st.query_params.get("c") != transcript.token:
+        # Switching pages drops the query string; put the token back so a reload still resumes
+        st.query_params["c"] = transcript.token
+    return transcript
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Return the process-wide ChatHistory"""
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = ChatHistory()
+    return _history
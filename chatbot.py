@@ -1,68 +1,136 @@
-import streamlit as st
+from contextlib import closing
+
 import requests
-import json
+import streamlit as st
 
-def chat_with_ollama(message, chat_history):
-    """Send message to Ollama and get response"""
-    url = "http://localhost:11434/api/generate"
-    
-    # Build context from chat history
-    context = ""
-    for msg in chat_history:
-        context += f"{msg['role']}: {msg['content']}\n"
+import metrics
+from chat_context import ChatWindow
+from chat_history import get_transcript
+from model_residency import KEEP_ALIVE, get_residency_manager
+from ollama_client import get_client
+from semantic_cache import SEMANTIC_CACHE, get_semantic_cache
+from stream_writer import StreamWriter
+
+MODEL = "tinyllama"
+
+def summarize_turns(summary, messages):
+    """Fold older turns into the running conversation summary"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    payload = {
+        "model": MODEL,
+        "messages": [{
+            "role": "user",
+            "content": f"Previous summary:\n{summary or '(none)'}\n\n"
+                       f"New conversation turns:\n{transcript}\n\n"
+                       "Write an updated summary of the whole conversation in at most 5 sentences."
+        }],
+        "stream": False,
+        "options": {"num_predict": 200, "temperature": 0}
+    }
+    response = get_client().post("/api/chat", json=payload)
+    response.raise_for_status()
+    return response.json()['message']['content'].strip()
+
+def chat_with_ollama(message, window, on_token=None):
+    """Send message to Ollama and get response; `on_token` sees each streamed piece"""
+    # Opening questions don't depend on earlier turns, so near-duplicates
+    # of ones already answered can be served without generating
+    first_turn = not window.messages and not window.summary
+    if first_turn and SEMANTIC_CACHE:
+        cached = get_semantic_cache().lookup(f"chatbot:{MODEL}", message)
+        if cached is not None:
+            window.add("user", message)
+            window.add("assistant", cached)
+            return cached
     
-    prompt = f"{context}user: {message}\nassistant:"
+    # Only the new turn is appended; the rest of the window is an unchanged
+    # prefix that Ollama can reuse from its KV cache
+    window.add("user", message)
     
     payload = {
-        "model": "tinyllama",
-        "prompt": prompt,
-        "stream": False
+        "model": MODEL,
+        "messages": window.build(),
+        "keep_alive": KEEP_ALIVE
     }
     
+    residency = get_residency_manager()
+    residency.touch(MODEL)
     try:
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            result = response.json()
-            return result['response']
-        else:
-            return f"Error: {response.status_code}"
+        parts = []
+        with closing(get_client().stream("/api/chat", payload)) as chunks:
+            for chunk in chunks:
+                if chunk.get('error'):
+                    window.messages.pop()
+                    return f"Error: {chunk['error']}"
+                token = chunk.get('message', {}).get('content', '')
+                parts.append(token)
+                if on_token:
+                    on_token(token)
+                if chunk.get('done'):
+                    residency.observe(MODEL, chunk)
+        reply = "".join(parts)
+        window.add("assistant", reply)
+        window.trim(summarize_turns)
+        if first_turn and SEMANTIC_CACHE:
+            get_semantic_cache().store(f"chatbot:{MODEL}", message, reply)
+        return reply
+    except requests.HTTPError as e:
+        window.messages.pop()
+        return f"Error: {e.response.status_code}"
     except Exception as e:
+        window.messages.pop()
         return f"Connection error: {e}"
+    except BaseException:
+        # Interrupted by a rerun (e.g. Clear Chat); don't leave an unanswered turn in the window
+        window.messages.pop()
+        raise
+
+def failed(reply):
+    """Whether chat_with_ollama's `reply` reports an error instead of answering"""
+    return reply.startswith(("Error:", "Connection error:"))
 
 def main():
+    metrics.set_app_name("chatbot")
     st.title("🤖 AI Chatbot")
     st.markdown("*Powered by Ollama (TinyLlama)*")
     
-    # Initialize chat history
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    # Chat history lives on disk; the session keeps only the recent messages it shows
+    transcript = get_transcript("chatbot")
+    if "window" not in st.session_state:
+        # After a reload or restart, carry on from the stored conversation
+        st.session_state.window = ChatWindow()
+        turns = [(role, content) for _, role, content in transcript.messages]
+        for i, (role, content) in enumerate(turns):
+            # A user message stands or falls with the reply after it
+            answer = turns[i + 1] if role == "user" and i + 1 < len(turns) else (role, content)
+            # Failed turns are shown but were dropped from the window when they happened
+            if not (answer[0] == "assistant" and failed(answer[1])):
+                st.session_state.window.add(role, content)
+        st.session_state.window.trim()
     
     # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    transcript.render()
     
     # Chat input
     if prompt := st.chat_input("Ask me anything..."):
-        # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        
         # Display user message
         with st.chat_message("user"):
             st.markdown(prompt)
         
         # Get bot response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = chat_with_ollama(prompt, st.session_state.messages)
-                st.markdown(response)
+            writer = StreamWriter()
+            response = writer.close(chat_with_ollama(prompt, st.session_state.window, writer.write))
         
-        # Add assistant response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        # Stored only once answered: an interrupted turn leaves the window
+        # too, and a reload must not bring it back unanswered
+        transcript.append("user", prompt)
+        transcript.append("assistant", response)
     
     # Clear chat button
     if st.button("🗑️ Clear Chat"):
-        st.session_state.messages = []
+        transcript.reset()
+        st.session_state.window.clear()
         st.rerun()
 
 if __name__ == "__main__":
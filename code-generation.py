@@ -1,5 +1,14 @@
 import streamlit as st
-import ollama
+
+import metrics
+from code_completion import complete_holes, extract_code, race, stream_completion
+from prompts import code_completion_prompt
+from response_cache import get_cache, should_cache
+from stream_writer import StreamWriter
+
+metrics.set_app_name("code_generation")
+
+MODELS = ["tinyllama:latest", "qwen2.5:0.5b"]
 
 # Page configuration
 st.set_page_config(
@@ -17,10 +26,27 @@ with st.sidebar:
     st.header("⚙️ Settings")
     model = st.selectbox(
         "Select Model",
-        ["tinyllama:latest", "qwen2.5:0.5b"],
+        MODELS,
         index=0
     )
     
+    by_hole = st.checkbox(
+        "🎯 Complete TODOs one at a time",
+        value=False,
+        help="Send each TODO or empty function with only its surrounding context, several at once, "
+             "and splice the answers back into your file. Faster for large files."
+    )
+    
+    mode = st.radio(
+        "Mode",
+        ["Single model", "Race", "Hedged"],
+        # Each TODO goes to the selected model alone
+        disabled=by_hole,
+        help="Race sends the code to every model at once and keeps the first valid answer. "
+             "Hedged starts with the selected model and only adds the next one if it is slow to respond. "
+             "Not available while TODOs are completed one at a time."
+    )
+    
     temperature = st.slider(
         "Temperature",
         min_value=0.0,
@@ -87,44 +113,56 @@ if generate_btn:
             with st.spinner(f"Completing {language} code with {model}..."):
                 try:
                     # Construct the prompt
-                    prompt = f"""You are an expert {language} programmer. Complete the following incomplete code:
+                    prompt = code_completion_prompt(language, incomplete_code, completion_instructions)
 
-```{language.lower()}
-{incomplete_code}
-```
-"""
-                    if completion_instructions.strip():
-                        prompt += f"\nInstructions: {completion_instructions}\n"
+                    options = {
+                        'temperature': temperature,
+                        'num_predict': max_tokens
+                    }
                     
-                    prompt += f"""
-Requirements:
-- Complete the missing parts of the code
-- Follow {language} best practices and conventions
-- Add appropriate comments where needed
-- Ensure the code is functional and complete
-- Keep the existing code structure intact
-
-Provide ONLY the complete code, nothing else."""
-
-                    # Call Ollama API
-                    response = ollama.chat(
-                        model=model,
-                        messages=[
-                            {
-                                'role': 'user',
-                                'content': prompt
-                            }
-                        ],
-                        options={
-                            'temperature': temperature,
-                            'num_predict': max_tokens
-                        }
+                    # Temperature 0 is deterministic, so identical requests can be served from cache
+                    cache = get_cache()
+                    use_cache = should_cache(options)
+                    racing = mode != "Single model" and not by_hole
+                    # The selected model goes first when racing or hedging
+                    race_models = [model] + [m for m in MODELS if m != model]
+                    cache_model = ",".join(race_models) if racing else model
+                    if by_hole:
+                        cache_model += "#holes"
+                    completed_code = cache.get(cache_model, prompt, options) if use_cache else None
+                    writer = StreamWriter(
+                        render=lambda placeholder, text: placeholder.code(extract_code(text), language=language.lower()),
+                        cursor=""
                     )
                     
-                    completed_code = response['message']['content']
+                    if completed_code is None and by_hole:
+                        holes = complete_holes(incomplete_code, language, model, options, completion_instructions)
+                        if holes is None:
+                            st.info("No TODOs or empty functions found, completing the whole file instead.")
+                        else:
+                            completed_code, found, filled = holes
+                            st.caption(f"🎯 Completed {filled} of {found} places with {model}")
+                            if use_cache:
+                                cache.put(cache_model, prompt, options, completed_code)
+                    
+                    if completed_code is None and racing:
+                        result = race(race_models, prompt, options, language, hedge=(mode == "Hedged"))
+                        completed_code = result['code']
+                        st.caption(f"🏁 {result['model']} answered first in {result['elapsed']:.1f}s "
+                                   f"(started: {', '.join(result['started'])})")
+                        if use_cache:
+                            cache.put(cache_model, prompt, options, completed_code)
+                    
+                    elif completed_code is None:
+                        # The same client path as races, holes and the benchmark: pooled,
+                        # scheduled, and ended at the closing fence before the model explains it
+                        completed_code = extract_code(stream_completion(model, prompt, options,
+                                                                        on_token=writer.write))
+                        if use_cache:
+                            cache.put(cache_model, prompt, options, completed_code)
                     
                     # Display the completed code
-                    st.code(completed_code, language=language.lower())
+                    writer.close(completed_code)
                     
                     # Success message
                     st.success("✅ Code completed successfully!")
@@ -151,6 +189,7 @@ Provide ONLY the complete code, nothing else."""
                     )
                     
                 except Exception as e:
+                    metrics.record_error(model, type(e).__name__)
                     st.error(f"Error completing code: {str(e)}")
                     st.info("Make sure Ollama is running and the selected model is installed. Run: `ollama pull " + model + "`")
 
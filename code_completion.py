@@ -0,0 +1,467 @@
+"""
+Code completion helpers for code-generation.py
+Streams completions through the shared Ollama client, checks that an answer
+holds usable code, races or hedges several models against each other, and
+completes the holes (TODOs, empty bodies) of a large file one at a time.
+"""
+
+import ast
+import os
+import re
+import textwrap
+import threading
+import time
+import tokenize
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import metrics
+from chat_context import estimate_tokens
+from model_residency import KEEP_ALIVE, get_residency_manager
+from ollama_client import Cancel, finish, get_client
+from prompts import hole_completion_prompt
+
+FENCE = "```"
+# Hedge once the running models are slower to a first token than this
+# share of their recent first tokens
+HEDGE_PERCENTILE = 0.9
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_HEDGE_SAMPLES = 5
+
+_ttft_samples = defaultdict(lambda: deque(maxlen=200))
+
+HOLE_CONCURRENCY = int(os.getenv("CODE_HOLE_CONCURRENCY", "2"))
+# Lines of code on each side of a TODO when the language can't be parsed
+WINDOW_LINES = 12
+TODO = re.compile(r"\bTODO\b")
+IMPORT = re.compile(r"^\s*(import|from|#include|using|package|require|use)\b")
+
+RACE_WINS = metrics.REGISTRY.counter("code_race_wins_total", "Races won, by model", ("app", "model"))
+HEDGES = metrics.REGISTRY.counter("code_hedges_total", "Extra models started by hedging", ("app", "model"))
+FENCE_STOPS = metrics.REGISTRY.counter("code_fence_stops_total",
+                                       "Completions ended at the closing code fence", ("app", "model"))
+TOKENS_CUT = metrics.REGISTRY.counter("code_tokens_cut_total",
+                                      "Estimated tokens not generated after the closing code fence",
+                                      ("app", "model"))
+
+
+def extract_code(text):
+    """The first fenced code block in `text`, or all of it if there is no fence"""
+    start = text.find(FENCE)
+    if start == -1:
+        return text.strip("\n").rstrip()
+    body = text.find("\n", start)
+    if body == -1:
+        return ""
+    end = text.find(FENCE, body)
+    return text[body + 1:end if end != -1 else len(text)].rstrip()
+
+
+class FenceParser:
+    """Finds the end of the first fenced code block while tokens stream in"""
+
+    def __init__(self):
+        self.text = ""
+        self.opened = False
+        self.closed = False
+        self.end = None
+        self._body = None
+        self._scan = 0
+
+    def feed(self, token):
+        """Add a token; returns True once the first code block is closed"""
+        self.text += token
+        while not self.closed:
+            newline = self.text.find("\n", self._scan)
+            line = self.text[self._scan:] if newline == -1 else self.text[self._scan:newline]
+            if line.lstrip().startswith(FENCE):
+                if self.opened:
+                    # A closing fence needs no language tag, so no need to wait for the newline
+                    self.closed = True
+                    self.end = self._scan + line.index(FENCE) + len(FENCE)
+                    break
+                if newline == -1:
+                    break
+                self.opened = True
+                self._body = newline + 1
+            if newline == -1:
+                break
+            self._scan = newline + 1
+        return self.closed
+
+    @property
+    def code(self):
+        """The code block so far, or all of the text if no block has opened"""
+        if not self.opened:
+            return self.text.strip("\n").rstrip()
+        end = self.end - len(FENCE) if self.closed else len(self.text)
+        return self.text[self._body:end].rstrip()
+
+
+def record_fence_stop(model, generated):
+    """Count a completion ended at its closing fence after `generated` tokens"""
+    FENCE_STOPS.inc(metrics.app_name(), model)
+    TOKENS_CUT.inc(metrics.app_name(), model, amount=metrics.remaining_tokens(model, generated))
+
+
+def is_valid_code(text, language):
+    """Whether `text` holds a complete code answer.
+
+    Fences must be closed. Python must parse; other languages can't be
+    checked here, so their answer must at least be a fenced code block.
+    """
+    if text.count(FENCE) % 2:
+        return False
+    if language.lower() != "python" and FENCE not in text:
+        return False
+    code = extract_code(text)
+    if not code.strip():
+        return False
+    if language.lower() == "python":
+        try:
+            ast.parse(code)
+        except SyntaxError:
+            return False
+    return True
+
+
+def stream_completion(model, prompt, options, cancel=None, on_token=None):
+    """Stream one completion and return its text, or None if `cancel` (a Cancel) was set first.
+
+    The generation is ended as soon as FenceParser sees the close of the
+    first fenced code block. There is no server-side stop sequence for it:
+    one that matches a closing fence also matches a bare opening fence, and
+    done_reason "stop" doesn't tell a stop sequence from a natural end.
+    """
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "options": options,
+        "keep_alive": KEEP_ALIVE,
+    }
+    residency = get_residency_manager()
+    residency.touch(model)
+    started = time.perf_counter()
+    parser = FenceParser()
+    generated = 0
+    with closing(get_client().stream("/api/chat", payload, cancel=cancel)) as chunks:
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                return None
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"])
+            token = chunk.get("message", {}).get("content", "")
+            if token and not generated:
+                _ttft_samples[model].append(time.perf_counter() - started)
+            if token:
+                generated += 1
+                if parser.feed(token):
+                    finish(chunks)
+                    record_fence_stop(model, generated)
+                    if on_token:
+                        on_token(parser.text[len(parser.text) - len(token):parser.end])
+                    return parser.text[:parser.end]
+                if on_token:
+                    on_token(token)
+            if chunk.get("done"):
+                residency.observe(model, chunk)
+    if cancel is not None and cancel.is_set():
+        return None
+    return parser.text
+
+
+def hedge_delay(model):
+    """How long to wait for `model`'s first token before starting another model"""
+    samples = sorted(_ttft_samples[model])
+    if len(samples) < MIN_HEDGE_SAMPLES:
+        return DEFAULT_HEDGE_DELAY
+    return samples[min(len(samples) - 1, int(HEDGE_PERCENTILE * len(samples)))]
+
+
+def race(models, prompt, options, language, hedge=False):
+    """Complete `prompt` on several models and return the first valid answer.
+
+    All models start at once, unless `hedge` is set: then the next model
+    only starts if none of the running ones has produced a token within
+    the last one's hedge_delay, or if every running one has finished
+    without usable code. The losers' streams are shut down as soon as
+    there is a winner, even those still waiting for a first token.
+    Returns a dict with model, text, code, elapsed, valid and the models
+    that were started.
+    """
+    cancel = Cancel()
+    first_token = threading.Event()
+    finished = threading.Condition()
+    results = []
+    started = []
+    began = time.perf_counter()
+
+    def run(model):
+        try:
+            text = stream_completion(model, prompt, options, cancel, lambda token: first_token.set())
+            result = {"model": model, "text": text, "error": None}
+        except Exception as e:
+            result = {"model": model, "text": None, "error": str(e)}
+        result["elapsed"] = time.perf_counter() - began
+        with finished:
+            results.append(result)
+            finished.notify_all()
+
+    def start(model):
+        started.append(model)
+        threading.Thread(target=run, args=(model,), daemon=True).start()
+
+    pending = list(models)
+    start(pending.pop(0))
+    while pending and not hedge:
+        start(pending.pop(0))
+    deadline = began + hedge_delay(started[-1])
+
+    winner = None
+    checked = 0
+    with finished:
+        while winner is None:
+            if checked == len(results):
+                waiting_to_hedge = pending and not first_token.is_set()
+                finished.wait(max(0.0, deadline - time.perf_counter()) if waiting_to_hedge else None)
+            while winner is None and checked < len(results):
+                result = results[checked]
+                checked += 1
+                result["valid"] = result["text"] is not None and is_valid_code(result["text"], language)
+                if result["valid"]:
+                    winner = result
+            if winner is not None:
+                break
+            slow = not first_token.is_set() and time.perf_counter() >= deadline
+            if pending and (slow or checked == len(started)):
+                model = pending.pop(0)
+                HEDGES.inc(metrics.app_name(), model)
+                start(model)
+                deadline = time.perf_counter() + hedge_delay(model)
+            elif checked == len(started):
+                break
+    cancel.set()
+
+    if winner is None:
+        # Nothing parsed; fall back to the first answer we got at all
+        winner = next((r for r in results if r["text"]), None)
+        if winner is None:
+            raise RuntimeError("; ".join(f"{r['model']}: {r['error']}" for r in results))
+    RACE_WINS.inc(metrics.app_name(), winner["model"])
+    return {**winner, "code": extract_code(winner["text"]), "started": started}
+
+
+class Hole:
+    """Lines [start, end) of the file that need completing, with context for the prompt.
+
+    A hole that is a Python function also knows the function's name and
+    parameters, and the line after its signature (None if the body shares
+    the `def` line), so an answer can be checked against it before splicing.
+    """
+
+    def __init__(self, start, end, context, name=None, params=None, body=None):
+        self.start = start
+        self.end = end
+        self.context = context
+        self.name = name
+        self.params = params
+        self.body = body
+
+
+def _is_stub(node):
+    # Nothing but pass, ... and a docstring
+    return all(isinstance(stmt, ast.Pass)
+               or (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant)
+                   and (stmt.value.value is Ellipsis or isinstance(stmt.value.value, str)))
+               for stmt in node.body)
+
+
+def _params(args):
+    return ([a.arg for a in args.posonlyargs + args.args], args.vararg and args.vararg.arg,
+            [a.arg for a in args.kwonlyargs], args.kwarg and args.kwarg.arg)
+
+
+def _header(lines, node):
+    """The `def` or `class` line(s) of `node`, however many lines the signature spans"""
+    body = node.body[0]
+    header = lines[node.lineno - 1:body.lineno]
+    # col_offset counts UTF-8 bytes
+    header[-1] = header[-1].encode()[:body.col_offset].decode(errors="ignore")
+    return "\n".join(line for line in header if line.strip()).rstrip()
+
+
+def _body_line(lines, node):
+    """Index of the line after the signature of `node`, or None if its body shares that line"""
+    source = iter(line + "\n" for line in lines[node.lineno - 1:node.end_lineno])
+    depth = 0
+    for token in tokenize.generate_tokens(source.__next__):
+        if token.type != tokenize.OP:
+            continue
+        if token.string in ("(", "[", "{"):
+            depth += 1
+        elif token.string in (")", "]", "}"):
+            depth -= 1
+        elif token.string == ":" and not depth:
+            rest = token.line[token.end[1]:].split("#")[0]
+            return None if rest.strip() else node.lineno - 1 + token.end[0]
+    return None
+
+
+def _first_line(node):
+    # Decorators belong to the definition
+    return min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+
+
+def _python_holes(code, lines):
+    tree = ast.parse(code)
+    functions = [node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    spans = {}
+    for node in functions:
+        start = _first_line(node)
+        if _is_stub(node) or any(TODO.search(line) for line in lines[start:node.end_lineno]):
+            spans[(start, node.end_lineno)] = node
+    # A function inside another hole is completed along with it
+    spans = {(a, b): node for (a, b), node in spans.items()
+             if not any(c <= a and b <= d and (c, d) != (a, b) for c, d in spans)}
+
+    imports = [ast.get_source_segment(code, node) for node in tree.body
+               if isinstance(node, (ast.Import, ast.ImportFrom))]
+    holes = []
+    for (start, end), function in sorted(spans.items(), key=lambda item: item[0]):
+        context = list(imports)
+        for node in tree.body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            if _first_line(node) <= start and end <= node.end_lineno:
+                if isinstance(node, ast.ClassDef):
+                    # Enclosing class: its header and the signatures of its other methods
+                    context.append(_header(lines, node))
+                    context += [_header(lines, child) + " ..." for child in node.body
+                                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+                                and not start <= child.lineno - 1 < end]
+                continue
+            context.append(_header(lines, node) + " ...")
+        holes.append(Hole(start, end, "\n".join(context), function.name, _params(function.args),
+                          _body_line(lines, function)))
+    return holes
+
+
+def _window_holes(lines, covered=()):
+    """Line windows around TODOs that no other hole covers"""
+    imports = "\n".join(line for line in lines if IMPORT.match(line))
+    holes = []
+    for i, line in enumerate(lines):
+        if not TODO.search(line) or any(a <= i < b for a, b in covered):
+            continue
+        if holes and i < holes[-1].end:
+            # Already inside the previous window
+            continue
+        start, end = max(0, i - WINDOW_LINES), min(len(lines), i + WINDOW_LINES + 1)
+        start = max([start] + [b for a, b in covered if b <= i] + [h.end for h in holes])
+        end = min([end] + [a for a, b in covered if a > i])
+        holes.append(Hole(start, end, imports))
+    return holes
+
+
+def find_holes(code, language):
+    """Places in `code` that need completing.
+
+    Python functions that are stubs or contain a TODO are found through
+    the AST, with imports and surrounding signatures as their context. Any
+    other TODO, or any TODO in a file that doesn't parse, gets a window of
+    WINDOW_LINES lines on either side.
+    """
+    lines = code.splitlines()
+    holes = []
+    if language.lower() == "python":
+        try:
+            holes = _python_holes(code, lines)
+        except SyntaxError:
+            holes = []
+    holes += _window_holes(lines, [(h.start, h.end) for h in holes])
+    return sorted(holes, key=lambda h: h.start)
+
+
+def _parses(code):
+    try:
+        ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        return False
+    return True
+
+
+def _splice_function(hole, lines, answer):
+    """The lines to put in place of a Python function hole, or None to keep the original.
+
+    An answer holding the function itself (same name and parameters)
+    replaces the whole hole; anything else the answer defines is left out.
+    An answer that is only a body goes under the original signature, in
+    place of everything below it, TODO comments included. Nothing else may
+    replace the `def` line.
+    """
+    try:
+        tree = ast.parse(textwrap.dedent(answer))
+    except SyntaxError:
+        return None
+    dedented = textwrap.dedent(answer).splitlines()
+    for node in tree.body:
+        if (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == hole.name
+                and _params(node.args) == hole.params):
+            return _reindent("\n".join(dedented[_first_line(node):node.end_lineno]), lines[hole.start]).splitlines()
+    if any(isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) for node in tree.body):
+        # Some other function: not an answer for this hole
+        return None
+    if hole.body is None:
+        # A one-line function has no separate body to replace
+        return None
+    body = next(line for line in lines[hole.body:hole.end] if line.strip())
+    return lines[hole.start:hole.body] + _reindent(answer, body).splitlines()
+
+
+def _reindent(code, like):
+    # Models often drop the indentation of a method; restore the original's
+    indent = like[:len(like) - len(like.lstrip())]
+    return textwrap.indent(textwrap.dedent(code), indent)
+
+
+def complete_holes(code, language, model, options, instructions=""):
+    """Complete each hole of `code` separately and splice the answers back in.
+
+    Holes run concurrently, HOLE_CONCURRENCY at a time. A hole keeps its
+    original lines if its answer is empty or, for Python, doesn't parse;
+    a function hole only takes an answer as described in _splice_function.
+    Returns (completed code, number of holes, number completed), or None
+    when there is nothing to complete hole by hole.
+    """
+    holes = find_holes(code, language)
+    if not holes:
+        return None
+    lines = code.splitlines()
+
+    def complete(hole):
+        snippet = "\n".join(lines[hole.start:hole.end])
+        # The answer is about as long as the hole, not the file
+        hole_options = {**options, "num_predict": min(options.get("num_predict", 2000),
+                                                       2 * estimate_tokens(snippet) + 256)}
+        prompt = hole_completion_prompt(language, hole.context, textwrap.dedent(snippet), instructions)
+        answer = extract_code(stream_completion(model, prompt, hole_options) or "")
+        if not answer.strip():
+            return None
+        if hole.name is not None:
+            return _splice_function(hole, lines, answer)
+        answer = _reindent(answer, lines[hole.start])
+        if language.lower() == "python" and _parses(snippet) and not _parses(answer):
+            return None
+        return answer.splitlines()
+
+    with ThreadPoolExecutor(max_workers=HOLE_CONCURRENCY) as pool:
+        answers = list(pool.map(complete, holes))
+
+    completed = 0
+    # Splice from the bottom up so earlier line numbers stay valid
+    for hole, answer in sorted(zip(holes, answers), key=lambda pair: pair[0].start, reverse=True):
+        if answer is not None:
+            lines[hole.start:hole.end] = answer
+            completed += 1
+    return "\n".join(lines), len(holes), completed
@@ -1,24 +1,21 @@
 import streamlit as st
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
+from contextlib import closing
 
-load_dotenv()
+import gemini_client
+import metrics
+from chat_history import get_transcript
+from stream_writer import StreamWriter
 
-API_KEY = os.getenv("GEMINI_API_KEY")
+metrics.set_app_name("gemini_chat")
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash')
+MODEL = 'gemini-2.5-flash'
 
 st.title("🤖 Gemini Chatbot")
 st.markdown("*Ask me anything!*")
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.write(msg["content"])
+# Chat history lives on disk; the session keeps only the recent messages it shows
+transcript = get_transcript("gemini_chat")
+transcript.render()
 
 user_input = st.chat_input("Type your question here...")
 
@@ -26,15 +23,22 @@ if user_input:
     with st.chat_message("user"):
         st.write(user_input)
     
-    st.session_state.messages.append({"role": "user", "content": user_input})
-    
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            response = model.generate_content(user_input)
-            st.write(response.text)
+        writer = StreamWriter()
+        try:
+            with closing(gemini_client.stream(MODEL, user_input)) as chunks:
+                for text in chunks:
+                    writer.write(text)
+            response = writer.close()
+        except Exception as e:
+            response = None
+            st.error(f"Error: {e}")
     
-    st.session_state.messages.append({"role": "assistant", "content": response.text})
+    # Stored only once answered, so an error or a Stop leaves no unanswered turn behind
+    if response is not None:
+        transcript.append("user", user_input)
+        transcript.append("assistant", response)
 
 if st.button("Clear Chat"):
-    st.session_state.messages = []
+    transcript.reset()
     st.rerun()
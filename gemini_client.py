@@ -0,0 +1,142 @@
+"""
+Shared Gemini client
+One google-genai client per process, keyed from the environment, with
+streaming generation and retries on rate limits (429) and server errors.
+Set GEMINI_BASE_URL to point it at a local stub.
+"""
+
+import os
+import random
+import threading
+import time
+
+from google import genai
+from google.genai import errors, types
+
+import metrics
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+BACKOFF = float(os.getenv("GEMINI_BACKOFF", "1"))
+# Per-minute quotas reset within a minute; never wait longer than that
+MAX_DELAY = 60
+
+RETRY_CODES = (429, 500, 502, 503, 504)
+
+
+def _usage(response):
+    """Token counts in the shape metrics.record_response expects"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    return {"prompt_eval_count": usage.prompt_token_count, "eval_count": usage.candidates_token_count}
+
+
+def _retry_delay(error, attempt):
+    # A 429 says how long until the quota frees up; otherwise back off with full jitter
+    body = error.details.get("error", {}) if isinstance(error.details, dict) else {}
+    for detail in body.get("details", []):
+        delay = detail.get("retryDelay", "")
+        if detail.get("@type", "").endswith("RetryInfo") and delay.endswith("s"):
+            try:
+                return min(MAX_DELAY, float(delay[:-1]))
+            except ValueError:
+                break
+    return random.uniform(0, min(MAX_DELAY, BACKOFF * (2 ** attempt)))
+
+
+def _retrying(call, model):
+    """Run `call()`, retrying 429 and 5xx responses"""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except errors.APIError as e:
+            if e.code not in RETRY_CODES or attempt == MAX_RETRIES:
+                metrics.record_error(model, f"http_{e.code}")
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+
+def generate(model, contents, config=None):
+    """Generate a whole response and return its text"""
+    client = get_gemini_client()
+    started = time.perf_counter()
+    response = _retrying(lambda: client.models.generate_content(model=model, contents=contents, config=config),
+                         model)
+    metrics.record_response(model, _usage(response), time.perf_counter() - started)
+    return response.text or ""
+
+
+def stream(model, contents, config=None):
+    """Yield the response text as it is generated.
+
+    Failures before the first chunk are retried like generate(); once text
+    has been handed out a failure is raised instead of starting over.
+    Closing the generator early stops the request, like OllamaClient.stream,
+    and is recorded as a cancellation.
+    """
+    client = get_gemini_client()
+    started = time.perf_counter()
+    ttft = None
+    generated = 0
+    last = None
+    chunks = None
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                chunks = client.models.generate_content_stream(model=model, contents=contents, config=config)
+                for chunk in chunks:
+                    last = chunk
+                    if not chunk.text:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    generated += 1
+                    yield chunk.text
+                break
+            except errors.APIError as e:
+                if generated or e.code not in RETRY_CODES or attempt == MAX_RETRIES:
+                    metrics.record_error(model, f"http_{e.code}")
+                    raise
+                time.sleep(_retry_delay(e, attempt))
+    except GeneratorExit:
+        metrics.record_cancel(model, generated)
+        raise
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    metrics.record_response(model, _usage(last), time.perf_counter() - started, ttft)
+
+
+def list_models(method="generateContent"):
+    """Models that support `method`, or all of them if it is None"""
+    client = get_gemini_client()
+    models = _retrying(lambda: list(client.models.list()), None)
+    return [m for m in models if method is None or method in (m.supported_actions or [])]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """Return the process-wide genai.Client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not GEMINI_API_KEY:
+                    raise RuntimeError("Set GEMINI_API_KEY (or put it in .env) to use Gemini")
+                http_options = types.HttpOptions(timeout=int(GEMINI_TIMEOUT * 1000))
+                if GEMINI_BASE_URL:
+                    http_options.base_url = GEMINI_BASE_URL
+                _client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _client
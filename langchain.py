@@ -1,22 +1,196 @@
 import streamlit as st
+import asyncio
+import csv
+import json
+import os
+import time
 from langchain_community.llms import Ollama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", "You are a helpful AI assistant."),
-    ("user", "Question: {question}")
-])
+import metrics
+import scheduler
+from model_residency import KEEP_ALIVE, get_residency_manager
+from ollama_client import OLLAMA_API
+from response_cache import get_cache, should_cache
+from scheduler import get_scheduler
+from stream_writer import StreamWriter, stop_with_script
+
+metrics.set_app_name("langchain")
+
+# Questions answered at once in batch mode, up to the scheduler's slots
+BATCH_CONCURRENCY = int(os.getenv("LANGCHAIN_BATCH_CONCURRENCY", str(scheduler.SLOTS)))
+
+
+@st.cache_resource
+def get_chain():
+    """The model and chain, built once per process rather than on every rerun"""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "You are a helpful AI assistant."),
+        ("user", "Question: {question}")
+    ])
+    model = Ollama(model="tinyllama", base_url=OLLAMA_API, keep_alive=KEEP_ALIVE)
+    return model, prompt | model | StrOutputParser()
+
+
+def parse_questions(text, name=""):
+    """Questions from pasted lines or an uploaded .txt, .csv or .jsonl file, without blanks and repeats"""
+    lines = text.splitlines()
+    if name.endswith(".jsonl"):
+        records = []
+        for n, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"line {n}: {e}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"line {n}: expected a JSON object")
+            records.append(record)
+        lines = [record.get("question", "") for record in records]
+    elif name.endswith(".csv"):
+        rows = [row for row in csv.reader(lines) if row]
+        if rows and rows[0][0].strip().lower() == "question":
+            rows = rows[1:]
+        lines = [row[0] for row in rows]
+    return list(dict.fromkeys(q.strip() for q in lines if q.strip()))
+
+
+async def answer(chain, model, question, use_cache):
+    """Answer one batch question; returns (answer, seconds, error, cached)"""
+    cache = get_cache()
+    started = time.perf_counter()
+    if should_cache(force=use_cache):
+        cached = cache.get(model.model, question)
+        if cached is not None:
+            return cached, time.perf_counter() - started, None, True
+    # Batch work yields to people waiting on the other pages
+    slots = get_scheduler()
+    queue_wait = await slots.acquire_async("batch")
+    # Timed from the slot on; the wait for it is recorded as queue_wait
+    started = time.perf_counter()
+    parts = []
+    ttft = None
+    try:
+        async for token in chain.astream({"question": question}):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(token)
+    except asyncio.CancelledError:
+        # The script was stopped or rerun
+        metrics.record_cancel(model.model, len(parts))
+        raise
+    except Exception as e:
+        metrics.record_error(model.model, type(e).__name__)
+        return None, time.perf_counter() - started, str(e), False
+    finally:
+        slots.release()
+    elapsed = time.perf_counter() - started
+    metrics.record_response(model.model, {}, elapsed, ttft, queue_wait)
+    response = "".join(parts)
+    if use_cache:
+        cache.put(model.model, question, None, response)
+    return response, elapsed, None, False
+
+
+async def run_batch(chain, model, questions, concurrency, use_cache):
+    """Answer every question, at most `concurrency` at a time, showing each one as it completes"""
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i, question):
+        async with limit:
+            return i, question, await answer(chain, model, question, use_cache)
+
+    progress = st.progress(0.0, text=f"0/{len(questions)} answered")
+    results = [None] * len(questions)
+    started = time.perf_counter()
+    for done, task in enumerate(asyncio.as_completed([one(i, q) for i, q in enumerate(questions)]), 1):
+        i, question, (response, seconds, error, cached) = await task
+        results[i] = {"question": question, "answer": response, "seconds": round(seconds, 3),
+                      "error": error, "cached": cached}
+        progress.progress(done / len(questions), text=f"{done}/{len(questions)} answered")
+        label = f"{'❌' if error else '✅'} {question} — {seconds:.2f}s{' (cached)' if cached else ''}"
+        with st.expander(label):
+            st.write(error or response)
+    return results, time.perf_counter() - started
+
+
+def batch_summary(results, elapsed):
+    answered = sorted(r["seconds"] for r in results if not r["error"])
+    cols = st.columns(4)
+    cols[0].metric("Answered", f"{len(answered)}/{len(results)}")
+    cols[1].metric("Questions/s", f"{len(results) / elapsed:.2f}" if elapsed else "-")
+    cols[2].metric("Median latency", f"{answered[len(answered) // 2]:.2f}s" if answered else "-")
+    cols[3].metric("p95 latency", f"{answered[min(len(answered) - 1, int(len(answered) * 0.95))]:.2f}s"
+                   if answered else "-")
+    st.download_button("⬇️ Download results (JSONL)", "\n".join(json.dumps(r) for r in results) + "\n",
+                       file_name="answers.jsonl", mime="application/x-ndjson")
+
+
+def batch_mode(chain, model):
+    pasted = st.text_area("Questions, one per line")
+    uploaded = st.file_uploader("…or a file of questions", type=["txt", "csv", "jsonl"],
+                                help="One question per line; the first column of a CSV; "
+                                     "the `question` field of each JSONL record")
+    # Each question holds one of the process's scheduler slots, so more than that would only queue
+    slots = get_scheduler().slots
+    if slots > 1:
+        concurrency = st.slider("Questions at once", 1, slots, min(slots, BATCH_CONCURRENCY),
+                                help=f"At most the {slots} generation slots of this process; "
+                                     "set SCHEDULER_SLOTS to what the backends can run in parallel")
+    else:
+        concurrency = 1
+        st.caption("One question at a time: this process has a single generation slot (SCHEDULER_SLOTS)")
+    use_cache = st.checkbox("♻️ Reuse earlier answers to the same question", value=False)
+    if not st.button("Run batch"):
+        return
+    try:
+        if uploaded is not None:
+            questions = parse_questions(uploaded.getvalue().decode("utf-8", "replace"), uploaded.name)
+        else:
+            questions = parse_questions(pasted)
+    except ValueError as e:
+        st.error(f"Could not read the questions: {e}")
+        return
+    if not questions:
+        st.warning("No questions to answer")
+        return
+    get_residency_manager().touch(model.model)
+    results, elapsed = asyncio.run(run_batch(chain, model, questions, concurrency, use_cache))
+    batch_summary(results, elapsed)
+
 
 st.title("Langchain Demo with TinyLlama")
-input_text = st.text_input("Your question: ")
+mode = st.radio("Mode", ["Single question", "Batch"], horizontal=True)
 
-model = Ollama(model="tinyllama")
+model, chain = get_chain()
 
-output_parser = StrOutputParser()
+if mode == "Batch":
+    batch_mode(chain, model)
+else:
+    input_text = st.text_input("Your question: ")
 
-chain = prompt | model | output_parser
+    use_cache = st.checkbox("♻️ Reuse earlier answers to the same question", value=False)
 
-if input_text:
-    response = chain.invoke({"question": input_text})
-    st.write(response)
\ No newline at end of file
+    if input_text:
+        cache = get_cache()
+        response = cache.get(model.model, input_text) if should_cache(force=use_cache) else None
+        if response is None:
+            get_residency_manager().touch(model.model)
+            ttft = None
+            writer = StreamWriter()
+            stream = chain.stream({"question": input_text})
+            with get_scheduler().slot() as queue_wait, stop_with_script(stream, model.model, writer):
+                started = time.perf_counter()
+                for token in stream:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    writer.write(token)
+            response = writer.close()
+            # The chain only hands back text, so timings are all we can record
+            metrics.record_response(model.model, {}, time.perf_counter() - started, ttft, queue_wait)
+            if use_cache:
+                cache.put(model.model, input_text, None, response)
+        else:
+            st.write(response)
\ No newline at end of file
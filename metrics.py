@@ -0,0 +1,287 @@
+"""
+Request metrics for Ollama calls
+Histograms and counters kept in-process and rendered in the Prometheus text
+format, plus an optional JSON-lines log of every generation (METRICS_LOG).
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+METRICS_LOG = os.getenv("METRICS_LOG", "")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_app = contextvars.ContextVar("metrics_app", default=None)
+_default_app = "unknown"
+
+
+def set_app_name(name):
+    """Label metrics recorded from the current context (and by default the process) with `name`"""
+    global _default_app
+    if _default_app == "unknown":
+        _default_app = name
+    _app.set(name)
+
+
+def app_name():
+    return _app.get() or _default_app
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"'.replace("\n", " ") for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total, count = self.values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            # Prometheus buckets are cumulative: each one counts values <= its bound
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                for bound, n in zip(self.buckets, counts):
+                    le = _format_labels(self.labels + ("le",), labels + (bound,))
+                    lines.append(f"{self.name}_bucket{le} {n}")
+                le = _format_labels(self.labels + ("le",), labels + ("+Inf",))
+                lines.append(f"{self.name}_bucket{le} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        """Add a callable returning [(name, type, help, [(labels dict, value)])] at render time"""
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                families = collect()
+            except Exception:
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("ollama_requests_total", "Generation requests", ("app", "model"))
+ERRORS = REGISTRY.counter("ollama_errors_total", "Failed Ollama requests", ("app", "model", "kind"))
+REQUEST_SECONDS = REGISTRY.histogram("ollama_request_seconds", "Wall time of a generation request",
+                                     ("app", "model"))
+TTFT_SECONDS = REGISTRY.histogram("ollama_time_to_first_token_seconds", "Time until the first token",
+                                  ("app", "model"))
+LOAD_SECONDS = REGISTRY.histogram("ollama_load_seconds", "Model load time reported by Ollama",
+                                  ("app", "model"))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("ollama_queue_wait_seconds",
+                                        "Time spent waiting before Ollama started the request",
+                                        ("app", "model", "stage"))
+EVAL_RATE = REGISTRY.histogram("ollama_eval_tokens_per_second", "Generation speed",
+                               ("app", "model"), RATE_BUCKETS)
+PROMPT_EVAL_RATE = REGISTRY.histogram("ollama_prompt_eval_tokens_per_second", "Prompt evaluation speed",
+                                      ("app", "model"), RATE_BUCKETS)
+CANCELLED = REGISTRY.counter("ollama_cancelled_total", "Generations abandoned before they finished",
+                             ("app", "model"))
+TOKENS_SAVED = REGISTRY.counter("ollama_tokens_saved_total",
+                                "Estimated tokens not generated because the generation was cancelled",
+                                ("app", "model"))
+CACHE_LOOKUPS = REGISTRY.counter("response_cache_requests_total",
+                                 "Response cache lookups, by the tier that answered (miss if none)",
+                                 ("app", "result"))
+PAGE_LOAD_SECONDS = REGISTRY.histogram("app_page_load_seconds",
+                                       "First run of a page in this process, imports included", ("page",))
+
+# Moving average of completed generation lengths, to estimate what a
+# cancelled generation would still have produced
+_typical_tokens = {}
+
+_log_lock = threading.Lock()
+_log_file = None
+
+
+def _log(record):
+    global _log_file
+    if not METRICS_LOG:
+        return
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(METRICS_LOG, "a", encoding="utf-8")
+        _log_file.write(json.dumps(record) + "\n")
+        _log_file.flush()
+
+
+def _seconds(result, field):
+    # Ollama reports durations in nanoseconds; SDK objects may hold None
+    return (result.get(field) or 0) / 1e9
+
+
+def record_response(model, result, elapsed, ttft=None, queue_wait=None, app=None):
+    """Record one finished generation from Ollama's final response fields.
+
+    `elapsed` is the client-side wall time from sending the request, so
+    without any `queue_wait` spent on a slot first. Without a measured `ttft`
+    (non-streamed calls) it is estimated as the time before token generation
+    began. Time not covered by Ollama's total_duration is counted as
+    upstream queue wait.
+    """
+    app = app or app_name()
+    labels = (app, model)
+    total = _seconds(result, "total_duration")
+    load = _seconds(result, "load_duration")
+    eval_seconds = _seconds(result, "eval_duration")
+    prompt_seconds = _seconds(result, "prompt_eval_duration")
+    eval_count = result.get("eval_count") or 0
+    if ttft is None and eval_seconds:
+        ttft = max(0.0, elapsed - eval_seconds)
+
+    REQUESTS.inc(*labels)
+    REQUEST_SECONDS.observe(elapsed, *labels)
+    if ttft is not None:
+        TTFT_SECONDS.observe(ttft, *labels)
+    if total:
+        LOAD_SECONDS.observe(load, *labels)
+        QUEUE_WAIT_SECONDS.observe(max(0.0, elapsed - total), *labels, "upstream")
+    if queue_wait is not None:
+        QUEUE_WAIT_SECONDS.observe(queue_wait, *labels, "admission")
+    if eval_count:
+        typical = _typical_tokens.get(model)
+        _typical_tokens[model] = eval_count if typical is None else 0.9 * typical + 0.1 * eval_count
+    if eval_seconds:
+        EVAL_RATE.observe(eval_count / eval_seconds, *labels)
+    if prompt_seconds:
+        PROMPT_EVAL_RATE.observe((result.get("prompt_eval_count") or 0) / prompt_seconds, *labels)
+
+    _log({"ts": time.time(), "app": app, "model": model, "elapsed": round(elapsed, 4),
+          "ttft": None if ttft is None else round(ttft, 4), "load": round(load, 4),
+          "queue_wait": None if queue_wait is None else round(queue_wait, 4),
+          "prompt_eval_count": result.get("prompt_eval_count"),
+          "eval_count": result.get("eval_count"),
+          "eval_rate": round(eval_count / eval_seconds, 2) if eval_seconds else None})
+
+
+def record_error(model, kind, app=None):
+    app = app or app_name()
+    ERRORS.inc(app, model or "", kind)
+    _log({"ts": time.time(), "app": app, "model": model, "error": kind})
+
+
+def remaining_tokens(model, generated):
+    """Estimate how many more tokens a generation stopped after `generated` would have produced"""
+    return max(0, round(_typical_tokens.get(model, 0) - generated))
+
+
+def record_cancel(model, generated, app=None):
+    """Record a generation stopped after `generated` tokens"""
+    app = app or app_name()
+    saved = remaining_tokens(model, generated)
+    CANCELLED.inc(app, model or "")
+    TOKENS_SAVED.inc(app, model or "", amount=saved)
+    _log({"ts": time.time(), "app": app, "model": model, "cancelled": True,
+          "generated": generated, "tokens_saved": saved})
+
+
+def record_cache_lookup(model, tier, app=None):
+    """Record a response cache lookup for `model` answered by `tier` ("memory", "disk"), or None on a miss"""
+    app = app or app_name()
+    CACHE_LOOKUPS.inc(app, tier or "miss")
+    _log({"ts": time.time(), "app": app, "model": model, "cache_hit": tier})
+
+
+def record_page_load(page, seconds, modules):
+    """Record the first run of a page, which imported `modules` new modules"""
+    PAGE_LOAD_SECONDS.observe(seconds, page)
+    _log({"ts": time.time(), "app": app_name(), "page": page, "load_seconds": round(seconds, 4),
+          "modules": modules, "rss": rss_bytes()})
+
+
+def rss_bytes():
+    """Resident memory of this process, or its peak where the current figure isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def collect_process():
+    rss = rss_bytes()
+    return [("process_resident_memory_bytes", "gauge", "Resident memory size",
+             [({}, rss)] if rss is not None else [])]
+
+
+REGISTRY.register_collector(collect_process)
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,270 @@
+"""
+Model catalog
+The Ollama and Gemini model listings, with each model's size, capabilities
+and whether it is loaded right now. Each backend's listing is kept in
+memory and on disk and refreshed in the background on its own once it is
+older than MODEL_CATALOG_TTL, so readers get an answer at once even while
+Ollama is busy generating, a slow backend never holds up the other, and
+page loads don't reach the backends at all.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from ollama_client import CONNECT_TIMEOUT, get_client
+
+BACKENDS = ("ollama", "gemini")
+# Also bounds how out of date the residency flags can be
+CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "60"))
+# Where to keep the catalog across restarts; empty keeps it in memory only
+CATALOG_PATH = os.getenv("MODEL_CATALOG_PATH", os.path.join(os.path.expanduser("~"), ".cache", "bootcamp-genai",
+                                                            "models.json"))
+# Listing calls are quick even on a busy server; don't let one hang a refresh
+CATALOG_TIMEOUT = float(os.getenv("MODEL_CATALOG_TIMEOUT", "10"))
+
+
+def _ollama_entry(tag, show, running):
+    details = tag.get("details") or {}
+    return {
+        "name": tag["name"],
+        "backend": "ollama",
+        "size": tag.get("size"),
+        "digest": tag.get("digest"),
+        "modified_at": tag.get("modified_at"),
+        "family": details.get("family"),
+        "parameter_size": details.get("parameter_size"),
+        "quantization": details.get("quantization_level"),
+        # Older Ollama versions don't report capabilities
+        "capabilities": show.get("capabilities"),
+        "resident": running is not None,
+        "size_vram": running.get("size_vram") if running else None,
+        "expires_at": running.get("expires_at") if running else None,
+    }
+
+
+def _gemini_entry(model):
+    return {
+        "name": model.name,
+        "backend": "gemini",
+        "display_name": model.display_name,
+        "size": None,
+        "capabilities": list(model.supported_actions or []),
+        "input_token_limit": model.input_token_limit,
+        "output_token_limit": model.output_token_limit,
+        # Hosted models are always ready
+        "resident": True,
+    }
+
+
+class _Listing:
+    """One backend's models, when they were fetched and how that went"""
+
+    def __init__(self, models=(), updated=0.0, error=None):
+        self.models = list(models)
+        self.updated = updated
+        self.error = error
+        self.refreshes = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def age(self):
+        return time.time() - self.updated
+
+
+class ModelCatalog:
+    """Model listings per backend, served from memory and refreshed in the background"""
+
+    def __init__(self, ttl=CATALOG_TTL, path=CATALOG_PATH, client=None):
+        self.ttl = ttl
+        self.path = path
+        self.client = client or get_client()
+        self.timeout = (CONNECT_TIMEOUT, CATALOG_TIMEOUT)
+        self.listings = {backend: _Listing() for backend in BACKENDS}
+        self._fetchers = {"ollama": self._ollama_models, "gemini": self._gemini_models}
+        # /api/show per model only changes with the model's digest
+        self._shown = {}
+        # backends -> (refresh counts of their listings, etag, body, gzipped body)
+        self._encoded = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for backend, listing in saved.items():
+            if backend in self.listings:
+                self.listings[backend] = _Listing(listing.get("models", []), listing.get("updated", 0.0),
+                                                  listing.get("error"))
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {backend: {"models": listing.models, "updated": listing.updated, "error": listing.error}
+                    for backend, listing in self.listings.items()}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _ollama_models(self):
+        tags = self.client.get("/api/tags", timeout=self.timeout)
+        tags.raise_for_status()
+        try:
+            ps = self.client.get("/api/ps", timeout=self.timeout)
+            ps.raise_for_status()
+            running = {m["name"]: m for m in ps.json().get("models", [])}
+        except Exception:
+            running = {}
+        models = []
+        for tag in tags.json().get("models", []):
+            key = (tag["name"], tag.get("digest"))
+            if key not in self._shown:
+                try:
+                    show = self.client.post("/api/show", json={"model": tag["name"]}, timeout=self.timeout)
+                    self._shown[key] = show.json() if show.ok else {}
+                except Exception:
+                    pass  # asked again on the next refresh
+            models.append(_ollama_entry(tag, self._shown.get(key, {}), running.get(tag["name"])))
+        return models
+
+    def _gemini_models(self):
+        # Imported here so the Ollama-only apps never load the Gemini SDK
+        import gemini_client
+        if not gemini_client.GEMINI_API_KEY:
+            return []
+        return [_gemini_entry(m) for m in gemini_client.list_models(method=None)]
+
+    def refresh(self, backend, max_age=0):
+        """Fetch `backend`'s listing unless it is younger than `max_age` seconds.
+
+        A failed fetch keeps the previous models and records the error.
+        """
+        listing = self.listings[backend]
+        with listing.lock:
+            # Whoever waited for the lock may find the work already done
+            if listing.updated and listing.age() < max_age:
+                return
+            try:
+                models, error = self._fetchers[backend](), None
+            except Exception as e:
+                models, error = listing.models, str(e)
+            with self._lock:
+                listing.models, listing.error, listing.updated = models, error, time.time()
+                listing.refreshes += 1
+        try:
+            self._save()
+        except OSError:
+            pass
+
+    def _ensure(self, backend, max_age=None):
+        """Make sure `backend` has a listing and is kept fresh from now on"""
+        listing = self.listings[backend]
+        if not listing.updated or (max_age is not None and listing.age() >= max_age):
+            self.refresh(backend, self.ttl if max_age is None else max_age)
+        elif listing.age() >= self.ttl:
+            listing.wake.set()
+        self.start(backend)
+
+    def list(self, backend, max_age=None):
+        """`backend`'s models, refreshed first if older than `max_age` seconds"""
+        self._ensure(backend, max_age)
+        with self._lock:
+            return list(self.listings[backend].models)
+
+    def snapshot(self, backends=BACKENDS):
+        """(etag, json body, gzipped body) of the listings of `backends`.
+
+        Only a backend with no listing in memory or on disk is waited for;
+        a stale one is returned as-is and refreshed in the background. The
+        body is encoded once per change, not once per request.
+        """
+        backends = tuple(backends)
+        for backend in backends:
+            self._ensure(backend)
+        with self._lock:
+            listings = [self.listings[backend] for backend in backends]
+            # Counted, not id(listing.models): a new list can reuse a freed one's id
+            versions = tuple(listing.refreshes for listing in listings)
+            cached = self._encoded.get(backends)
+            if cached is None or cached[0] != versions:
+                body = json.dumps({"models": [m for listing in listings for m in listing.models],
+                                   "errors": {b: l.error for b, l in zip(backends, listings) if l.error}},
+                                  ensure_ascii=False, separators=(",", ":")).encode()
+                etag = hashlib.sha256(body).hexdigest()[:32]
+                cached = self._encoded[backends] = (versions, etag, body, gzip.compress(body, mtime=0))
+            return cached[1:]
+
+    def _run(self, backend):
+        listing = self.listings[backend]
+        while True:
+            listing.wake.wait(max(1.0, self.ttl - listing.age()))
+            listing.wake.clear()
+            try:
+                self.refresh(backend, self.ttl)
+            except Exception:
+                pass
+
+    def start(self, *backends):
+        """Keep `backends` (default: all) refreshed in the background, each on its own thread"""
+        for backend in backends or BACKENDS:
+            listing = self.listings[backend]
+            # Not listing.lock: a refresh in progress holds that one
+            with self._lock:
+                if listing.thread is None:
+                    listing.thread = threading.Thread(target=self._run, args=(backend,), daemon=True)
+                    listing.thread.start()
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {backend: {"models": len(listing.models),
+                              "age": round(listing.age(), 1) if listing.updated else None,
+                              "refreshes": listing.refreshes, "error": listing.error}
+                    for backend, listing in self.listings.items()}
+
+
+def http_response(if_none_match="", accept_encoding="", backends=BACKENDS):
+    """(status, headers, body) answering a GET for the listings of `backends`, for any web framework.
+
+    A matching If-None-Match gets an empty 304, and clients that accept gzip
+    get the pre-compressed body. Each encoding has its own ETag.
+    """
+    etag, body, gzipped = get_model_catalog().snapshot(backends)
+    use_gzip = "gzip" in (accept_encoding or "")
+    etag = f'"{etag}-gzip"' if use_gzip else f'"{etag}"'
+    # Revalidate every time: a 304 costs nothing and the picker sees new models at once
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    tags = {tag.strip().removeprefix("W/") for tag in (if_none_match or "").split(",")}
+    if etag in tags or "*" in tags:
+        return 304, headers, b""
+    headers["Content-Type"] = "application/json"
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return 200, headers, gzipped
+    return 200, headers, body
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_model_catalog():
+    """Return the process-wide ModelCatalog"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ModelCatalog()
+    return _catalog
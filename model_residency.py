@@ -0,0 +1,210 @@
+"""
+Model residency manager
+Preloads the configured models, keeps recently used ones loaded through
+Ollama's keep_alive, tracks what is resident via /api/ps and unloads the
+least recently used models when a memory budget is exceeded. Behind the
+load balancer each backend is an Ollama instance of its own, with its own
+memory, so all of this is done backend by backend.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from ollama_client import OllamaClient, get_client
+
+PRELOAD_MODELS = [m.strip() for m in os.getenv("OLLAMA_PRELOAD", "tinyllama").split(",") if m.strip()]
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Bytes of model memory we allow resident at once; 0 means no limit
+MEMORY_BUDGET = int(os.getenv("OLLAMA_MEMORY_BUDGET", "0"))
+REFRESH_INTERVAL = 60
+# A model counts as hot, and gets re-pinned, if it was used this recently
+HOT_WINDOW = 15 * 60
+# Ollama reports a few ms of load_duration even for resident models
+COLD_START_SECONDS = 0.5
+
+
+def _base_name(model):
+    return model if ":" in model else f"{model}:latest"
+
+
+class ResidencyManager:
+    """Keeps hot models resident in Ollama and counts cold starts"""
+
+    def __init__(self, client=None, models=PRELOAD_MODELS, keep_alive=KEEP_ALIVE,
+                 memory_budget=MEMORY_BUDGET):
+        self.client = client or get_client()
+        self.models = list(models)
+        self.keep_alive = keep_alive
+        self.memory_budget = memory_budget
+        # Instance URL -> {model name: /api/ps entry}
+        self.resident = {}
+        self.last_used = OrderedDict()
+        self.cold_starts = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._backend_clients = {}
+
+    def instances(self, model=None):
+        """(url, client) for each Ollama instance, or each that has `model` installed.
+
+        A BalancedClient would send a request to whichever backend it picks,
+        so each of its backends gets a client of its own here.
+        """
+        backends = getattr(self.client, "backends", None)
+        if not backends:
+            return [(self.client.base_url, self.client)]
+        with self._lock:
+            for backend in backends:
+                if backend.url not in self._backend_clients:
+                    self._backend_clients[backend.url] = OllamaClient(
+                        backend.url, pool_size=1, max_retries=self.client.max_retries, backoff=self.client.backoff)
+        return [(b.url, self._backend_clients[b.url]) for b in backends if model is None or b.has(model)]
+
+    def refresh(self):
+        """Update each instance's resident set from its /api/ps.
+
+        Instances that can't be reached are left out; it raises only if
+        none can be.
+        """
+        resident = {}
+        error = None
+        for url, client in self.instances():
+            try:
+                response = client.get("/api/ps")
+                response.raise_for_status()
+                resident[url] = {m["name"]: m for m in response.json().get("models", [])}
+            except Exception as e:
+                error = e
+        if error is not None and not resident:
+            raise error
+        with self._lock:
+            self.resident = resident
+        return resident
+
+    def _load(self, client, model, keep_alive):
+        # An empty prompt loads the model without generating anything; it
+        # should not hold up anyone's answer, nor count as a generation
+        response = client.post("/api/generate", priority="prefetch", measured=False, json={
+            "model": model, "prompt": "", "stream": False, "keep_alive": keep_alive})
+        response.raise_for_status()
+        return response.json()
+
+    def preload(self, models=None):
+        """Load each model on every instance that has it, and pin it with keep_alive"""
+        for model in models or self.models:
+            loaded = False
+            for _, client in self.instances(model):
+                try:
+                    self._load(client, model, self.keep_alive)
+                    loaded = True
+                except Exception:
+                    continue
+            if loaded:
+                # Loaded ahead of time, so not a cold start anyone waited for
+                self.touch(model)
+        self.enforce_budget()
+
+    def touch(self, model):
+        """Mark a model as just used"""
+        with self._lock:
+            self.last_used[_base_name(model)] = time.monotonic()
+            self.last_used.move_to_end(_base_name(model))
+
+    def observe(self, model, result):
+        """Record a finished Ollama response; counts it if the model had to load"""
+        load_seconds = (result.get("load_duration") or 0) / 1e9
+        if load_seconds >= COLD_START_SECONDS:
+            with self._lock:
+                self.cold_starts += 1
+                self.load_seconds += load_seconds
+
+    def enforce_budget(self):
+        """Unload least recently used models until each instance's resident set fits the budget"""
+        if not self.memory_budget:
+            return
+        resident = self.refresh()
+        for url, client in self.instances():
+            models = resident.get(url, {})
+            used = sum(m.get("size", 0) for m in models.values())
+            with self._lock:
+                # Never-used models first, then from least to most recently used
+                order = [name for name in models if name not in self.last_used]
+                order += [name for name in self.last_used if name in models]
+            for name in order[:-1]:
+                if used <= self.memory_budget:
+                    break
+                try:
+                    self._load(client, name, 0)
+                except Exception:
+                    continue
+                used -= models[name].get("size", 0)
+                self.evictions += 1
+        self.refresh()
+
+    def _repin_hot(self):
+        """Reload hot models an instance has dropped, e.g. to make room for another"""
+        now = time.monotonic()
+        with self._lock:
+            hot = [name for name, used in self.last_used.items() if now - used < HOT_WINDOW]
+            resident = self.resident
+        for name in hot:
+            for url, client in self.instances(name):
+                # Resident ones need nothing: each use renews their keep_alive
+                if url not in resident or name in resident[url]:
+                    continue
+                try:
+                    self._load(client, name, self.keep_alive)
+                except Exception:
+                    pass
+
+    def _run(self, interval):
+        try:
+            self.preload()
+        except Exception:
+            pass
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+                self._repin_hot()
+                self.enforce_budget()
+            except Exception:
+                pass
+
+    def start(self, interval=REFRESH_INTERVAL):
+        """Preload in the background and keep hot models resident"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+                self._thread.start()
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": {url: {name: {"size": m.get("size", 0), "expires_at": m.get("expires_at")}
+                                   for name, m in models.items()}
+                             for url, models in self.resident.items()},
+                "cold_starts": self.cold_starts,
+                "load_seconds": round(self.load_seconds, 3),
+                "evictions": self.evictions,
+                "memory_budget": self.memory_budget,
+            }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_residency_manager():
+    """Return the process-wide ResidencyManager, started on first use"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ResidencyManager().start()
+    return _manager
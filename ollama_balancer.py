@@ -0,0 +1,185 @@
+"""
+Load balancer over several Ollama backends
+Health-checks each backend through /api/tags and /api/ps, and routes every
+request for a model to a healthy backend that has it. The backend with the
+fewest outstanding requests wins, with a preference for backends that
+already hold the model in memory. Connection errors and 5xx responses fail
+over to the next backend.
+
+Enable with OLLAMA_HOSTS=http://gpu1:11434,http://gpu2:11434
+"""
+
+import os
+import random
+import threading
+import time
+
+import requests
+
+from ollama_client import OllamaClient
+
+OLLAMA_HOSTS = [h.strip().rstrip("/") for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]
+HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+HEALTH_TIMEOUT = 2
+# A resident model is worth this many queued requests: loading it elsewhere
+# costs seconds, a queued request on the warm backend usually less
+AFFINITY_BONUS = 2
+
+
+def _base_name(model):
+    return model if ":" in model else f"{model}:latest"
+
+
+class Backend:
+    """One Ollama instance and what we last learned about it"""
+
+    def __init__(self, url):
+        self.url = url if url.startswith("http") else "http://" + url
+        self.healthy = True
+        self.checked = False
+        self.models = set()
+        self.resident = set()
+        self.outstanding = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+
+    def end(self):
+        with self._lock:
+            self.outstanding -= 1
+
+    def mark_down(self):
+        with self._lock:
+            self.healthy = False
+            self.failures += 1
+
+    def has(self, model):
+        # Before the first health check we don't know, so assume it might
+        return not self.checked or _base_name(model) in self.models
+
+    def stats(self):
+        return {"healthy": self.healthy, "outstanding": self.outstanding, "failures": self.failures,
+                "models": sorted(self.models), "resident": sorted(self.resident)}
+
+
+class BalancedClient(OllamaClient):
+    """OllamaClient that spreads requests over several backends"""
+
+    def __init__(self, hosts=OLLAMA_HOSTS, health_interval=HEALTH_INTERVAL, **kwargs):
+        super().__init__(hosts[0], **kwargs)
+        self.backends = [Backend(url) for url in hosts]
+        self.health_interval = health_interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def check(self, backend):
+        """Refresh one backend's health, installed models and resident models"""
+        try:
+            tags = self.session.get(f"{backend.url}/api/tags", timeout=HEALTH_TIMEOUT)
+            tags.raise_for_status()
+            models = {m["name"] for m in tags.json().get("models", [])}
+            ps = self.session.get(f"{backend.url}/api/ps", timeout=HEALTH_TIMEOUT)
+            resident = {m["name"] for m in ps.json().get("models", [])} if ps.ok else set()
+        except (requests.RequestException, ValueError):
+            backend.mark_down()
+            backend.checked = True
+            return
+        backend.models = models
+        backend.resident = resident
+        backend.healthy = True
+        backend.checked = True
+
+    def check_all(self):
+        for backend in self.backends:
+            self.check(backend)
+
+    def _run(self):
+        while True:
+            self.check_all()
+            time.sleep(self.health_interval)
+
+    def start(self):
+        """Health-check in the background from now on"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self
+
+    def pick(self, model=None, exclude=()):
+        """Choose the backend for a request; None once every backend is excluded"""
+        backends = [b for b in self.backends if b not in exclude]
+        if not backends:
+            return None
+        candidates = [b for b in backends if b.healthy] or backends
+        if model:
+            candidates = [b for b in candidates if b.has(model)] or candidates
+
+        def load(backend):
+            warm = model is not None and _base_name(model) in backend.resident
+            return backend.outstanding - (AFFINITY_BONUS if warm else 0)
+
+        best = min(load(b) for b in candidates)
+        backend = random.choice([b for b in candidates if load(b) == best])
+        if model:
+            # It will be loaded there now; keep routing the model to it
+            backend.resident.add(_base_name(model))
+        return backend
+
+    def _send(self, method, path, timeout=None, **kwargs):
+        model = (kwargs.get("json") or {}).get("model")
+        timeout = timeout or self.timeout
+        tried = []
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            backend = self.pick(model, exclude=tried)
+            if backend is None:
+                # Every backend failed once; back off and start over
+                tried = []
+                self._sleep_before_retry(attempt)
+                backend = self.pick(model)
+            tried.append(backend)
+            backend.begin()
+            try:
+                response = self.session.request(method, f"{backend.url}{path}", timeout=timeout, **kwargs)
+            except requests.ConnectionError:
+                backend.end()
+                backend.mark_down()
+                if last_attempt:
+                    raise
+                continue
+            except BaseException:
+                # e.g. a read timeout or ollama_client.Cancelled: the request is over, but the backend isn't down
+                backend.end()
+                raise
+            if response.status_code >= 500 and not last_attempt:
+                response.close()
+                backend.end()
+                continue
+            if kwargs.get("stream"):
+                # The request is outstanding until the caller closes the stream
+                _release_on_close(response, backend)
+            else:
+                backend.end()
+            return response
+
+    def stats(self):
+        return {backend.url: backend.stats() for backend in self.backends}
+
+
+def _release_on_close(response, backend):
+    close = response.close
+    released = threading.Event()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                backend.end()
+
+    response.close = close_and_release
@@ -0,0 +1,346 @@
+"""
+Shared Ollama client
+Keep-alive connection pool, timeouts and retries for every app in this repo.
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+from scheduler import get_scheduler
+
+OLLAMA_API = os.getenv("OLLAMA_HOST", "http://localhost:11434").rstrip("/")
+if not OLLAMA_API.startswith("http"):
+    OLLAMA_API = "http://" + OLLAMA_API
+
+POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "3"))
+BACKOFF = float(os.getenv("OLLAMA_BACKOFF", "0.25"))
+
+# Endpoints whose responses carry Ollama's timing fields
+GENERATION_PATHS = ("/api/generate", "/api/chat")
+
+
+class StreamFinished(Exception):
+    """Thrown into a stream by finish(): the caller has everything it wanted"""
+
+
+def finish(stream):
+    """End `stream` because its answer is complete, e.g. at a closing code fence.
+
+    Like closing it, this stops the generation, but it is recorded as a
+    finished response instead of a cancellation.
+    """
+    try:
+        stream.throw(StreamFinished())
+    except (StreamFinished, StopIteration):
+        pass
+
+
+class Cancel:
+    """Ends streams from another thread, e.g. ones nobody is waiting for any more.
+
+    Checked like a threading.Event. Setting it also shuts down the
+    connection of every stream it was passed to. Ollama sends nothing, not
+    even headers, until the first token, so this is the only way to end a
+    stream that is still loading its model or evaluating its prompt and
+    give its scheduler slot back at once.
+    """
+
+    def __init__(self):
+        self._set = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return self._set
+
+    def set(self):
+        with self._lock:
+            self._set = True
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            try:
+                # close() doesn't wake a thread blocked reading the socket; shutdown() does
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except (AttributeError, OSError):
+                pass
+
+    def _attach(self, connection):
+        """Shut down `connection` when set, until detached; False if already set"""
+        with self._lock:
+            if self._set:
+                return False
+            self._connections.add(connection)
+            return True
+
+    def _detach(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+
+class Cancelled(Exception):
+    """A request's Cancel was set before its response arrived"""
+
+
+# The Cancel of the stream being sent from this thread, for the connection to pick up
+_sending = threading.local()
+
+
+class _CancellableConnection:
+    """urllib3 connection that a Cancel can shut down while it waits for a response"""
+
+    cancel = None
+
+    def request(self, *args, **kwargs):
+        self.cancel = getattr(_sending, "cancel", None)
+        if self.cancel is not None:
+            previous = getattr(_sending, "connection", None)
+            if previous is not None:
+                # An earlier attempt; urllib3 has closed or pooled it, and a pooled one may serve someone else
+                self.cancel._detach(previous)
+            _sending.connection = self
+            if not self.cancel._attach(self):
+                raise Cancelled()
+        return super().request(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        try:
+            return super().getresponse(*args, **kwargs)
+        except Exception:
+            # Raised as itself so that neither retries nor the balancer take it for a dead backend
+            if self.cancel is not None and self.cancel.is_set():
+                raise Cancelled() from None
+            raise
+
+
+class _HTTPConnection(_CancellableConnection, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CancellableConnection, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _Adapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPConnectionPool, "https": _HTTPSConnectionPool}
+
+
+class OllamaClient:
+    """Pooled HTTP client for the Ollama REST API"""
+
+    def __init__(self, base_url=OLLAMA_API, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff=BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Requests currently open, streams included; background work waits for 0
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = _Adapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                           pool_block=False, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spread retries out so parallel callers don't stampede
+        delay = self.backoff * (2 ** attempt)
+        time.sleep(random.uniform(0, delay))
+
+    def request(self, method, path, timeout=None, priority=None, client_id=None, measured=True, **kwargs):
+        """Send a request, retrying connection errors and 5xx responses.
+
+        The last 5xx response is returned as-is so callers can inspect it;
+        a connection error on the last attempt is raised. Non-streamed
+        generations wait for a scheduler slot as `priority` on behalf of
+        `client_id`, and are recorded in `metrics` once finished unless
+        `measured` is False (housekeeping such as model loads).
+        """
+        model = (kwargs.get("json") or {}).get("model")
+        counted = not kwargs.get("stream")
+        try:
+            with self._busy(counted), self._scheduled(path, counted, priority, client_id) as queue_wait:
+                # Timed from the slot on, like streams: the wait is recorded separately as queue_wait
+                started = time.perf_counter()
+                response = self._send(method, path, timeout, **kwargs)
+        except requests.RequestException as e:
+            metrics.record_error(model, type(e).__name__)
+            raise
+        if not response.ok:
+            metrics.record_error(model, f"http_{response.status_code}")
+        elif path in GENERATION_PATHS and counted and measured:
+            try:
+                metrics.record_response(model, response.json(), time.perf_counter() - started,
+                                        queue_wait=queue_wait)
+            except ValueError:
+                pass
+        return response
+
+    @contextmanager
+    def _busy(self, counted=True):
+        if not counted:
+            yield
+            return
+        with self._in_flight_lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    def _scheduled(self, path, counted=True, priority=None, client_id=None):
+        if counted and path in GENERATION_PATHS:
+            return get_scheduler().slot(priority, client_id)
+        return nullcontext()
+
+    def _send(self, method, path, timeout=None, **kwargs):
+        url = f"{self.base_url}{path}"
+        timeout = timeout or self.timeout
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.ConnectionError:
+                # Includes connect timeouts; read timeouts mean the model is busy
+                # generating and are not worth repeating
+                if last_attempt:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            if response.status_code >= 500 and not last_attempt:
+                response.close()
+                self._sleep_before_retry(attempt)
+                continue
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def stream(self, path, payload, priority=None, client_id=None, cancel=None, **kwargs):
+        """POST a streaming request and yield each NDJSON chunk as a dict.
+
+        The upstream response is closed when the generator is closed, so a
+        caller that stops iterating early also stops the generation; that
+        is recorded as a cancellation. A scheduler slot is held until then.
+        Streamlit ends a rerun or Stop by raising out of the script's next
+        `st` call, so a page that iterates inside closing() stops an
+        abandoned generation with no handling of its own. A stream can also
+        be ended from another thread through a Cancel passed as `cancel`;
+        it then simply stops yielding.
+        """
+        with self._busy(), self._scheduled(path, True, priority, client_id) as queue_wait:
+            yield from self._stream(path, payload, queue_wait, cancel, **kwargs)
+
+    def _stream(self, path, payload, queue_wait=None, cancel=None, **kwargs):
+        if cancel is not None and cancel.is_set():
+            # Cancelled while waiting for a slot; nothing was sent
+            return
+        started = time.perf_counter()
+        ttft = None
+        generated = 0
+        finished = False
+        _sending.cancel = cancel
+        try:
+            response = self.post(path, json={**payload, "stream": True}, stream=True, **kwargs)
+        except Cancelled:
+            metrics.record_cancel(payload.get("model"), 0)
+            return
+        finally:
+            _sending.cancel = None
+            connection = _sending.__dict__.pop("connection", None)
+        if not response.ok:
+            if connection is not None:
+                cancel._detach(connection)
+            response.close()
+            response.raise_for_status()
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                if chunk.get("done"):
+                    finished = True
+                    metrics.record_response(payload.get("model"), chunk,
+                                            time.perf_counter() - started, ttft, queue_wait)
+                elif chunk.get("error"):
+                    metrics.record_error(payload.get("model"), "stream")
+                    finished = True
+                else:
+                    generated += 1
+                yield chunk
+        except StreamFinished:
+            # No final chunk to take token counts from; timings are all there is
+            metrics.record_response(payload.get("model"), {}, time.perf_counter() - started, ttft, queue_wait)
+        except GeneratorExit:
+            if not finished:
+                metrics.record_cancel(payload.get("model"), generated)
+            raise
+        except Exception as e:
+            if cancel is not None and cancel.is_set():
+                # Shut down from another thread by Cancel.set()
+                metrics.record_cancel(payload.get("model"), generated)
+                return
+            if isinstance(e, requests.RequestException):
+                metrics.record_error(payload.get("model"), type(e).__name__)
+            raise
+        finally:
+            if connection is not None:
+                cancel._detach(connection)
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide OllamaClient, creating it on first use.
+
+    With OLLAMA_HOSTS set this is a BalancedClient over those backends.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if os.getenv("OLLAMA_HOSTS"):
+                    # Imported here because the balancer builds on OllamaClient
+                    from ollama_balancer import BalancedClient
+                    _client = BalancedClient().start()
+                else:
+                    _client = OllamaClient()
+    return _client
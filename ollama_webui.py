@@ -5,13 +5,32 @@ Access at: http://localhost:8080
 """
 
 import json
-import requests
-from flask import Flask, render_template_string, request, jsonify, Response
+import sys
+from contextlib import closing
+from flask import Flask, render_template_string, request, jsonify, Response, stream_with_context
 import threading
 
+import metrics
+import model_catalog
+from ollama_balancer import OLLAMA_HOSTS
+from model_residency import KEEP_ALIVE, PRELOAD_MODELS, get_residency_manager
+from ollama_client import OLLAMA_API, get_client
+from semantic_cache import SEMANTIC_CACHE, get_semantic_cache
+from session_store import SessionStore
+from singleflight import SingleFlight, flight_key
+
 app = Flask(__name__)
 
-OLLAMA_API = "http://localhost:11434"
+# Ollama's context grows with every turn; past this many tokens the session
+# is re-seeded from its recent transcript instead
+MAX_CONTEXT_TOKENS = 1536
+RESEED_MESSAGES = 6
+
+sessions = SessionStore(max_sessions=1000, idle_ttl=1800)
+# Identical concurrent turns (same model, prompt and context) share one generation
+inflight = SingleFlight()
+
+metrics.set_app_name("webui")
 
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -57,7 +76,15 @@ HTML_TEMPLATE = '''
     </div>
 
     <script>
-        let chatHistory = [];
+        // History lives on the server; the page only keeps its session id
+        let sessionId = newSessionId();
+        // Aborting the in-flight request ends its generation on the server too
+        let controller = null;
+        
+        function newSessionId() {
+            if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+            return Date.now().toString(36) + Math.random().toString(36).slice(2);
+        }
         
         // Load available models
         fetch('/api/models')
@@ -68,7 +95,8 @@ HTML_TEMPLATE = '''
                 data.models.forEach(m => {
                     const option = document.createElement('option');
                     option.value = m.name;
-                    option.textContent = m.name + ' (' + formatSize(m.size) + ')';
+                    option.textContent = (m.resident ? '● ' : '') + m.name + ' (' + formatSize(m.size) + ')';
+                    if (m.resident) option.title = 'Loaded, answers without a cold start';
                     select.appendChild(option);
                 });
             });
@@ -87,6 +115,31 @@ HTML_TEMPLATE = '''
             msgDiv.textContent = content;
             chatBox.appendChild(msgDiv);
             chatBox.scrollTop = chatBox.scrollHeight;
+            return msgDiv;
+        }
+        
+        // Read a text/event-stream body and call onEvent(event, data) per event
+        async function readEvents(response, onEvent) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const {value, done} = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, {stream: true});
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const raw = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let event = 'message';
+                    let data = '';
+                    raw.split('\\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) data += line.slice(5).trim();
+                    });
+                    if (data) onEvent(event, JSON.parse(data));
+                }
+            }
         }
         
         async function sendMessage() {
@@ -106,34 +159,55 @@ HTML_TEMPLATE = '''
             loadingDiv.textContent = 'Thinking...';
             document.getElementById('chat').appendChild(loadingDiv);
             
+            controller = new AbortController();
             try {
                 const response = await fetch('/api/chat', {
                     method: 'POST',
                     headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({model: model, prompt: userMessage, history: chatHistory})
+                    body: JSON.stringify({model: model, prompt: userMessage, session_id: sessionId, stream: true}),
+                    signal: controller.signal
                 });
                 
-                loadingDiv.remove();
-                
                 if (response.ok) {
-                    const data = await response.json();
-                    addMessage('assistant', data.response);
-                    chatHistory.push({role: 'user', content: userMessage});
-                    chatHistory.push({role: 'assistant', content: data.response});
+                    let msgDiv = null;
+                    let reply = '';
+                    await readEvents(response, (event, data) => {
+                        if (event === 'error') {
+                            reply += '\\nError: ' + data.error;
+                        } else if (data.token) {
+                            reply += data.token;
+                        }
+                        if (!msgDiv) {
+                            loadingDiv.remove();
+                            msgDiv = addMessage('assistant', '');
+                        }
+                        msgDiv.textContent = reply;
+                        const chatBox = document.getElementById('chat');
+                        chatBox.scrollTop = chatBox.scrollHeight;
+                    });
+                    loadingDiv.remove();
+                } else if (response.status === 429) {
+                    loadingDiv.remove();
+                    const retry = response.headers.get('Retry-After') || 'a few';
+                    addMessage('assistant', 'The server is busy, please try again in ' + retry + ' seconds.');
                 } else {
+                    loadingDiv.remove();
                     addMessage('assistant', 'Error: ' + response.statusText);
                 }
             } catch (error) {
                 loadingDiv.remove();
-                addMessage('assistant', 'Error: ' + error.message);
+                if (error.name !== 'AbortError') addMessage('assistant', 'Error: ' + error.message);
             }
             
+            controller = null;
             sendBtn.disabled = false;
         }
         
         function clearChat() {
+            if (controller) controller.abort();
             document.getElementById('chat').innerHTML = '';
-            chatHistory = [];
+            fetch('/api/session/' + encodeURIComponent(sessionId), {method: 'DELETE'});
+            sessionId = newSessionId();
         }
     </script>
 </body>
@@ -147,41 +221,212 @@ def index():
 @app.route('/api/models')
 def get_models():
     try:
-        response = requests.get(f"{OLLAMA_API}/api/tags")
-        return jsonify(response.json())
+        # Chat only goes to Ollama, so the picker never waits on Gemini
+        status, headers, body = model_catalog.http_response(request.headers.get('If-None-Match'),
+                                                            request.headers.get('Accept-Encoding'), ("ollama",))
+        return Response(body, status=status, headers=headers)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def sse(data, event=None):
+    """Format one Server-Sent Event"""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+def turn_payload(session, model, prompt):
+    """Build a /api/generate payload that only carries the new turn.
+
+    The session itself is left alone; add_turn() updates it once the turn
+    has succeeded.
+    """
+    # Context tokens are model-specific and grow every turn, and a turn
+    # answered from the cache has none; start a fresh context from the
+    # recent transcript instead
+    if session.messages and (session.model != model or not session.context
+                             or len(session.context) > MAX_CONTEXT_TOKENS):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in session.messages[-RESEED_MESSAGES:])
+        return {"model": model, "prompt": f"Conversation so far:\n{transcript}\n\nuser: {prompt}",
+                "keep_alive": KEEP_ALIVE}
+    payload = {"model": model, "prompt": prompt, "keep_alive": KEEP_ALIVE}
+    if session.context:
+        payload["context"] = session.context
+    return payload
+
+def semantic_lookup(session, model, prompt):
+    """Cached answer for the opening question of a conversation, if any"""
+    if not SEMANTIC_CACHE or session.messages:
+        return None
+    return get_semantic_cache().lookup(f"webui:{model}", prompt)
+
+def join_generation(payload, priority=None, client_id=None):
+    """Follow the upstream generation for `payload`; returns (chunks, leader)"""
+    # Only a new generation waits for a scheduler slot; followers don't
+    flight, leader = inflight.join(flight_key(payload), lambda cancel: get_client().stream(
+        "/api/generate", payload, priority=priority, client_id=client_id, cancel=cancel))
+    return flight.follow(), leader
+
+def stream_chat(session, model, prompt, priority=None):
+    """Relay Ollama's NDJSON token stream as Server-Sent Events"""
+    with session.lock:
+        reply = ""
+        try:
+            cached = semantic_lookup(session, model, prompt)
+            if cached is not None:
+                session.add_turn(prompt, cached, None, model)
+                yield sse({"token": cached})
+                yield sse({"done": True, "session_id": session.id, "cached": True})
+                return
+            fresh = not session.messages
+            get_residency_manager().touch(model)
+            chunks, leader = join_generation(turn_payload(session, model, prompt), priority, session.id)
+            # Leaving this block, the browser disconnecting included, stops
+            # following the flight; the last follower to leave ends it
+            with closing(chunks):
+                for chunk in chunks:
+                    if session.closed:
+                        # The chat was cleared mid-answer
+                        return
+                    if chunk.get('error'):
+                        yield sse({"error": chunk['error']}, event="error")
+                        return
+                    if chunk.get('done'):
+                        session.add_turn(prompt, reply, chunk.get('context'), model)
+                        # Followers got the leader's tokens; count the generation once
+                        if leader:
+                            get_residency_manager().observe(model, chunk)
+                        if fresh and leader and SEMANTIC_CACHE:
+                            get_semantic_cache().store(f"webui:{model}", prompt, reply)
+                        stats = {k: v for k, v in chunk.items() if k.endswith(('_count', '_duration'))}
+                        yield sse({"done": True, "session_id": session.id, **stats})
+                    else:
+                        reply += chunk.get('response', '')
+                        yield sse({"token": chunk.get('response', '')})
+        except Exception as e:
+            yield sse({"error": str(e)}, event="error")
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
         data = request.json
         model = data.get('model')
         prompt = data.get('prompt')
+        session = sessions.get(data.get('session_id'))
+        # API clients may ask for "batch" or "prefetch"; the page is interactive
+        priority = data.get('priority')
         
-        response = requests.post(
-            f"{OLLAMA_API}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            }
-        )
+        if data.get('stream'):
+            return Response(
+                stream_with_context(stream_chat(session, model, prompt, priority)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
-        if response.ok:
-            result = response.json()
-            return jsonify({"response": result.get('response', '')})
-        else:
-            return jsonify({"error": "Ollama API error"}), 500
+        with session.lock:
+            cached = semantic_lookup(session, model, prompt)
+            if cached is not None:
+                session.add_turn(prompt, cached, None, model)
+                return jsonify({"response": cached, "session_id": session.id, "cached": True})
             
+            fresh = not session.messages
+            get_residency_manager().touch(model)
+            # Non-streamed requests follow the same flights as streamed ones
+            chunks, leader = join_generation(turn_payload(session, model, prompt), priority, session.id)
+            reply = ""
+            for chunk in chunks:
+                if chunk.get('error'):
+                    return jsonify({"error": chunk['error']}), 500
+                if chunk.get('done'):
+                    session.add_turn(prompt, reply, chunk.get('context'), model)
+                    if leader:
+                        get_residency_manager().observe(model, chunk)
+                    if fresh and leader and SEMANTIC_CACHE:
+                        get_semantic_cache().store(f"webui:{model}", prompt, reply)
+                else:
+                    reply += chunk.get('response', '')
+            return jsonify({"response": reply, "session_id": session.id})
+            
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/residency')
+def residency():
+    try:
+        manager = get_residency_manager()
+        manager.refresh()
+        return jsonify(manager.stats())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def collect_stats():
+    """Gauges and counters owned by other components, read at scrape time"""
+    residency = get_residency_manager().stats()
+    families = [
+        ("webui_sessions", "gauge", "Live chat sessions", [({}, len(sessions))]),
+        ("webui_generations_total", "counter", "Upstream generations started by chat requests",
+         [({}, inflight.leaders)]),
+        ("webui_coalesced_requests_total", "counter", "Chat requests that joined an identical generation",
+         [({}, inflight.coalesced)]),
+        ("ollama_resident_models", "gauge", "Models loaded in Ollama",
+         [({"backend": url}, len(models)) for url, models in residency["resident"].items()]),
+        ("ollama_cold_starts_total", "counter", "Requests that had to load their model",
+         [({}, residency["cold_starts"])]),
+        ("ollama_cold_start_seconds_total", "counter", "Time spent loading models on request",
+         [({}, residency["load_seconds"])]),
+        ("ollama_evictions_total", "counter", "Models unloaded to fit the memory budget",
+         [({}, residency["evictions"])]),
+    ]
+    catalog = model_catalog.get_model_catalog().stats()
+    families.append(("model_catalog_age_seconds", "gauge", "Age of the cached model listing",
+                     [({"backend": b}, c["age"]) for b, c in catalog.items() if c["age"] is not None]))
+    families.append(("model_catalog_refreshes_total", "counter", "Model listing refreshes",
+                     [({"backend": b}, c["refreshes"]) for b, c in catalog.items()]))
+    if OLLAMA_HOSTS:
+        backends = get_client().stats()
+        families.append(("ollama_backend_healthy", "gauge", "Whether the backend passed its last health check",
+                         [({"backend": url}, int(b["healthy"])) for url, b in backends.items()]))
+        families.append(("ollama_backend_outstanding", "gauge", "Requests in flight per backend",
+                         [({"backend": url}, b["outstanding"]) for url, b in backends.items()]))
+    if SEMANTIC_CACHE:
+        semantic = get_semantic_cache().stats()
+        families.append(("semantic_cache_requests_total", "counter", "Semantic cache lookups",
+                         [({"result": "hit"}, semantic["hits"]), ({"result": "miss"}, semantic["misses"]),
+                          ({"result": "error"}, semantic["errors"])]))
+        families.append(("semantic_cache_entries", "gauge", "Prompts in the semantic cache",
+                         [({}, semantic["entries"])]))
+    return families
+
+metrics.REGISTRY.register_collector(collect_stats)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/backends')
+def backends():
+    if not OLLAMA_HOSTS:
+        return jsonify({OLLAMA_API: {"healthy": True}})
+    return jsonify(get_client().stats())
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def clear_session(session_id):
+    sessions.drop(session_id)
+    return jsonify({"cleared": session_id})
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("🦙 Ollama Web UI Starting...")
     print("="*50)
     print(f"\n✅ Access the interface at: http://localhost:8080")
-    print(f"✅ Ollama API: {OLLAMA_API}")
+    print(f"✅ Ollama API: {', '.join(OLLAMA_HOSTS) or OLLAMA_API}")
+    print(f"✅ Preloading models: {', '.join(PRELOAD_MODELS) or 'none'}")
     print("\nPress Ctrl+C to stop\n")
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    if '--async' in sys.argv:
+        # asyncio + aiohttp with per-model queues and admission control
+        from async_engine import serve
+        serve(host='0.0.0.0', port=8080)
+    else:
+        get_residency_manager()
+        model_catalog.get_model_catalog().start("ollama")
+        app.run(host='0.0.0.0', port=8080, debug=False)
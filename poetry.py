@@ -1,39 +1,72 @@
 import streamlit as st
-import time
 import requests
-import json
+from contextlib import closing
 
-def generate_poetry(topic):
+import metrics
+from model_residency import KEEP_ALIVE, get_residency_manager
+from ollama_client import get_client
+from prompts import poem_prompt
+from response_cache import get_cache, should_cache
+from semantic_cache import SEMANTIC_CACHE, get_semantic_cache
+from stream_writer import StreamWriter
+
+MODEL = "tinyllama"
+
+def generate_poetry(topic, use_cache=False):
     if topic:
-        msg = st.toast("Gathering inspiration...")
-        time.sleep(1)
+        prompt = poem_prompt(topic)
+        cache = get_cache()
+        cached = cache.get(MODEL, prompt) if should_cache(force=use_cache) else None
+        if cached is None and SEMANTIC_CACHE:
+            # "rain" and "the rain" should get the same poem
+            cached = get_semantic_cache().lookup(f"poetry:{MODEL}", topic)
+        if cached is not None:
+            st.write(f"**Your theme:** {topic}")
+            st.write("---")
+            st.toast("Poetry ready!", icon="✨")
+            st.write(cached)
+            return
+        
         msg = st.toast("Crafting verses...")
         
         st.write(f"**Your theme:** {topic}")
         st.write("---")
         
         # Call Ollama API
-        url = "http://localhost:11434/api/generate"
         payload = {
-            "model": "tinyllama",
-            "prompt": f"Write a beautiful poem about {topic}. Make it emotional and vivid.",
-            "stream": False
+            "model": MODEL,
+            "prompt": prompt,
+            "keep_alive": KEEP_ALIVE
         }
         
+        residency = get_residency_manager()
+        residency.touch(MODEL)
+        writer = StreamWriter()
         try:
-            response = requests.post(url, json=payload)
-            if response.status_code == 200:
-                result = response.json()
-                st.toast("Poetry ready!", icon="✨")
-                st.write(result['response'])
-            else:
-                st.error(f"Error: {response.status_code}")
+            with closing(get_client().stream("/api/generate", payload)) as chunks:
+                for chunk in chunks:
+                    if chunk.get('error'):
+                        st.error(f"Error: {chunk['error']}")
+                        return
+                    writer.write(chunk.get('response', ''))
+                    if chunk.get('done'):
+                        residency.observe(MODEL, chunk)
+            poem = writer.close()
+            if use_cache:
+                cache.put(MODEL, prompt, None, poem)
+            if SEMANTIC_CACHE:
+                get_semantic_cache().store(f"poetry:{MODEL}", topic, poem)
+            st.toast("Poetry ready!", icon="✨")
+        except requests.HTTPError as e:
+            st.error(f"Error: {e.response.status_code}")
         except Exception as e:
             st.error(f"Connection error: {e}")
 
 if __name__=="__main__":
+    metrics.set_app_name("poetry")
     st.title("✨ Poetry Generator")
     st.markdown("Enter a theme and let AI create a poem for you")
     st.markdown("*Powered by Ollama (TinyLlama)*")
+    use_cache = st.checkbox("♻️ Reuse earlier poems for the same theme", value=False)
     topic = st.chat_input("What should I write about?")
-    generate_poetry(topic)
+    generate_poetry(topic, use_cache)
@@ -0,0 +1,78 @@
+"""
+Prompt builders shared by the Streamlit apps and the batch CLI
+"""
+
+
+def poem_prompt(topic):
+    return f"Write a beautiful poem about {topic}. Make it emotional and vivid."
+
+
+def story_prompt(theme):
+    return f"""Write a short story inspired by Ruskin Bond's writing style about: {theme}
+
+The story should have these characteristics:
+- Simple, elegant prose
+- Set in the hills or mountains of India
+- Nostalgic and warm tone
+- Focus on nature, childhood memories, or simple village life
+- Observations about people, animals, or landscapes
+- Gentle humor and wisdom
+- Around 200-300 words
+
+Write the complete story:"""
+
+
+def code_completion_prompt(language, incomplete_code, instructions=""):
+    prompt = f"""You are an expert {language} programmer. Complete the following incomplete code:
+
+```{language.lower()}
+{incomplete_code}
+```
+"""
+    if instructions.strip():
+        prompt += f"\nInstructions: {instructions}\n"
+
+    prompt += f"""
+Requirements:
+- Complete the missing parts of the code
+- Follow {language} best practices and conventions
+- Add appropriate comments where needed
+- Ensure the code is functional and complete
+- Keep the existing code structure intact
+
+Provide ONLY the complete code, nothing else."""
+    return prompt
+
+
+def recipe_prompt(dish):
+    return f"Write a detailed recipe for {dish}"
+
+
+def hole_completion_prompt(language, context, snippet, instructions=""):
+    fence = language.lower()
+    prompt = f"""You are an expert {language} programmer. Complete a part of a larger file.
+
+Context from the rest of the file (for reference only):
+
+```{fence}
+{context}
+```
+
+Code to complete:
+
+```{fence}
+{snippet}
+```
+"""
+    if instructions.strip():
+        prompt += f"\nInstructions: {instructions}\n"
+
+    prompt += f"""
+Requirements:
+- Implement every TODO and empty body in the code to complete
+- Follow {language} best practices and conventions
+- Keep its names, signatures and structure intact
+- Do not repeat the context
+
+Provide ONLY the completed code, nothing else."""
+    return prompt
@@ -0,0 +1,136 @@
+"""
+Response cache for repeatable generations
+An in-process LRU in front of an SQLite file, keyed by (model, prompt, options).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "bootcamp-genai", "responses.db"))
+MEMORY_ENTRIES = 256
+MAX_ENTRIES = 10000
+TTL = 7 * 24 * 3600
+
+
+def should_cache(options=None, force=False):
+    """Cache only when asked to, or when the sampling is deterministic"""
+    return force or (options or {}).get("temperature") == 0
+
+
+def cache_key(model, prompt, options=None):
+    raw = json.dumps([model, prompt, options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier LRU cache with a TTL and a size bound on both tiers"""
+
+    def __init__(self, path=CACHE_PATH, memory_entries=MEMORY_ENTRIES,
+                 max_entries=MAX_ENTRIES, ttl=TTL):
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, response TEXT NOT NULL,
+            created REAL NOT NULL, last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, model, prompt, options=None):
+        """Return the cached response text, or None on a miss"""
+        key = cache_key(model, prompt, options)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                metrics.record_cache_lookup(model, "memory")
+                return entry[0]
+
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self.misses += 1
+                metrics.record_cache_lookup(model, None)
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            metrics.record_cache_lookup(model, "disk")
+            return row[0]
+
+    def put(self, model, prompt, options, response):
+        key = cache_key(model, prompt, options)
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                             (key, response, now, now))
+            self._evict(now)
+
+    def _remember(self, key, response, created):
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._db.execute("""DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY last_used LIMIT ?)""", (excess,))
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory),
+                "entries": entries}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide ResponseCache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def collect_cache():
+    # Lookups are counted as they happen; this only reports the size of a cache in use
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    return [("response_cache_entries", "gauge", "Responses cached, by tier",
+             [({"tier": "memory"}, stats["memory_entries"]), ({"tier": "disk"}, stats["entries"])])]
+
+
+metrics.REGISTRY.register_collector(collect_cache)
@@ -1,58 +1,79 @@
 import streamlit as st
 import requests
-import json
-import time
+from contextlib import closing
 
-def generate_ruskin_bond_story(theme):
+import metrics
+from model_residency import KEEP_ALIVE, get_residency_manager
+from ollama_client import CONNECT_TIMEOUT, get_client
+from prompts import story_prompt
+from story_pool import get_story_pool
+from stream_writer import StreamWriter
+
+MODEL = "tinyllama"
+STORY_OPTIONS = {
+    "temperature": 0.8,
+    "top_p": 0.9
+}
+PRESETS = [
+    ("🌳 A Tree", "an old tree in the mountains"),
+    ("🦜 A Bird", "a bird in the garden"),
+    ("🌧️ The Rain", "monsoon in the hills"),
+    ("👦 Childhood", "childhood memories in a hill station"),
+    ("🏘️ Village Life", "life in a small mountain village"),
+    ("🌄 Mountains", "the Himalayan mountains"),
+]
+
+def generate_ruskin_bond_story(theme, preset=False):
     """Generate a Ruskin Bond inspired story using Ollama"""
     if theme:
-        msg = st.toast("Gathering memories from the hills...")
-        time.sleep(1)
+        prompt = story_prompt(theme)
+        # Preset themes are written ahead of time while Ollama is idle
+        ready = get_story_pool([t for _, t in PRESETS], MODEL, STORY_OPTIONS).pop(theme) if preset else None
+        if ready is not None:
+            st.write(f"**Theme:** {theme}")
+            st.write("---")
+            st.markdown("### ✍️ A Tale from the Hills")
+            st.write(ready)
+            return
+        
         msg = st.toast("Crafting a nostalgic tale...")
         
         st.write(f"**Theme:** {theme}")
         st.write("---")
         
         # Call Ollama API with Ruskin Bond style prompt
-        url = "http://localhost:11434/api/generate"
-        
-        prompt = f"""Write a short story inspired by Ruskin Bond's writing style about: {theme}
-
-The story should have these characteristics:
-- Simple, elegant prose
-- Set in the hills or mountains of India
-- Nostalgic and warm tone
-- Focus on nature, childhood memories, or simple village life
-- Observations about people, animals, or landscapes
-- Gentle humor and wisdom
-- Around 200-300 words
-
-Write the complete story:"""
-        
         payload = {
-            "model": "tinyllama",
+            "model": MODEL,
             "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.8,
-                "top_p": 0.9
-            }
+            "options": STORY_OPTIONS,
+            "keep_alive": KEEP_ALIVE
         }
         
+        residency = get_residency_manager()
+        residency.touch(MODEL)
         try:
             with st.spinner("🏔️ Writing from the hills..."):
-                response = requests.post(url, json=payload, timeout=60)
-                if response.status_code == 200:
-                    result = response.json()
-                    st.toast("Story ready!", icon="📖")
-                    st.markdown("### ✍️ A Tale from the Hills")
-                    st.write(result['response'])
-                else:
-                    st.error(f"Error: {response.status_code}")
+                st.markdown("### ✍️ A Tale from the Hills")
+                writer = StreamWriter()
+                # The read timeout now applies between tokens, not to the whole story
+                stream = get_client().stream("/api/generate", payload, timeout=(CONNECT_TIMEOUT, 60))
+                with closing(stream) as chunks:
+                    for chunk in chunks:
+                        if chunk.get('error'):
+                            st.error(f"Error: {chunk['error']}")
+                            return
+                        writer.write(chunk.get('response', ''))
+                        if chunk.get('done'):
+                            residency.observe(MODEL, chunk)
+                writer.close()
+            st.toast("Story ready!", icon="📖")
+        except requests.HTTPError as e:
+            st.error(f"Error: {e.response.status_code}")
         except Exception as e:
             st.error(f"Connection error: {e}")
 
 def main():
+    metrics.set_app_name("ruskin_stories")
     st.title("📖 Ruskin Bond Story Generator")
     st.markdown("*Create stories inspired by the master storyteller of the hills*")
     st.markdown("*Powered by Ollama (TinyLlama)*")
@@ -62,33 +83,14 @@ def main():
     # Story theme options
     st.subheader("Choose a theme or write your own:")
     
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("🌳 A Tree", use_container_width=True):
-            st.session_state.theme = "an old tree in the mountains"
-    
-    with col2:
-        if st.button("🦜 A Bird", use_container_width=True):
-            st.session_state.theme = "a bird in the garden"
-    
-    with col3:
-        if st.button("🌧️ The Rain", use_container_width=True):
-            st.session_state.theme = "monsoon in the hills"
-    
-    col4, col5, col6 = st.columns(3)
-    
-    with col4:
-        if st.button("👦 Childhood", use_container_width=True):
-            st.session_state.theme = "childhood memories in a hill station"
-    
-    with col5:
-        if st.button("🏘️ Village Life", use_container_width=True):
-            st.session_state.theme = "life in a small mountain village"
+    # Starts the background worker on first load so the pool is filled before the first click
+    get_story_pool([t for _, t in PRESETS], MODEL, STORY_OPTIONS)
     
-    with col6:
-        if st.button("🌄 Mountains", use_container_width=True):
-            st.session_state.theme = "the Himalayan mountains"
+    for row in (PRESETS[:3], PRESETS[3:]):
+        for col, (label, theme) in zip(st.columns(3), row):
+            with col:
+                if st.button(label, use_container_width=True):
+                    st.session_state.theme = theme
     
     st.write("---")
     
@@ -99,7 +101,7 @@ def main():
     if st.button("✨ Generate Story", type="primary"):
         theme_to_use = custom_theme if custom_theme else st.session_state.get('theme', '')
         if theme_to_use:
-            generate_ruskin_bond_story(theme_to_use)
+            generate_ruskin_bond_story(theme_to_use, preset=not custom_theme)
         else:
             st.warning("Please select a theme or enter your own!")
     
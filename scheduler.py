@@ -0,0 +1,269 @@
+"""
+Priority scheduler for generation requests
+Every generation in a process waits here for one of a fixed number of
+slots. Waiting requests are served by priority class in proportion to the
+class weights, round-robin between clients (sessions) within a class, and a
+request that has waited longer than SCHEDULER_MAX_WAIT goes before anything
+else, so low priority work is slowed down but never starved.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import metrics
+
+# Share of the slots each class gets while all of them are waiting
+WEIGHTS = {name: float(weight) for name, weight in (
+    item.split("=") for item in os.getenv("SCHEDULER_WEIGHTS", "interactive=16,batch=4,prefetch=1").split(","))}
+DEFAULT_PRIORITY = "interactive"
+_hosts = [h for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]
+# Generations running at once; Ollama runs OLLAMA_NUM_PARALLEL per model, the rest queue there
+SLOTS = int(os.getenv("SCHEDULER_SLOTS", str(2 * max(1, len(_hosts)))))
+MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+
+WAIT_SECONDS = metrics.REGISTRY.histogram("scheduler_wait_seconds",
+                                          "Time a generation waited for a scheduler slot",
+                                          ("app", "priority"))
+
+_priority = contextvars.ContextVar("scheduler_priority", default=None)
+_client = contextvars.ContextVar("scheduler_client", default=None)
+_default_priority = DEFAULT_PRIORITY
+
+
+def set_default_priority(priority):
+    """Schedule this process's generations as `priority` unless told otherwise (e.g. batch jobs)"""
+    global _default_priority
+    if priority not in WEIGHTS:
+        raise ValueError(f"unknown priority {priority!r}")
+    _default_priority = priority
+
+
+@contextmanager
+def scheduling(priority=None, client=None):
+    """Schedule generations started in this context as `priority`, on behalf of `client`"""
+    tokens = [_priority.set(priority)] if priority else []
+    if client is not None:
+        tokens.append(_client.set(client))
+    try:
+        yield
+    finally:
+        for token in reversed(tokens):
+            token.var.reset(token)
+
+
+def resolve_priority(priority=None):
+    """`priority` if it is a known class, else the context's or the process default"""
+    if priority in WEIGHTS:
+        return priority
+    return _priority.get() or _default_priority
+
+
+class _Ticket:
+    __slots__ = ("priority", "client", "queued_at", "grant", "granted", "wait")
+
+    def __init__(self, priority, client, grant):
+        self.priority = priority
+        self.client = client
+        self.queued_at = time.monotonic()
+        self.grant = grant
+        self.granted = False
+        self.wait = 0.0
+
+
+class _Flow:
+    """One client's waiting tickets within a class"""
+    __slots__ = ("tickets", "pass_")
+
+    def __init__(self, pass_):
+        self.tickets = deque()
+        self.pass_ = pass_
+
+
+class Scheduler:
+    """Weighted fair slots: stride scheduling across classes and across clients within a class"""
+
+    def __init__(self, slots=SLOTS, weights=WEIGHTS, max_wait=MAX_WAIT, name="default"):
+        self.slots = slots
+        self.weights = dict(weights)
+        self.max_wait = max_wait
+        self.name = name
+        self.busy = 0
+        self.granted = dict.fromkeys(self.weights, 0)
+        self.promoted = 0
+        # Stride scheduling: whoever has the lowest pass goes next, and every
+        # grant advances the pass by 1 / weight
+        self._class_pass = dict.fromkeys(self.weights, 0.0)
+        self._global_pass = 0.0
+        self._flows = {p: OrderedDict() for p in self.weights}
+        self._flow_pass = dict.fromkeys(self.weights, 0.0)
+        self._lock = threading.Lock()
+        _schedulers.add(self)
+
+    def resize(self, slots):
+        """Change the number of slots, e.g. to what a batch job was asked to run at once"""
+        with self._lock:
+            self.slots = max(1, slots)
+            self._dispatch()
+
+    def _enqueue(self, priority, client, grant):
+        ticket = _Ticket(resolve_priority(priority), client if client is not None else _client.get(), grant)
+        with self._lock:
+            flows = self._flows[ticket.priority]
+            if not flows:
+                # An idle class rejoins at the current pass instead of cashing in idle time
+                self._class_pass[ticket.priority] = max(self._class_pass[ticket.priority], self._global_pass)
+            flow = flows.get(ticket.client)
+            if flow is None:
+                flow = flows[ticket.client] = _Flow(self._flow_pass[ticket.priority])
+            flow.tickets.append(ticket)
+            self._dispatch()
+        return ticket
+
+    def _next(self):
+        waiting = [p for p, flows in self._flows.items() if flows]
+        if not waiting:
+            return None
+        priority = min(waiting, key=lambda p: self._class_pass[p])
+        client = min(self._flows[priority].items(), key=lambda item: item[1].pass_)[0]
+        # Starvation protection: anything that has waited too long goes first, oldest first
+        heads = [flow.tickets[0] for p in waiting for flow in self._flows[p].values()]
+        overdue = min(heads, key=lambda t: t.queued_at)
+        if time.monotonic() - overdue.queued_at >= self.max_wait and (overdue.priority, overdue.client) != (priority, client):
+            self.promoted += 1
+            priority, client = overdue.priority, overdue.client
+
+        self._global_pass = self._class_pass[priority]
+        self._class_pass[priority] += 1 / self.weights[priority]
+        flows = self._flows[priority]
+        flow = flows[client]
+        self._flow_pass[priority] = flow.pass_
+        flow.pass_ += 1
+        ticket = flow.tickets.popleft()
+        if not flow.tickets:
+            del flows[client]
+        return ticket
+
+    def _dispatch(self):
+        while self.busy < self.slots:
+            ticket = self._next()
+            if ticket is None:
+                return
+            self.busy += 1
+            self.granted[ticket.priority] += 1
+            ticket.granted = True
+            ticket.wait = time.monotonic() - ticket.queued_at
+            ticket.grant()
+
+    def _cancel(self, ticket):
+        """Forget a ticket that stopped waiting; False if it already holds a slot"""
+        with self._lock:
+            if ticket.granted:
+                return False
+            flows = self._flows[ticket.priority]
+            flow = flows.get(ticket.client)
+            if flow is not None and ticket in flow.tickets:
+                flow.tickets.remove(ticket)
+                if not flow.tickets:
+                    del flows[ticket.client]
+            return True
+
+    def release(self):
+        with self._lock:
+            self.busy -= 1
+            self._dispatch()
+
+    def acquire(self, priority=None, client=None):
+        """Block until a slot is free; returns the seconds waited. Pair with release()"""
+        ready = threading.Event()
+        ticket = self._enqueue(priority, client, ready.set)
+        try:
+            ready.wait()
+        except BaseException:
+            if not self._cancel(ticket):
+                self.release()
+            raise
+        return self._granted(ticket)
+
+    async def acquire_async(self, priority=None, client=None):
+        """acquire() for coroutines: waiting does not block the event loop"""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def grant():
+            # May run on another thread, under the scheduler lock
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        ticket = self._enqueue(priority, client, grant)
+        try:
+            await ready
+        except BaseException:
+            if not self._cancel(ticket):
+                self.release()
+            raise
+        return self._granted(ticket)
+
+    def _granted(self, ticket):
+        WAIT_SECONDS.observe(ticket.wait, metrics.app_name(), ticket.priority)
+        return ticket.wait
+
+    @contextmanager
+    def slot(self, priority=None, client=None):
+        """Hold a slot for the block; yields the seconds spent waiting for it"""
+        wait = self.acquire(priority, client)
+        try:
+            yield wait
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "busy": self.busy,
+                "promoted": self.promoted,
+                "classes": {p: {
+                    "weight": self.weights[p],
+                    "queued": sum(len(flow.tickets) for flow in self._flows[p].values()),
+                    "clients": len(self._flows[p]),
+                    "granted": self.granted[p],
+                } for p in self.weights},
+            }
+
+
+_schedulers = weakref.WeakSet()
+
+
+def collect_schedulers():
+    stats = [(s.name, s.stats()) for s in list(_schedulers)]
+    return [
+        ("scheduler_queued", "gauge", "Generations waiting for a slot",
+         [({"scheduler": n, "priority": p}, c["queued"]) for n, s in stats for p, c in s["classes"].items()]),
+        ("scheduler_granted_total", "counter", "Slots handed out",
+         [({"scheduler": n, "priority": p}, c["granted"]) for n, s in stats for p, c in s["classes"].items()]),
+        ("scheduler_busy_slots", "gauge", "Slots in use",
+         [({"scheduler": n}, s["busy"]) for n, s in stats]),
+        ("scheduler_promoted_total", "counter", "Requests served early because they waited too long",
+         [({"scheduler": n}, s["promoted"]) for n, s in stats]),
+    ]
+
+
+metrics.REGISTRY.register_collector(collect_schedulers)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide Scheduler every OllamaClient generation goes through"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler()
+    return _scheduler
@@ -0,0 +1,290 @@
+"""
+Semantic prompt cache
+Serves a stored answer when a new prompt means the same thing as an earlier
+one ("a poem about rain" / "write a poem about the rain"). Prompts are
+embedded through Ollama and searched by cosine similarity.
+
+Embeddings live in one contiguous float32 matrix memory-mapped on disk;
+answers and bookkeeping live in an SQLite file next to it. A flat scan over
+100k full-size embeddings reads hundreds of megabytes, so once the cache
+outgrows BRUTE_FORCE_ROWS it is searched through an index instead:
+
+- vectors are projected onto their top REDUCED_DIM principal directions,
+- grouped around k-means centroids in that reduced space (IVF lists),
+- a lookup scores only the rows of the NPROBE nearest centroids, and
+- the best RERANK of those are re-scored exactly against the full matrix.
+
+The index is derived data. It is rebuilt in a background thread whenever the
+cache doubles in size and on startup; lookups scan the matrix until it is ready.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from ollama_client import get_client
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0") == "1"
+CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "bootcamp-genai", "semantic"))
+EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "100000"))
+
+BRUTE_FORCE_ROWS = 1024
+REDUCED_DIM = 128
+NPROBE = 4
+RERANK = 8
+TRAIN_SAMPLE = 20000
+TRAIN_ITERATIONS = 5
+BLOCK = 20000
+
+
+def _namespace_id(namespace):
+    return zlib.crc32(namespace.encode("utf-8"))
+
+
+class _Index:
+    """IVF lists over PCA-reduced vectors"""
+
+    def __init__(self, projection, centroids, capacity):
+        self.projection = projection
+        self.centroids = centroids
+        self.reduced = np.zeros((capacity, projection.shape[1]), dtype=np.float32)
+        self.assign = np.full(capacity, -1, dtype=np.int32)
+        self.lists = [[] for _ in range(len(centroids))]
+
+    @classmethod
+    def train(cls, vectors, size, capacity, nlist):
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(size, min(size, TRAIN_SAMPLE), replace=False))])
+
+        # Uncentered PCA keeps dot products (and so cosine scores) intact
+        _, eigenvectors = np.linalg.eigh(sample.T @ sample)
+        projection = np.ascontiguousarray(eigenvectors[:, ::-1][:, :min(REDUCED_DIM, sample.shape[1])])
+
+        # Spherical k-means in the reduced space
+        reduced = sample @ projection
+        reduced /= np.linalg.norm(reduced, axis=1, keepdims=True) + 1e-12
+        nlist = min(nlist, len(reduced) // 4)
+        centroids = reduced[rng.choice(len(reduced), nlist, replace=False)].copy()
+        for _ in range(TRAIN_ITERATIONS):
+            labels = np.argmax(reduced @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = reduced[labels == i]
+                if len(members):
+                    centroids[i] = members.sum(axis=0)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+
+        index = cls(projection, centroids.astype(np.float32), capacity)
+        for start in range(0, size, BLOCK):
+            index.add_block(start, np.asarray(vectors[start:min(size, start + BLOCK)]))
+        return index
+
+    def add_block(self, start, block):
+        reduced = block @ self.projection
+        clusters = np.argmax(reduced @ self.centroids.T, axis=1)
+        self.reduced[start:start + len(block)] = reduced
+        for row, cluster in enumerate(clusters.tolist(), start):
+            self._move(row, cluster)
+
+    def add(self, row, vector):
+        reduced = vector @ self.projection
+        self.reduced[row] = reduced
+        self._move(row, int(np.argmax(self.centroids @ reduced)))
+
+    def _move(self, row, cluster):
+        if self.assign[row] >= 0:
+            self.lists[self.assign[row]].remove(row)
+        self.assign[row] = cluster
+        self.lists[cluster].append(row)
+
+    def candidates(self, query):
+        """Rows in the nearest lists, plus the reduced query to score them with"""
+        reduced = query @ self.projection
+        nprobe = min(NPROBE, len(self.centroids))
+        probe = np.argpartition(self.centroids @ reduced, -nprobe)[-nprobe:]
+        rows = np.array([row for cluster in probe.tolist() for row in self.lists[cluster]], dtype=np.int64)
+        return rows, reduced
+
+
+class SemanticCache:
+    """Near-duplicate prompt cache over a memory-mapped embedding matrix"""
+
+    def __init__(self, path=CACHE_DIR, capacity=CAPACITY, threshold=THRESHOLD,
+                 embed_model=EMBED_MODEL, client=None):
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self.embed_model = embed_model
+        self.client = client or get_client()
+        self.nlist = max(16, int(2 * np.sqrt(capacity)))
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._embeddings = OrderedDict()
+
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "entries.db"), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            row INTEGER PRIMARY KEY, namespace INTEGER NOT NULL,
+            prompt TEXT NOT NULL, answer TEXT NOT NULL, last_used REAL NOT NULL)""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+
+        self.dim = None
+        self.size = 0
+        self.vectors = None
+        self.index = None
+        self.indexed_size = 0
+        self._training = False
+        self._dirty = set()
+        self.namespaces = np.zeros(capacity, dtype=np.uint32)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self._load()
+
+    def _load(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if row is None:
+            return
+        self.dim = row[0]
+        self.vectors = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32,
+                                 mode="r+", shape=(self.capacity, self.dim))
+        for row, namespace, last_used in self._db.execute(
+                "SELECT row, namespace, last_used FROM entries"):
+            self.namespaces[row] = namespace
+            self.last_used[row] = last_used
+            self.size = max(self.size, row + 1)
+        if self.size > BRUTE_FORCE_ROWS:
+            # Training takes seconds at full size; don't hold up the app that opened the cache
+            self._training = True
+            threading.Thread(target=self._retrain, daemon=True).start()
+
+    def embed(self, text):
+        """Unit-length embedding of `text`, memoized for the last few prompts"""
+        with self._lock:
+            vector = self._embeddings.get(text)
+        if vector is not None:
+            return vector
+        response = self.client.post("/api/embeddings", json={"model": self.embed_model, "prompt": text})
+        response.raise_for_status()
+        vector = np.asarray(response.json()["embedding"], dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._embeddings[text] = vector
+            while len(self._embeddings) > 256:
+                self._embeddings.popitem(last=False)
+        return vector
+
+    def _retrain(self):
+        """Build a fresh index off-lock, then catch up on rows written meanwhile"""
+        size = self.size
+        try:
+            index = _Index.train(self.vectors, size, self.capacity, self.nlist)
+            with self._lock:
+                for row in sorted(self._dirty | set(range(size, self.size))):
+                    index.add(row, np.asarray(self.vectors[row]))
+                self.index = index
+                self.indexed_size = size
+        finally:
+            with self._lock:
+                self._dirty.clear()
+                self._training = False
+
+    def lookup(self, namespace, prompt):
+        """Return the stored answer for a near-duplicate prompt, or None"""
+        try:
+            query = self.embed(prompt)
+        except Exception:
+            # The cache must never break generation; treat it as a miss
+            self.errors += 1
+            return None
+        return self.search(namespace, query)
+
+    def search(self, namespace, query):
+        """Return the stored answer whose prompt embedding is nearest `query`, or None"""
+        with self._lock:
+            if self.size == 0 or query.shape[0] != self.dim:
+                self.misses += 1
+                return None
+            if self.index is None:
+                rows = np.arange(self.size)
+            else:
+                rows, reduced = self.index.candidates(query)
+            rows = rows[self.namespaces[rows] == _namespace_id(namespace)]
+            if self.index is not None and len(rows) > RERANK:
+                approx = self.index.reduced[rows] @ reduced
+                rows = rows[np.argpartition(approx, -RERANK)[-RERANK:]]
+            if len(rows) == 0:
+                self.misses += 1
+                return None
+            scores = self.vectors[rows] @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            row = int(rows[best])
+            now = self.last_used[row] = time.time()
+            self.hits += 1
+        # Persisted so eviction after a restart still follows use, not store time
+        self._db.execute("UPDATE entries SET last_used = ? WHERE row = ?", (now, row))
+        answer = self._db.execute("SELECT answer FROM entries WHERE row = ?", (row,)).fetchone()
+        return answer[0] if answer else None
+
+    def store(self, namespace, prompt, answer):
+        try:
+            vector = self.embed(prompt)
+        except Exception:
+            self.errors += 1
+            return
+        now = time.time()
+        with self._lock:
+            if self.dim is None:
+                self.dim = vector.shape[0]
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (self.dim,))
+                self.vectors = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32,
+                                         mode="w+", shape=(self.capacity, self.dim))
+            if self.size < self.capacity:
+                row = self.size
+                self.size += 1
+            else:
+                # Full: overwrite the least recently used entry
+                row = int(np.argmin(self.last_used))
+            self.vectors[row] = vector
+            self.namespaces[row] = _namespace_id(namespace)
+            self.last_used[row] = now
+            if self.index is not None:
+                self.index.add(row, vector)
+            if self._training:
+                self._dirty.add(row)
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                             (row, int(self.namespaces[row]), prompt, answer, now))
+            # Rebuild the index whenever the cache has doubled since the last build
+            if (not self._training and self.size > BRUTE_FORCE_ROWS
+                    and self.size >= 2 * max(self.indexed_size, BRUTE_FORCE_ROWS // 2)):
+                self._training = True
+                threading.Thread(target=self._retrain, daemon=True).start()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors, "entries": self.size,
+                "indexed": self.index is not None}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the process-wide SemanticCache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache()
+    return _cache
@@ -0,0 +1,82 @@
+"""
+In-memory conversation sessions for the web UI
+Bounded by an LRU cap and an idle TTL so memory stays flat however many
+browsers connect.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+MAX_MESSAGES = 20
+
+
+class Session:
+    """One conversation: its recent messages plus Ollama's returned context"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.model = None
+        self.context = None
+        self.messages = []
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        # Set when the conversation is cleared; a turn still streaming stops
+        self.closed = False
+
+    def add_turn(self, prompt, reply, context, model):
+        """Record a finished turn; the session only changes once a turn has succeeded"""
+        self.messages.append({"role": "user", "content": prompt})
+        self.messages.append({"role": "assistant", "content": reply})
+        del self.messages[:-MAX_MESSAGES]
+        self.context = context
+        self.model = model
+
+    def reset(self):
+        self.model = None
+        self.context = None
+        self.messages = []
+
+
+class SessionStore:
+    """Thread-safe LRU of sessions with idle expiry"""
+
+    def __init__(self, max_sessions=1000, idle_ttl=1800):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id=None):
+        """Return the session for `session_id`, creating it if needed"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(session_id or uuid.uuid4().hex)
+                self._sessions[session.id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session.id)
+            session.last_used = now
+            return session
+
+    def drop(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.closed = True
+
+    def _expire(self, now):
+        # Oldest entries are at the front, so stop at the first live one
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,206 @@
+"""
+Single-flight request coalescing
+Concurrent requests for an identical generation attach to one upstream
+stream instead of each starting their own. Every follower receives all of
+the flight's chunks from the start, however late it joined, and the
+upstream is abandoned once nobody is following it any more.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+from ollama_client import Cancel
+
+
+def flight_key(payload):
+    """Requests with the same model, prompt, context and options share a key"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class Flight:
+    """One upstream generation, buffered so that any number of requests can follow it"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.cancelled = False
+        # Ends the upstream stream once nobody follows, even mid-wait for a chunk
+        self.cancel = Cancel()
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self):
+        """Yield every chunk of the flight; raises the upstream error, if any"""
+        with self._cond:
+            self.followers += 1
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    while seen == len(self.chunks) and not self.done:
+                        self._cond.wait()
+                    batch = self.chunks[seen:]
+                    finished, error = self.done, self.error
+                seen += len(batch)
+                yield from batch
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._cond:
+                self.followers -= 1
+                abandoned = not self.followers and not self.done
+                if abandoned:
+                    self.cancelled = True
+            if abandoned:
+                self.cancel.set()
+
+
+class SingleFlight:
+    """Coalesces identical in-flight generations for threaded servers"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key, start):
+        """Follow the flight for `key`, starting one with `start()` if there is none.
+
+        `start(cancel)` returns an iterator of chunks and runs on a background
+        thread, so the generation carries on if the request that started it
+        goes away while others are still following. `cancel` is the flight's
+        Cancel, set when its last follower leaves; passed on to
+        OllamaClient.stream, it ends the generation and frees its scheduler
+        slot without waiting for the next chunk. Returns (flight, leader).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.cancelled:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+        threading.Thread(target=self._run, args=(key, flight, start), daemon=True).start()
+        return flight, True
+
+    def _run(self, key, flight, start):
+        chunks = None
+        try:
+            chunks = start(flight.cancel)
+            for chunk in chunks:
+                if flight.cancelled:
+                    break
+                flight.publish(chunk)
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+class AsyncFlight:
+    """Flight for the asyncio engine; the producer runs as a task"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.cancelled = False
+        self.task = None
+        self._cond = asyncio.Condition()
+
+    async def publish(self, chunk):
+        async with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def finish(self, error=None):
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    async def follow(self):
+        self.followers += 1
+        seen = 0
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: seen < len(self.chunks) or self.done)
+                    batch = self.chunks[seen:]
+                    finished, error = self.done, self.error
+                seen += len(batch)
+                for chunk in batch:
+                    yield chunk
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done and self.task is not None:
+                # Nobody is left to read it; stop the producer and its upstream request
+                self.cancelled = True
+                self.task.cancel()
+
+
+class AsyncSingleFlight:
+    """Coalesces identical in-flight generations on one event loop"""
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key, produce):
+        """Follow the flight for `key`; `produce(flight)` is awaited as its producer task"""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.cancelled:
+            self.coalesced += 1
+            return flight, False
+        flight = self._flights[key] = AsyncFlight()
+        self.leaders += 1
+        flight.task = asyncio.ensure_future(self._run(key, flight, produce))
+        return flight, True
+
+    async def _run(self, key, flight, produce):
+        try:
+            await produce(flight)
+            await flight.finish()
+        except asyncio.CancelledError:
+            flight.done = True
+            raise
+        except Exception as e:
+            await flight.finish(e)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
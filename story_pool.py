@@ -0,0 +1,170 @@
+"""
+Pre-generated story pool for ruskin_stories.py
+A background worker keeps a few distinct stories ready for each preset
+theme, so a click on a preset is served at once. Refills only run while no
+interactive request is in flight in this process, one at a time and within
+an hourly budget, and are abandoned as soon as interactive traffic shows up.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import closing
+
+from model_residency import KEEP_ALIVE
+from ollama_client import get_client
+from prompts import story_prompt
+
+POOL_SIZE = int(os.getenv("STORY_POOL_SIZE", "3"))
+# Where to keep the pool across restarts; empty keeps it in memory only
+POOL_PATH = os.getenv("STORY_POOL_PATH", "")
+# Background generations allowed per hour
+POOL_BUDGET = int(os.getenv("STORY_POOL_BUDGET", "30"))
+# How long interactive traffic must have been quiet before a refill starts
+IDLE_SECONDS = 5
+POLL_SECONDS = 1
+
+
+class StoryPool:
+    """Ready-made stories per theme, refilled in the background when Ollama is idle"""
+
+    def __init__(self, themes, model, options, size=POOL_SIZE, path=POOL_PATH, budget=POOL_BUDGET):
+        self.themes = list(themes)
+        self.model = model
+        self.options = options
+        self.size = size
+        self.path = path
+        self.budget = budget
+        self.stories = {theme: deque() for theme in self.themes}
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.abandoned = 0
+        self._spent = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for theme in self.themes:
+            self.stories[theme].extend(saved.get(theme, [])[:self.size])
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {theme: list(stories) for theme, stories in self.stories.items()}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def pop(self, theme):
+        """A ready story for `theme`, or None if the pool for it is empty"""
+        with self._lock:
+            stories = self.stories.get(theme)
+            story = stories.popleft() if stories else None
+            if story is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if story is not None:
+            self._save()
+        self._wake.set()
+        return story
+
+    def _neediest_theme(self):
+        with self._lock:
+            theme = min(self.themes, key=lambda t: len(self.stories[t]))
+            return theme if len(self.stories[theme]) < self.size else None
+
+    def _within_budget(self):
+        now = time.monotonic()
+        while self._spent and now - self._spent[0] > 3600:
+            self._spent.popleft()
+        return len(self._spent) < self.budget
+
+    def _generate(self, theme):
+        """One story, or None if interactive traffic arrived while it was being written"""
+        payload = {"model": self.model, "prompt": story_prompt(theme), "options": self.options,
+                   "keep_alive": KEEP_ALIVE}
+        parts = []
+        # The shared client, so that with OLLAMA_HOSTS set this goes through the
+        # balancer too; as "prefetch" it gets the smallest share of scheduler slots
+        client = get_client()
+        with closing(client.stream("/api/generate", payload, priority="prefetch")) as chunks:
+            for chunk in chunks:
+                # This stream is in flight itself; anything more is interactive
+                if client.in_flight > 1:
+                    # Leaving closes the stream and frees the backend for the user
+                    return None
+                if chunk.get("error"):
+                    return None
+                parts.append(chunk.get("response", ""))
+        return "".join(parts).strip()
+
+    def _run(self):
+        quiet_since = time.monotonic()
+        while True:
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+            if get_client().in_flight:
+                quiet_since = time.monotonic()
+                continue
+            theme = self._neediest_theme()
+            if theme is None or time.monotonic() - quiet_since < IDLE_SECONDS or not self._within_budget():
+                continue
+            self._spent.append(time.monotonic())
+            try:
+                story = self._generate(theme)
+            except Exception:
+                story = None
+            if not story:
+                self.abandoned += 1
+                quiet_since = time.monotonic()
+                continue
+            with self._lock:
+                # Temperature 0.8 rarely repeats itself, but keep the pool distinct
+                if story not in self.stories[theme]:
+                    self.stories[theme].append(story)
+                    self.generated += 1
+            self._save()
+
+    def start(self):
+        """Refill in the background from now on"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {"ready": {theme: len(stories) for theme, stories in self.stories.items()},
+                    "hits": self.hits, "misses": self.misses,
+                    "generated": self.generated, "abandoned": self.abandoned}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_story_pool(themes, model, options):
+    """Return the process-wide StoryPool, started on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = StoryPool(themes, model, options).start()
+    return _pool
@@ -0,0 +1,82 @@
+"""
+Incremental Streamlit writer
+Renders a response into a single placeholder while its tokens arrive,
+redrawing at most every RENDER_INTERVAL seconds instead of once per token.
+"""
+
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+import metrics
+
+# Each redraw re-sends the whole text to the browser, so per-token redraws
+# of a 1000-token answer would cost O(n^2) bytes
+RENDER_INTERVAL = 0.1
+CURSOR = "▌"
+
+
+def render_markdown(placeholder, text):
+    placeholder.markdown(text)
+
+
+class StreamWriter:
+    """Accumulates streamed tokens and redraws a placeholder at a throttled rate"""
+
+    def __init__(self, placeholder=None, render=render_markdown, interval=RENDER_INTERVAL, cursor=CURSOR):
+        self.placeholder = placeholder if placeholder is not None else st.empty()
+        self.render = render
+        self.interval = interval
+        self.cursor = cursor
+        self.parts = []
+        self._last_render = 0.0
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def write(self, token):
+        """Append a token; redraws only if the last redraw is old enough"""
+        if not token:
+            return
+        self.parts.append(token)
+        now = time.monotonic()
+        if now - self._last_render >= self.interval:
+            self._last_render = now
+            self.render(self.placeholder, self.text + self.cursor)
+
+    def close(self, text=None):
+        """Draw the final text (or `text` in its place) and return it"""
+        if text is not None:
+            self.parts = [text]
+        final = self.text
+        self.render(self.placeholder, final)
+        return final
+
+
+@contextmanager
+def stop_with_script(stream, model, writer):
+    """Close `stream` if Streamlit stops the script mid-generation.
+
+    A rerun (any widget interaction) or Stop raises a BaseException out of
+    the next Streamlit call; closing the stream then closes the upstream
+    request instead of leaving Ollama generating for nobody. Streams from
+    OllamaClient.stream only need closing(); the client records those.
+    """
+    try:
+        yield stream
+    except Exception:
+        raise
+    except BaseException:
+        stream.close()
+        metrics.record_cancel(model, len(writer.parts))
+        raise
+
+
+def write_stream(tokens, **kwargs):
+    """Render an iterable of text chunks incrementally and return the full text"""
+    writer = StreamWriter(**kwargs)
+    for token in tokens:
+        writer.write(token)
+    return writer.close()
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The apps are top-level scripts, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_stub_server  # noqa: E402
+
+
+@pytest.fixture
+def stubs():
+    """Start `count` stub Ollama servers, shut down after the test"""
+    servers = []
+
+    def start(count, **settings):
+        settings.setdefault("ttft", 0.0)
+        settings.setdefault("tokens", 3)
+        settings.setdefault("tokens_per_second", 0)
+        servers.extend(bench_stub_server.start(**settings) for _ in range(count))
+        return servers[-count:]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,26 @@
+import sqlite3
+
+from chat_history import ChatHistory
+
+
+def test_conversations_are_found_by_token_and_app_only(tmp_path):
+    history = ChatHistory(str(tmp_path / "history.db"))
+    conversation, token = history.new_conversation("chatbot")
+    _, other = history.new_conversation("chatbot")
+    assert token != other and len(token) >= 20
+    assert history.find(token, "chatbot") == conversation
+    assert history.find(token, "gemini_chat") is None
+    # Ids stay on the server; a guessed one finds nothing
+    assert history.find(str(conversation), "chatbot") is None
+
+
+def test_files_from_before_tokens_are_upgraded(tmp_path):
+    path = str(tmp_path / "history.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE conversations (id INTEGER PRIMARY KEY, app TEXT NOT NULL, created REAL NOT NULL)")
+    db.execute("INSERT INTO conversations (app, created) VALUES ('chatbot', 1)")
+    db.commit()
+    db.close()
+    history = ChatHistory(path)
+    conversation, token = history.new_conversation("chatbot")
+    assert history.find(token, "chatbot") == conversation == 2
@@ -0,0 +1,148 @@
+import textwrap
+import time
+
+import bench_stub_server
+import code_completion
+import ollama_client
+from code_completion import FenceParser, complete_holes, find_holes, is_valid_code
+from scheduler import get_scheduler
+
+ANSWER = "Here you go:\n```python\ndef add(a, b):\n    return a + b\n```\nThis adds two numbers."
+
+SOURCE = textwrap.dedent('''\
+    import math
+
+
+    def add(a, b):
+        """Sum of a and b"""
+        ...
+
+
+    class Circle:
+        def __init__(self,
+                     radius):
+            self.radius = radius
+
+        def area(self):
+            # TODO: use math.pi
+            pass
+
+
+    def untouched():
+        return 1
+    ''')
+
+
+def feed(parser, text):
+    """Feed `text` a character at a time; the index it closed at, or None"""
+    for i, char in enumerate(text):
+        if parser.feed(char):
+            return i
+    return None
+
+
+def test_fence_parser_stops_at_the_closing_fence():
+    parser = FenceParser()
+    closed_at = feed(parser, ANSWER)
+    assert closed_at == ANSWER.rindex("```") + 2
+    assert parser.code == "def add(a, b):\n    return a + b"
+
+
+def test_fence_parser_waits_for_the_language_tag_of_an_opening_fence():
+    parser = FenceParser()
+    assert feed(parser, "```python") is None
+    assert not parser.opened
+    assert feed(parser, "\nx = 1\n  ```") is not None
+
+
+def test_fence_parser_without_a_fence_keeps_all_the_text():
+    parser = FenceParser()
+    assert feed(parser, "x = 1\n") is None
+    assert parser.code == "x = 1"
+
+
+def test_is_valid_code():
+    assert is_valid_code(ANSWER, "python")
+    assert not is_valid_code("```python\ndef add(a, b):\n", "python")
+    assert not is_valid_code("```python\ndef add(a, b) return\n```", "python")
+    assert is_valid_code("```js\nconst x = ;\n```", "javascript")
+    # Without a fence, only Python can be told from prose
+    assert is_valid_code("def add(a, b):\n    return a + b", "python")
+    assert not is_valid_code("Sorry, I can't help with that.", "javascript")
+
+
+def test_find_holes_finds_stubs_and_todos_with_their_context():
+    holes = find_holes(SOURCE, "python")
+    assert [(h.name, h.start, h.end) for h in holes] == [("add", 3, 6), ("area", 13, 16)]
+    add, area = holes
+    assert add.params == (["a", "b"], None, [], None)
+    assert "import math" in add.context
+    # The enclosing class and its other methods, multi-line signatures included
+    assert "class Circle:" in area.context
+    assert "def __init__(self,\n                 radius): ..." in area.context
+    # Other functions by signature only
+    assert "def untouched(): ..." in area.context
+    assert "return 1" not in area.context
+
+
+def test_find_holes_falls_back_to_windows_around_todos():
+    code = "\n".join(["int main() {"] + ["  x++;"] * 30 + ["  // TODO: return"] + ["}"])
+    (hole,) = find_holes(code, "c")
+    assert hole.name is None
+    # Clipped at the end of the file
+    assert (hole.start, hole.end) == (31 - code_completion.WINDOW_LINES, 33)
+
+
+def complete_with(monkeypatch, answers):
+    """complete_holes(SOURCE) with the model answering `answers["add"]` and `answers["area"]`"""
+    def stream_completion(model, prompt, options, cancel=None, on_token=None):
+        # The other holes only appear in a prompt's context as signatures, and add's not at all
+        return answers["area" if "def area" in prompt else "add"]
+
+    monkeypatch.setattr(code_completion, "stream_completion", stream_completion)
+    return complete_holes(SOURCE, "python", "model", {})
+
+
+def test_complete_holes_splices_whole_functions_and_bodies(monkeypatch):
+    code, holes, completed = complete_with(monkeypatch, {
+        "add": ANSWER,
+        # Only a body, without the method's indentation
+        "area": "```python\nreturn math.pi * self.radius ** 2\n```",
+    })
+    assert (holes, completed) == (2, 2)
+    assert "def add(a, b):\n    return a + b\n" in code
+    assert "    def area(self):\n        return math.pi * self.radius ** 2\n" in code
+    assert code.endswith("def untouched():\n    return 1")
+    compile(code, "<completed>", "exec")
+
+
+def test_complete_holes_keeps_the_original_for_unusable_answers(monkeypatch):
+    code, holes, completed = complete_with(monkeypatch, {
+        # Another function's definition, and code that doesn't parse
+        "add": "```python\ndef subtract(a, b):\n    return a - b\n```",
+        "area": "```python\nreturn math.pi *\n```",
+    })
+    assert (holes, completed) == (2, 0)
+    assert code == SOURCE.rstrip("\n")
+
+
+def test_race_shuts_down_losers_still_loading(monkeypatch):
+    server = bench_stub_server.start(load_delay=5, ttft=0.0, tokens_per_second=0, replay=None,
+                                     models=("tinyllama:latest", "qwen2.5:0.5b"))
+    try:
+        # Only tinyllama is loaded; qwen would take seconds to answer
+        server.loaded.add("tinyllama:latest")
+        monkeypatch.setattr(ollama_client, "_client", ollama_client.OllamaClient(server.url))
+        monkeypatch.setattr(code_completion, "is_valid_code", lambda text, language: bool(text))
+        started = time.perf_counter()
+        result = code_completion.race(["qwen2.5:0.5b", "tinyllama"], "def f():", {}, "python")
+        assert result["model"] == "tinyllama"
+        # The loser gave its scheduler slot back without waiting for its model
+        deadline = time.monotonic() + 2
+        while get_scheduler().busy and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert get_scheduler().busy == 0
+        assert time.perf_counter() - started < 2
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,19 @@
+import json
+from itertools import count
+
+from model_catalog import ModelCatalog
+
+
+def test_every_refresh_reaches_the_snapshot():
+    catalog = ModelCatalog(ttl=3600, path="", client=object())
+    names = count()
+    catalog._fetchers["ollama"] = lambda: [{"name": f"model-{next(names)}"}]
+    etags = set()
+    for _ in range(50):
+        # Two refreshes: the second listing may reuse the memory of the first
+        catalog.refresh("ollama")
+        catalog.refresh("ollama")
+        etag, body, _ = catalog.snapshot(["ollama"])
+        assert json.loads(body)["models"] == catalog.list("ollama")
+        etags.add(etag)
+    assert len(etags) == 50
@@ -0,0 +1,36 @@
+from model_residency import ResidencyManager
+from ollama_balancer import BalancedClient
+
+
+def manager_over(servers, **kwargs):
+    client = BalancedClient([s.url for s in servers], backoff=0)
+    client.check_all()
+    return ResidencyManager(client, **kwargs)
+
+
+def test_preload_loads_each_backend_and_tracks_them_apart(stubs):
+    servers = stubs(2)
+    manager = manager_over(servers, models=["tinyllama"])
+    manager.preload()
+    assert all("tinyllama:latest" in s.loaded for s in servers)
+    resident = manager.refresh()
+    assert {url: set(models) for url, models in resident.items()} == {s.url: {"tinyllama:latest"} for s in servers}
+
+
+def test_only_backends_that_dropped_a_hot_model_reload_it(stubs):
+    kept, dropped = stubs(2)
+    kept.loaded.add("tinyllama:latest")
+    manager = manager_over([kept, dropped], models=[])
+    manager.touch("tinyllama")
+    manager.refresh()
+    manager._repin_hot()
+    assert kept.requests.get("/api/generate", 0) == 0
+    assert dropped.requests["/api/generate"] == 1
+    assert "tinyllama:latest" in dropped.loaded
+
+
+def test_unreachable_backends_are_left_out(stubs):
+    (server,) = stubs(1)
+    client = BalancedClient([server.url, "http://127.0.0.1:9"], backoff=0, max_retries=0)
+    manager = ResidencyManager(client, models=[])
+    assert list(manager.refresh()) == [server.url]
@@ -0,0 +1,138 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bench_stub_server
+from ollama_balancer import BalancedClient
+from ollama_client import Cancel
+from scheduler import get_scheduler
+
+
+def balanced(*servers, **kwargs):
+    return BalancedClient([getattr(s, "url", s) for s in servers], backoff=0, **kwargs)
+
+
+def generate(client, model="tinyllama"):
+    response = client.post("/api/generate", json={"model": model, "prompt": "hi", "stream": False})
+    response.raise_for_status()
+    return response.json()
+
+
+def dead_url():
+    # A port that was just free: connections to it are refused
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.server_close()
+    return url
+
+
+class _Failing(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_health_check_records_models_and_marks_unreachable_backends_down(stubs):
+    a, b = stubs(2, models=("tinyllama:latest", "qwen2.5:0.5b"))
+    b.loaded.add("qwen2.5:0.5b")
+    client = balanced(a, b, dead_url())
+    client.check_all()
+    stats = list(client.stats().values())
+    assert [s["healthy"] for s in stats] == [True, True, False]
+    assert stats[0]["models"] == ["qwen2.5:0.5b", "tinyllama:latest"]
+    assert stats[1]["resident"] == ["qwen2.5:0.5b"]
+    assert stats[2]["failures"] == 1
+    assert a.requests["/api/tags"] == a.requests["/api/ps"] == 1
+
+
+def test_routes_only_to_backends_that_have_the_model(stubs):
+    a, b = stubs(1, models=("tinyllama:latest",)) + stubs(1, models=("qwen2.5:0.5b",))
+    client = balanced(a, b)
+    client.check_all()
+    for _ in range(4):
+        generate(client, "qwen2.5:0.5b")
+    assert "/api/generate" not in a.requests
+    assert b.requests["/api/generate"] == 4
+
+
+def test_connection_error_fails_over_and_marks_the_backend_down():
+    server = bench_stub_server.start(ttft=0.0, tokens=3, tokens_per_second=0)
+    try:
+        client = balanced(dead_url(), server, max_retries=1)
+        # Unchecked backends are all candidates; make sure the dead one is tried first
+        client.backends[1].outstanding = 5
+        assert generate(client)["done"]
+        dead, alive = client.backends
+        assert not dead.healthy and dead.failures == 1
+        assert alive.healthy and server.requests["/api/generate"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_server_error_fails_over_to_the_next_backend(stubs):
+    failing = ThreadingHTTPServer(("127.0.0.1", 0), _Failing)
+    threading.Thread(target=failing.serve_forever, daemon=True).start()
+    try:
+        (server,) = stubs(1)
+        client = balanced(f"http://127.0.0.1:{failing.server_address[1]}", server, max_retries=1)
+        client.backends[1].outstanding = 5
+        assert generate(client)["done"]
+        assert server.requests["/api/generate"] == 1
+        assert all(b.outstanding in (0, 5) for b in client.backends)
+    finally:
+        failing.shutdown()
+        failing.server_close()
+
+
+def test_picks_the_backend_with_fewest_outstanding_requests(stubs):
+    client = balanced(*stubs(3))
+    client.check_all()
+    a, b, c = client.backends
+    a.outstanding, b.outstanding, c.outstanding = 3, 1, 2
+    assert client.pick() is b
+    # A backend with the model loaded counts as AFFINITY_BONUS requests less busy
+    c.resident.add("tinyllama:latest")
+    assert client.pick("tinyllama") is c
+    assert client.pick("tinyllama", exclude=[c]) is b
+
+
+def test_open_streams_count_as_outstanding_until_closed(stubs, monkeypatch):
+    # Each open stream holds a scheduler slot
+    monkeypatch.setattr(get_scheduler(), "slots", 9)
+    servers = stubs(3, tokens=50, tokens_per_second=20)
+    client = balanced(*servers)
+    client.check_all()
+    streams = []
+    for i in range(9):
+        stream = client.stream("/api/generate", {"model": f"model-{i}", "prompt": "hi"})
+        next(stream)
+        streams.append(stream)
+    # Nine different models, nothing resident: three open streams per backend
+    assert [b.outstanding for b in client.backends] == [3, 3, 3]
+    assert [s.requests["/api/generate"] for s in servers] == [3, 3, 3]
+    for stream in streams:
+        stream.close()
+    assert [b.outstanding for b in client.backends] == [0, 0, 0]
+
+
+def test_cancelled_stream_leaves_its_backend_healthy(stubs):
+    (server,) = stubs(1, load_delay=5)
+    client = balanced(server)
+    client.check_all()
+    cancel = Cancel()
+    chunks = []
+    # Still loading the model, so no response has arrived yet
+    reader = threading.Thread(target=lambda: chunks.extend(
+        client.stream("/api/generate", {"model": "tinyllama", "prompt": "hi"}, cancel=cancel)))
+    reader.start()
+    time.sleep(0.2)
+    cancel.set()
+    reader.join(1)
+    assert not reader.is_alive() and chunks == []
+    (backend,) = client.backends
+    assert backend.healthy and backend.failures == 0 and backend.outstanding == 0
@@ -0,0 +1,40 @@
+import metrics
+from response_cache import ResponseCache
+
+
+def lookups():
+    return {labels[1]: value for labels, value in metrics.CACHE_LOOKUPS.values.items()
+            if labels[0] == metrics.app_name()}
+
+
+def test_hits_come_from_memory_then_disk_and_are_counted(tmp_path):
+    path = str(tmp_path / "responses.db")
+    before = lookups()
+    cache = ResponseCache(path)
+    assert cache.get("m", "p", {"temperature": 0}) is None
+    cache.put("m", "p", {"temperature": 0}, "answer")
+    assert cache.get("m", "p", {"temperature": 0}) == "answer"
+    # Another process only has the disk tier
+    assert ResponseCache(path).get("m", "p", {"temperature": 0}) == "answer"
+    after = lookups()
+    assert {tier: after.get(tier, 0) - before.get(tier, 0) for tier in ("memory", "disk", "miss")} == \
+        {"memory": 1, "disk": 1, "miss": 1}
+    assert cache.stats() == {"hits": 1, "misses": 1, "memory_entries": 1, "entries": 1}
+
+
+def test_options_are_part_of_the_key(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.db"))
+    cache.put("m", "p", {"temperature": 0}, "answer")
+    assert cache.get("m", "p", {"temperature": 0, "num_predict": 10}) is None
+    assert cache.get("other", "p", {"temperature": 0}) is None
+
+
+def test_expired_and_excess_entries_are_dropped(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.db"), memory_entries=1, max_entries=2, ttl=60)
+    for prompt in ("a", "b", "c"):
+        cache.put("m", prompt, None, prompt.upper())
+    assert cache.stats()["entries"] == 2
+    assert cache.get("m", "a") is None
+    assert cache.get("m", "c") == "C"
+    cache.ttl = 0
+    assert cache.get("m", "c") is None
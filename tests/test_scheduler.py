@@ -0,0 +1,80 @@
+import asyncio
+
+from scheduler import Scheduler
+
+WEIGHTS = {"interactive": 4, "batch": 1}
+
+
+def grant_order(scheduler, requests):
+    """(priority, client) of each request, in the order the scheduler grants them one slot at a time"""
+    order = []
+
+    async def run():
+        async def one(priority, client):
+            await scheduler.acquire_async(priority, client)
+            order.append((priority, client))
+            scheduler.release()
+
+        # Hold the only slot until everything is queued
+        scheduler.acquire()
+        tasks = [asyncio.ensure_future(one(priority, client)) for priority, client in requests]
+        await asyncio.sleep(0.01)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    return order
+
+
+def test_classes_share_the_slot_by_weight():
+    scheduler = Scheduler(slots=1, weights=WEIGHTS, max_wait=60)
+    order = grant_order(scheduler, [("batch", None)] * 10 + [("interactive", None)] * 10)
+    first = [priority for priority, _ in order[:10]]
+    assert first.count("interactive") == 8
+    assert first.count("batch") == 2
+    assert scheduler.stats()["classes"]["batch"]["granted"] == 10
+
+
+def test_clients_take_turns_within_a_class():
+    scheduler = Scheduler(slots=1, weights=WEIGHTS, max_wait=60)
+    order = grant_order(scheduler, [("interactive", "a")] * 3 + [("interactive", "b")] * 2)
+    assert [client for _, client in order] == ["a", "b", "a", "b", "a"]
+
+
+def test_requests_waiting_too_long_go_first():
+    scheduler = Scheduler(slots=1, weights=WEIGHTS, max_wait=0)
+    order = grant_order(scheduler, [("batch", None)] * 3 + [("interactive", None)] * 3)
+    # Everything is overdue at once, so it's first come, first served
+    assert [priority for priority, _ in order] == ["batch"] * 3 + ["interactive"] * 3
+    assert scheduler.promoted
+
+
+def test_resize_grants_waiting_requests():
+    scheduler = Scheduler(slots=1, weights=WEIGHTS, max_wait=60)
+    scheduler.acquire()
+
+    async def run():
+        waiter = asyncio.ensure_future(scheduler.acquire_async("batch"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        scheduler.resize(2)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+    assert scheduler.stats()["busy"] == 2
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    scheduler = Scheduler(slots=1, weights=WEIGHTS, max_wait=60)
+    scheduler.acquire()
+
+    async def run():
+        waiter = asyncio.ensure_future(scheduler.acquire_async("batch"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert scheduler.stats()["classes"]["batch"]["queued"] == 0
+    scheduler.release()
+    assert scheduler.stats()["busy"] == 0
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import semantic_cache
+from semantic_cache import SemanticCache
+
+DIM = 768  # nomic-embed-text
+
+
+def fill(path, vectors, capacity, last_used=1.0):
+    """Write a cache directory as SemanticCache leaves it, without embedding anything"""
+    db = sqlite3.connect(os.path.join(path, "entries.db"))
+    db.execute("""CREATE TABLE entries (
+        row INTEGER PRIMARY KEY, namespace INTEGER NOT NULL,
+        prompt TEXT NOT NULL, answer TEXT NOT NULL, last_used REAL NOT NULL)""")
+    db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)")
+    db.execute("INSERT INTO meta VALUES ('dim', ?)", (vectors.shape[1],))
+    namespace = semantic_cache._namespace_id("poetry")
+    db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                   ((row, namespace, f"prompt {row}", f"answer {row}", last_used) for row in range(len(vectors))))
+    db.commit()
+    db.close()
+    matrix = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="w+", shape=(capacity, vectors.shape[1]))
+    matrix[:len(vectors)] = vectors
+    matrix.flush()
+
+
+def unit_vectors(rng, n, dim=DIM):
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def wait_for_index(cache, timeout=120):
+    deadline = time.monotonic() + timeout
+    while cache.index is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert cache.index is not None
+
+
+def near(rng, vector):
+    query = vector + 0.01 * rng.standard_normal(vector.shape, dtype=np.float32)
+    return query / np.linalg.norm(query)
+
+
+def test_index_trains_in_background_and_lookups_scan_meanwhile(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = unit_vectors(rng, 4 * semantic_cache.BRUTE_FORCE_ROWS)
+    fill(tmp_path, vectors, capacity=len(vectors))
+    cache = SemanticCache(str(tmp_path), capacity=len(vectors), client=object())
+    # Served by a flat scan if the index isn't ready yet
+    assert cache.search("poetry", near(rng, vectors[7])) == "answer 7"
+    wait_for_index(cache)
+    assert cache.search("poetry", near(rng, vectors[9])) == "answer 9"
+    assert cache.search("stories", near(rng, vectors[9])) is None
+
+
+def test_hits_persist_last_used(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = unit_vectors(rng, 64)
+    fill(tmp_path, vectors, capacity=64)
+    cache = SemanticCache(str(tmp_path), capacity=64, client=object())
+    assert cache.search("poetry", near(rng, vectors[3])) == "answer 3"
+    reopened = SemanticCache(str(tmp_path), capacity=64, client=object())
+    # The entry just used is no longer the eviction candidate after a restart
+    assert reopened.last_used[3] > 1.0
+    assert int(np.argmin(reopened.last_used[:64])) != 3
+
+
+class Reads:
+    """Stands in for the embedding matrix, recording which rows a lookup reads"""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.rows = []
+
+    def __getitem__(self, rows):
+        self.rows.extend(np.atleast_1d(rows).tolist())
+        return self.matrix[rows]
+
+
+def test_indexed_lookup_scores_only_the_probed_lists(tmp_path):
+    rng = np.random.default_rng(3)
+    size = 4 * semantic_cache.BRUTE_FORCE_ROWS
+    vectors = unit_vectors(rng, size)
+    fill(tmp_path, vectors, capacity=size)
+    cache = SemanticCache(str(tmp_path), capacity=size, client=object())
+    wait_for_index(cache)
+    query = near(rng, vectors[11])
+    rows, _ = cache.index.candidates(query)
+    # What keeps a lookup fast at any size: a few lists are scored, not the whole cache
+    assert 11 in rows and len(rows) < size // 8
+    cache.vectors = Reads(cache.vectors)
+    assert cache.search("poetry", query) == "answer 11"
+    # Only the best few candidates are re-scored against full-size embeddings
+    assert 0 < len(cache.vectors.rows) <= semantic_cache.RERANK
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from ollama_client import OllamaClient
+from scheduler import get_scheduler
+from singleflight import SingleFlight, flight_key
+
+
+def endless(closed):
+    """An upstream stream that only ends when it is closed"""
+    try:
+        i = 0
+        while True:
+            yield i
+            i += 1
+            time.sleep(0.005)
+    finally:
+        closed.set()
+
+
+def test_identical_payloads_share_a_key():
+    assert flight_key({"model": "m", "prompt": "p"}) == flight_key({"prompt": "p", "model": "m"})
+    assert flight_key({"model": "m", "prompt": "p"}) != flight_key({"model": "m", "prompt": "q"})
+
+
+def test_followers_get_every_chunk_from_the_start():
+    group = SingleFlight()
+    release = threading.Event()
+
+    def start(cancel):
+        yield "a"
+        release.wait(1)
+        yield "b"
+
+    leader, led = group.join("k", start)
+    follower, followed = group.join("k", start)
+    assert led and not followed and follower is leader
+    release.set()
+    assert list(leader.follow()) == list(follower.follow()) == ["a", "b"]
+    assert group.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 1}
+
+
+def test_upstream_errors_reach_every_follower():
+    group = SingleFlight()
+
+    def start(cancel):
+        yield "a"
+        raise RuntimeError("upstream")
+
+    flight, _ = group.join("k", start)
+    chunks = flight.follow()
+    assert next(chunks) == "a"
+    try:
+        next(chunks)
+    except RuntimeError as e:
+        assert str(e) == "upstream"
+    else:
+        raise AssertionError("the upstream error was swallowed")
+
+
+def test_upstream_keeps_going_while_anyone_follows():
+    group = SingleFlight()
+    closed = threading.Event()
+    flight, _ = group.join("k", lambda cancel: endless(closed))
+    first, second = flight.follow(), flight.follow()
+    next(first), next(second)
+    first.close()
+    assert not flight.cancelled
+    assert next(second) is not None
+    assert not closed.wait(0.05)
+    second.close()
+
+
+def test_upstream_is_closed_once_the_last_follower_leaves():
+    group = SingleFlight()
+    closed = threading.Event()
+    flight, _ = group.join("k", lambda cancel: endless(closed))
+    chunks = flight.follow()
+    next(chunks)
+    chunks.close()
+    assert flight.cancelled
+    assert closed.wait(1)
+    # A cancelled flight is never joined again; the next request starts afresh
+    _, led = group.join("k", lambda cancel: iter(["x"]))
+    assert led
+
+
+def test_an_abandoned_flight_frees_its_slot_without_waiting_for_a_chunk(stubs):
+    # A token every 3 s: the flight would otherwise notice only at the next one
+    (server,) = stubs(1, tokens=5, tokens_per_second=1 / 3)
+    client = OllamaClient(server.url)
+    group = SingleFlight()
+    flight, _ = group.join("k", lambda cancel: client.stream(
+        "/api/generate", {"model": "tinyllama", "prompt": "hi"}, cancel=cancel))
+    chunks = flight.follow()
+    next(chunks)
+    chunks.close()
+    deadline = time.monotonic() + 1
+    while get_scheduler().busy and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert get_scheduler().busy == 0
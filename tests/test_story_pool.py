@@ -0,0 +1,21 @@
+import ollama_client
+from ollama_balancer import BalancedClient
+from story_pool import StoryPool
+
+
+def test_refills_go_through_the_balancer(stubs, monkeypatch):
+    servers = stubs(2)
+    monkeypatch.setattr(ollama_client, "_client", BalancedClient([s.url for s in servers], backoff=0))
+    pool = StoryPool(["rain"], "tinyllama", {}, path="")
+    assert pool._generate("rain")
+    assert sum(s.requests.get("/api/generate", 0) for s in servers) == 1
+
+
+def test_a_refill_gives_way_to_interactive_requests(stubs, monkeypatch):
+    (server,) = stubs(1, tokens=50)
+    client = ollama_client.OllamaClient(server.url)
+    monkeypatch.setattr(ollama_client, "_client", client)
+    pool = StoryPool(["rain"], "tinyllama", {}, path="")
+    # Someone else's request is in flight on the shared client
+    monkeypatch.setattr(client, "in_flight", 1)
+    assert pool._generate("rain") is None